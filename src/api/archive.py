@@ -0,0 +1,31 @@
+"""
+アーカイブコマンド
+
+長期間更新されていないファイルを追記専用のパックファイルへ移す。
+移したファイルは GET /files/{file_id} から引き続き取得できる。
+
+使い方:
+    python -m src.api.archive --days 180
+"""
+
+import argparse
+import json
+from typing import List, Optional
+
+from .services.archive_service import archive_service
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """コマンドラインエントリーポイント"""
+    parser = argparse.ArgumentParser(description="更新されていないファイルのパックファイルへのアーカイブ")
+    parser.add_argument("--days", type=int, default=180,
+                        help="この日数以上更新されていないファイルを対象にする")
+    parser.add_argument("--batch-size", type=int, default=100, help="1回に取得するファイル数")
+    args = parser.parse_args(argv)
+
+    result = archive_service.archive_cold_files(args.days, batch_size=args.batch_size)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
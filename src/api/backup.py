@@ -0,0 +1,33 @@
+"""
+バックアップコマンド
+
+サービスを止めずに DB・アップロードされたPDF・Markdown・アーカイブの
+スナップショットを作成する。
+
+使い方:
+    python -m src.api.backup
+    python -m src.api.backup --backup-dir /mnt/backups --pages 512 --pause 0.01
+"""
+
+import argparse
+import json
+from typing import List, Optional
+
+from .services.backup_service import BackupService
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """コマンドラインエントリーポイント"""
+    parser = argparse.ArgumentParser(description="DB・ファイルのオンラインスナップショット")
+    parser.add_argument("--backup-dir", default=None, help="スナップショットの保存先（デフォルト: data/backups）")
+    parser.add_argument("--name", default=None, help="スナップショット名（デフォルト: 作成日時）")
+    parser.add_argument("--pages", type=int, default=256, help="DBを1ステップでコピーするページ数")
+    parser.add_argument("--pause", type=float, default=0.0, help="DBのコピーのステップ間の待ち時間（秒）")
+    args = parser.parse_args(argv)
+
+    service = BackupService(args.backup_dir, pages=args.pages, pause_seconds=args.pause)
+    print(json.dumps(service.create_snapshot(args.name), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Markdown本文の圧縮コマンド
+
+非圧縮で保存されている既存の本文を少しずつ圧縮する。また、保存済みの本文から
+zstd 辞書を学習する。APIや変換ワーカーを動かしたまま実行できる。
+
+使い方:
+    python -m src.api.compress_markdown compress --batch-size 200 --pause 0.1
+    python -m src.api.compress_markdown train --samples 2000
+        （表示された辞書IDを MARKDOWN_ZSTD_DICT_ID に設定すると新しい本文に使われる）
+"""
+
+import argparse
+import itertools
+import time
+from typing import List, Optional
+
+from . import markdown_codec
+from .database import db_manager
+from .models import FileStatus
+
+
+def compress(batch_size: int, pause: float, codec: Optional[str]) -> None:
+    """既存の本文を rowid 順に圧縮"""
+    totals = {"scanned": 0, "compressed": 0, "bytes_before": 0, "bytes_after": 0}
+    after_rowid = 0
+    while True:
+        result = db_manager.compress_markdown_batch(after_rowid, batch_size, codec)
+        for key in totals:
+            totals[key] += result[key]
+        if result["scanned"] < batch_size:
+            break
+        after_rowid = result["last_rowid"]
+        print(f"Compressed up to rowid {after_rowid}: {totals}")
+        if pause:
+            time.sleep(pause)
+    print(f"Markdown compression finished: {totals}")
+
+
+def train(samples: int, size: int) -> None:
+    """保存済みの本文から zstd 辞書を学習"""
+    rows = db_manager.iter_files(columns=["markdown_content"], status=FileStatus.COMPLETED)
+    data = [
+        row["markdown_content"].encode("utf-8")
+        for row in itertools.islice(rows, samples)
+        if row["markdown_content"]
+    ]
+    dict_id = markdown_codec.train_dictionary(data, size)
+    print(f"Trained dictionary {dict_id} from {len(data)} documents "
+          f"({markdown_codec.dictionary_dir() / f'{dict_id}.zdict'})")
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """コマンドラインエントリーポイント"""
+    parser = argparse.ArgumentParser(description="Markdown本文の圧縮")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    compress_parser = subparsers.add_parser("compress", help="非圧縮の本文を圧縮")
+    compress_parser.add_argument("--batch-size", type=int, default=200, help="1バッチで処理する行数")
+    compress_parser.add_argument("--pause", type=float, default=0.0, help="バッチの間に待つ秒数")
+    compress_parser.add_argument("--codec", choices=["zstd", "zlib"], default=None,
+                                 help="圧縮方式（未指定なら MARKDOWN_CODEC）")
+
+    train_parser = subparsers.add_parser("train", help="zstd 辞書を学習")
+    train_parser.add_argument("--samples", type=int, default=2000, help="学習に使う本文の数")
+    train_parser.add_argument("--size", type=int, default=112 * 1024, help="辞書の大きさ（バイト）")
+
+    args = parser.parse_args(argv)
+    if args.command == "compress":
+        compress(args.batch_size, args.pause, args.codec)
+    else:
+        train(args.samples, args.size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""
+レスポンス圧縮
+
+Accept-Encoding に応じて zstd / brotli / gzip でレスポンスを圧縮する。
+zstd と brotli は対応ライブラリがインストールされている場合のみ使用する。
+"""
+
+import gzip
+import os
+from typing import Callable, Dict, List, Optional
+
+import anyio.to_thread
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# この大きさ未満のレスポンスは圧縮しない（バイト）
+MINIMUM_SIZE = int(os.getenv("COMPRESSION_MINIMUM_SIZE", "1024"))
+
+# この大きさ以上の圧縮はイベントループを塞がないようスレッドで実行する
+THREAD_MINIMUM_SIZE = 128 * 1024
+
+
+def _compressors() -> Dict[str, Callable[[bytes], bytes]]:
+    """利用可能な圧縮方式（優先度の高い順）"""
+    compressors: Dict[str, Callable[[bytes], bytes]] = {}
+    if zstandard is not None:
+        compressors["zstd"] = zstandard.ZstdCompressor(level=3).compress
+    if brotli is not None:
+        compressors["br"] = lambda data: brotli.compress(data, quality=5)
+    compressors["gzip"] = lambda data: gzip.compress(data, compresslevel=6)
+    return compressors
+
+
+COMPRESSORS = _compressors()
+
+
+def available_encodings() -> List[str]:
+    """利用可能な Content-Encoding の一覧"""
+    return list(COMPRESSORS)
+
+
+def _parse_accept_encoding(accept_encoding: str) -> Dict[str, float]:
+    """Accept-Encoding を方式 -> 品質値の辞書にする"""
+    accepted: Dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    return accepted
+
+
+def accepts_encoding(accept_encoding: Optional[str], encoding: str) -> bool:
+    """クライアントが指定した方式を受け付けるか（圧縮済みの本文をそのまま返す場合）"""
+    if not accept_encoding:
+        return False
+    accepted = _parse_accept_encoding(accept_encoding)
+    return accepted.get(encoding, accepted.get("*", 0.0)) > 0
+
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """Accept-Encoding から使用する圧縮方式を選ぶ（圧縮しない場合はNone）"""
+    if not accept_encoding:
+        return None
+
+    accepted = _parse_accept_encoding(accept_encoding)
+    best = None
+    best_quality = 0.0
+    for encoding in COMPRESSORS:
+        quality = accepted.get(encoding, accepted.get("*", 0.0))
+        # 同じ品質値ならサーバー側の優先順（zstd > br > gzip）を採用
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress_body(body: bytes, encoding: str) -> bytes:
+    """指定した方式でレスポンス本文を圧縮"""
+    return COMPRESSORS[encoding](body)
+
+
+# ETag の末尾に付ける Content-Encoding（事前圧縮済みの deflate を含む）
+ETAG_ENCODINGS = ("zstd", "br", "gzip", "deflate")
+
+
+def encoded_etag(etag: str, encoding: Optional[str]) -> str:
+    """圧縮したレスポンスの ETag（"<値>" -> "<値>-gzip"）
+
+    強い ETag はバイト列ごとに異なる必要があるため、圧縮方式ごとに別の値にする
+    """
+    if not encoding or not etag.endswith('"'):
+        return etag
+    return f'{etag[:-1]}-{encoding}"'
+
+
+def strip_etag_encoding(etag: str) -> str:
+    """encoded_etag で付けた圧縮方式と W/ を取り除く（If-None-Match の弱い比較用）"""
+    if etag.startswith("W/"):
+        etag = etag[2:]
+    for encoding in ETAG_ENCODINGS:
+        suffix = f'-{encoding}"'
+        if etag.endswith(suffix):
+            return etag[:-len(suffix)] + '"'
+    return etag
+
+
+class CompressionMiddleware:
+    """Accept-Encoding に応じてレスポンスを圧縮するミドルウェア
+
+    すでに Content-Encoding が付いたレスポンス（事前圧縮済み）、
+    部分レスポンス、ストリーミングレスポンスはそのまま返す。
+    圧縮した場合は ETag にも圧縮方式を付ける。
+    """
+
+    def __init__(self, app: ASGIApp, minimum_size: int = MINIMUM_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message: Optional[Message] = None
+        passthrough = False
+
+        async def send_with_compression(message: Message) -> None:
+            nonlocal start_message, passthrough
+
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                passthrough = "content-encoding" in headers or message["status"] == 206
+                if passthrough:
+                    await send(message)
+                else:
+                    # 本文を見てから圧縮するかどうか決める
+                    start_message = message
+                return
+
+            if message["type"] != "http.response.body" or passthrough:
+                # pathsend など本文以外で応答する場合は保留中のヘッダーを先に送る
+                if start_message is not None:
+                    await send(start_message)
+                    start_message = None
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            if start_message is not None:
+                headers = MutableHeaders(raw=start_message["headers"])
+                if message.get("more_body", False) or len(body) < self.minimum_size:
+                    # ストリーミングや小さいレスポンスは圧縮しない
+                    passthrough = True
+                else:
+                    if len(body) >= THREAD_MINIMUM_SIZE:
+                        body = await anyio.to_thread.run_sync(compress_body, body, encoding)
+                    else:
+                        body = compress_body(body, encoding)
+                    headers["Content-Encoding"] = encoding
+                    headers["Content-Length"] = str(len(body))
+                    if "etag" in headers:
+                        headers["ETag"] = encoded_etag(headers["etag"], encoding)
+                    message = {**message, "body": body}
+                headers.add_vary_header("Accept-Encoding")
+                await send(start_message)
+                start_message = None
+            await send(message)
+
+        await self.app(scope, receive, send_with_compression)
@@ -2,39 +2,313 @@
 データベース接続・操作
 """
 
+import atexit
+import hashlib
+import heapq
+import itertools
+import shutil
 import sqlite3
 import os
+import sys
+import tempfile
+import threading
+import time
 from datetime import datetime
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Callable, Iterator, Tuple, Union, cast
 from pathlib import Path
 import json
 
+from . import markdown_codec, markdown_delta
+
+
+# 列指定で取得できる files テーブルの列
+FILE_COLUMNS = (
+    "id", "filename", "original_path", "markdown_path", "markdown_content", "status",
+    "file_size", "created_at", "updated_at", "processing_time", "metadata",
+    "conversion_attempts", "content_hash", "blob_digest", "markdown_encoding"
+)
+
+# IN 句1回あたりのID数（SQLiteのバインド変数上限より十分小さく）
+BATCH_CHUNK_SIZE = 500
+
+# 一覧で返す列（Markdown本文は含めない）
+LIST_COLUMNS = (
+    "id", "filename", "status", "file_size", "created_at", "updated_at", "processing_time"
+)
+
+# 一覧の並び替えに使える列
+LIST_SORT_COLUMNS = ("created_at", "processing_time", "file_size")
+
+# 一覧の絞り込み条件
+LIST_FILTERS = {
+    "status": "status = ?",
+    "created_from": "created_at >= ?",
+    "created_to": "created_at < ?",
+    "min_size": "file_size >= ?",
+    "max_size": "file_size <= ?",
+}
+
+# 一覧の絞り込み・並び替え用インデックス（名前, 列）
+# 状態での絞り込みと各並び順を組み合わせても、テーブル全体を走査しないようにする。
+# 並び順は id で同順位を決めるため、並び替えに使うインデックスは末尾に id を含める。
+# ファイル名の前方一致は範囲検索のため別の列の並び順をインデックスから取れない。
+# 一覧の列と絞り込みの列をすべて含め、一致した範囲をテーブルを読まずに並び替えられるようにする
+LIST_INDEXES = (
+    ("idx_files_created_at", "created_at, id"),
+    ("idx_files_status_created_at", "status, created_at, id"),
+    ("idx_files_filename",
+     "filename, status, created_at, file_size, processing_time, updated_at, id"),
+    ("idx_files_file_size", "file_size, id"),
+    ("idx_files_status_file_size", "status, file_size, id"),
+    ("idx_files_processing_time", "processing_time, id"),
+    ("idx_files_status_processing_time", "status, processing_time, id"),
+)
+
+# 一覧で読める位置の上限（page * per_page）。OFFSET は読み飛ばす行も読むため、
+# シャード分割時は各シャードから page * per_page 行を読んでマージするため深いページを制限する
+LIST_MAX_OFFSET = int(os.getenv("LIST_MAX_OFFSET", "10000"))
+
+# Markdownの版の履歴で、この版数ごとに差分ではなく全文を保存する
+# （任意の版の復元で適用する差分の数の上限になる）
+VERSION_SNAPSHOT_INTERVAL = int(os.getenv("FILE_VERSION_SNAPSHOT_INTERVAL", "10"))
+
+# ANALYZE / PRAGMA optimize でインデックスごとに調べる行数の上限（0 で全行）
+ANALYSIS_LIMIT = int(os.getenv("ANALYSIS_LIMIT", "1000"))
+
+# 本文の更新が他の書き込みと競合したときにやり直す回数
+VERSION_COMMIT_ATTEMPTS = 5
+
+
+# メモリ上のDBを表すパス
+MEMORY_DB_PATH = ":memory:"
+
+_ephemeral_data_dir: Optional[Path] = None
+
+
+def is_ephemeral() -> bool:
+    """DATABASE_MODE=memory（DBとファイルをプロセス内だけに置く使い捨ての環境）か"""
+    return os.getenv("DATABASE_MODE") == "memory"
+
+
+def _server_workers(argv: List[str]) -> int:
+    """uvicorn のワーカー数（--workers、なければ WEB_CONCURRENCY）"""
+    value = os.getenv("WEB_CONCURRENCY")
+    for index, arg in enumerate(argv):
+        if arg == "--workers" and index + 1 < len(argv):
+            value = argv[index + 1]
+        elif arg.startswith("--workers="):
+            value = arg.split("=", 1)[1]
+    try:
+        return int(value) if value else 1
+    except ValueError:
+        return 1
+
+
+def check_ephemeral_mode(conversion_mode: str, argv: Optional[List[str]] = None) -> None:
+    """エフェメラルモードで使えない構成なら起動しない（RuntimeError）
+
+    メモリ上のDBはプロセスごとに別のものになるため、変換ワーカー（CONVERSION_MODE=queue）や
+    複数の uvicorn ワーカーとはデータを共有できない
+    """
+    if not is_ephemeral():
+        return
+    if conversion_mode == "queue":
+        raise RuntimeError("DATABASE_MODE=memory cannot be used with CONVERSION_MODE=queue")
+    if _server_workers(sys.argv if argv is None else argv) > 1:
+        raise RuntimeError("DATABASE_MODE=memory cannot be used with multiple uvicorn workers")
+
+
+def data_dir() -> Path:
+    """アップロード・Markdownなどの保存先のルート
+
+    エフェメラルモードでは tmpfs（/dev/shm）上の一時ディレクトリを使い、
+    プロセス終了時に削除する（EPHEMERAL_DATA_DIR で指定した場合は削除しない）
+    """
+    global _ephemeral_data_dir
+    if not is_ephemeral():
+        return Path("data")
+    if _ephemeral_data_dir is None:
+        configured_dir = os.getenv("EPHEMERAL_DATA_DIR")
+        if configured_dir:
+            _ephemeral_data_dir = Path(configured_dir)
+            _ephemeral_data_dir.mkdir(parents=True, exist_ok=True)
+        else:
+            shm = "/dev/shm" if os.path.isdir("/dev/shm") else None
+            _ephemeral_data_dir = Path(tempfile.mkdtemp(prefix="pdf2md-", dir=shm))
+            atexit.register(shutil.rmtree, _ephemeral_data_dir, ignore_errors=True)
+    return _ephemeral_data_dir
+
+
+def default_db_path() -> str:
+    """環境に応じたDBファイルのパス"""
+    if is_ephemeral():
+        return MEMORY_DB_PATH
+    # 環境変数でテスト用DBパスを指定可能
+    environment = os.getenv("ENVIRONMENT", "development")
+    configured_path = os.getenv("DATABASE_PATH")
+    if configured_path:
+        return configured_path
+    elif environment == "test":
+        return "data/test_database.db"
+    return "data/database.db"
+
+
+def build_version_history(text: str, content_hash: Optional[str], updated_at: Optional[str],
+                          rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """最新の本文と履歴の行（本文なし、古い順）から版の一覧を作る
+
+    DB の file_versions とアーカイブのレコードで共通に使う
+    """
+    versions = [
+        {"version": row["version"], "kind": row["kind"], "content_hash": row["content_hash"],
+         "size": row["size"], "stored_size": row["stored_size"],
+         # 列を追加する前の版は None（比較時に本文から計算する）
+         "page_hashes": json.loads(row["page_hashes"]) if row["page_hashes"] else None,
+         "created_at": row["created_at"]}
+        for row in rows
+    ]
+    versions.append({
+        "version": (versions[-1]["version"] if versions else 0) + 1,
+        "kind": "current",
+        "content_hash": content_hash or hashlib.sha256(text.encode("utf-8")).hexdigest(),
+        "size": len(text.encode("utf-8")),
+        # 最新の版は files の本文なので履歴には場所を取らない
+        "stored_size": 0,
+        "page_hashes": None,
+        "created_at": updated_at
+    })
+    return {"text": text, "versions": versions}
+
+
+def restore_from_history(history: Dict[str, Any], versions: List[int],
+                         load: Callable[[int], Dict[str, Any]]) -> Dict[int, Dict[str, Any]]:
+    """build_version_history の結果と保存している行から版を復元し、ハッシュを確かめる"""
+    known = {version["version"]: version for version in history["versions"]}
+    targets = [version for version in versions if version in known]
+    texts = markdown_delta.restore_versions(
+        targets, history["versions"][-1]["version"], history["text"],
+        [version["version"] for version in history["versions"] if version["kind"] == "snapshot"],
+        load
+    )
+    results = {}
+    for version, text in texts.items():
+        info = known[version]
+        if hashlib.sha256(text.encode("utf-8")).hexdigest() != info["content_hash"]:
+            raise ValueError(f"Version {version} does not match its hash")
+        results[version] = {**info, "markdown_content": text}
+    return results
+
+
+class _SharedConnection:
+    """メモリ上のDBへの1つの接続をスレッド間で共有する
+
+    acquire() が返すハンドルを使っている間は他のスレッドを待たせる。
+    ハンドルは sqlite3.Connection と同じように with 文・close() で使える
+    """
+    
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+        self.lock = threading.RLock()
+        self.depth = 0
+    
+    def acquire(self) -> sqlite3.Connection:
+        self.lock.acquire()
+        self.depth += 1
+        if self.depth == 1:
+            # 前の利用者が変更した設定を戻す
+            self.conn.row_factory = None
+            self.conn.isolation_level = ""
+        # ハンドルは接続と同じように使える
+        return cast(sqlite3.Connection, _SharedConnectionHandle(self))
+    
+    def release(self) -> None:
+        try:
+            if self.depth == 1 and self.conn.in_transaction:
+                self.conn.rollback()
+        finally:
+            self.depth -= 1
+            self.lock.release()
+
+
+class _SharedConnectionHandle:
+    """共有接続を借りている間のハンドル（close() か with 文の終了で返す）"""
+    
+    _shared: _SharedConnection
+    _released: bool
+    
+    def __init__(self, shared: _SharedConnection):
+        object.__setattr__(self, "_shared", shared)
+        object.__setattr__(self, "_released", False)
+    
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._shared.conn, name)
+    
+    def __setattr__(self, name: str, value: Any) -> None:
+        setattr(self._shared.conn, name, value)
+    
+    def __enter__(self) -> "_SharedConnectionHandle":
+        return self
+    
+    def __exit__(self, *exc_info: Any) -> bool:
+        try:
+            return self._shared.conn.__exit__(*exc_info)
+        finally:
+            self.close()
+    
+    def close(self) -> None:
+        if not self._released:
+            object.__setattr__(self, "_released", True)
+            self._shared.release()
+
 
 class DatabaseManager:
     """SQLiteデータベース管理クラス"""
     
-    def __init__(self, db_path: str = None):
+    def __init__(self, db_path: Optional[str] = None):
         if db_path is None:
-            # 環境変数でテスト用DBパスを指定可能
-            import os
-            environment = os.getenv("ENVIRONMENT", "development")
-            if environment == "test":
-                db_path = "data/test_database.db"
-            else:
-                db_path = "data/database.db"
+            db_path = default_db_path()
         
         self.db_path = db_path
-        self._ensure_db_directory()
+        self._shared: Optional[_SharedConnection] = None
+        if db_path == MEMORY_DB_PATH:
+            # メモリ上のDBは接続ごとに別のDBになるため、1つの接続を共有する
+            conn = sqlite3.connect(MEMORY_DB_PATH, check_same_thread=False)
+            conn.create_function("markdown_text", 2, self._markdown_text, deterministic=True)
+            self._shared = _SharedConnection(conn)
+        else:
+            self._ensure_db_directory()
         self._init_database()
     
-    def _ensure_db_directory(self):
+    def _ensure_db_directory(self) -> None:
         """データベースディレクトリの存在確認・作成"""
         db_dir = Path(self.db_path).parent
         db_dir.mkdir(parents=True, exist_ok=True)
     
-    def _init_database(self):
+    def _connect(self) -> sqlite3.Connection:
+        """データベース接続を作成
+
+        APIプロセスと変換ワーカーが同じDBに書き込むため、
+        ロック待ちのタイムアウトを設定しておく
+        """
+        if self._shared is not None:
+            return self._shared.acquire()
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        # 圧縮した本文を全文検索インデックスに渡すためトリガーから使う
+        conn.create_function("markdown_text", 2, self._markdown_text, deterministic=True)
+        return conn
+    
+    @staticmethod
+    def _markdown_text(content: Union[str, bytes, None], encoding: Optional[str]) -> str:
+        """保存されている本文をテキストに戻す（SQL関数 markdown_text）"""
+        return markdown_codec.decode(content, encoding) or ""
+    
+    def _init_database(self) -> None:
         """データベースの初期化"""
-        with sqlite3.connect(self.db_path) as conn:
+        self._init_auto_vacuum()
+        with self._connect() as conn:
+            # 複数プロセスからの読み書きを並行させるためWALモードを使用
+            conn.execute("PRAGMA journal_mode=WAL")
+            
             conn.execute("""
                 CREATE TABLE IF NOT EXISTS files (
                     id TEXT PRIMARY KEY,
@@ -64,18 +338,359 @@ class DatabaseManager:
                 )
             """)
             
+            # 変換ジョブキュー（ワーカープロセスがリースして処理する）
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS conversion_jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    file_id TEXT NOT NULL,
+                    action TEXT NOT NULL,
+                    state TEXT NOT NULL DEFAULT 'queued',
+                    sort_key REAL NOT NULL,
+                    lease_owner TEXT,
+                    lease_expires_at REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (file_id) REFERENCES files (id)
+                )
+            """)
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_conversion_jobs_claim
+                ON conversion_jobs (state, sort_key)
+            """)
+            
+            # 変換ワーカーの稼働状況（メモリ使用量のゲージ）
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS conversion_workers (
+                    worker_id TEXT PRIMARY KEY,
+                    hostname TEXT,
+                    pid INTEGER,
+                    state TEXT NOT NULL,
+                    jobs_done INTEGER NOT NULL DEFAULT 0,
+                    rss_bytes INTEGER,
+                    started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    last_seen_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            
+            # 重複排除したPDF本体（内容のSHA-256）と参照しているファイル数
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS blobs (
+                    digest TEXT PRIMARY KEY,
+                    ref_count INTEGER NOT NULL DEFAULT 0,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            
+            # パックファイルへ移したファイルの索引（本文はパックファイル側にある）
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS archived_files (
+                    id TEXT PRIMARY KEY,
+                    filename TEXT NOT NULL,
+                    pack TEXT NOT NULL,
+                    offset INTEGER NOT NULL,
+                    length INTEGER NOT NULL,
+                    created_at TIMESTAMP,
+                    updated_at TIMESTAMP,
+                    archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            
+            # Markdownの版の履歴（前の版からの差分と、一定の版数ごとの全文）
+            # アーカイブしたファイルの履歴も残す
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS file_versions (
+                    file_id TEXT NOT NULL,
+                    version INTEGER NOT NULL,
+                    kind TEXT NOT NULL,
+                    payload BLOB NOT NULL,
+                    encoding TEXT,
+                    content_hash TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (file_id, version)
+                )
+            """)
+            
+            self._migrate_schema(conn)
+            self._init_blob_references(conn)
+            self._init_list_version(conn)
+            self.search_enabled = self._init_search_index(conn)
             conn.commit()
     
+    def _init_auto_vacuum(self) -> None:
+        """削除で空いたページを少しずつ返せるよう、新しいDBは auto_vacuum を INCREMENTAL で作る
+
+        既存のDBを移行するには VACUUM でDB全体を書き直す必要があり、その間は書き込みが止まるため
+        起動時には行わず、状態を表示するだけにする（enable_incremental_vacuum を参照）
+        """
+        conn = self._connect()
+        conn.isolation_level = None
+        try:
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+                return
+            if not conn.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()[0]:
+                # テーブルを作る前なら設定するだけで有効になる
+                conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+                return
+            print(f"auto_vacuum is not incremental for {self.db_path}; run "
+                  "'python -m src.api.maintenance enable-incremental-vacuum' once to migrate")
+        except Exception as e:
+            print(f"Error checking auto_vacuum: {e}")
+        finally:
+            conn.close()
+    
+    def enable_incremental_vacuum(self) -> Dict[str, Any]:
+        """既存のDBを auto_vacuum = INCREMENTAL に移行する（VACUUM で作り直す）
+
+        DB全体を書き直すため時間がかかり、その間は他の書き込みが待たされる。
+        一度だけメンテナンスコマンドから実行する
+        """
+        conn = self._connect()
+        conn.isolation_level = None
+        try:
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+                return {"migrated": False, "auto_vacuum": "incremental"}
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+            return {"migrated": True, "auto_vacuum": self.get_storage_status().get("auto_vacuum")}
+        finally:
+            conn.close()
+    
+    def _migrate_schema(self, conn: sqlite3.Connection) -> None:
+        """既存DBに後から追加したカラムを反映"""
+        added_columns = [
+            ("files", "conversion_attempts", "INTEGER NOT NULL DEFAULT 0"),
+            ("files", "content_hash", "TEXT"),
+            ("files", "blob_digest", "TEXT"),
+            ("files", "markdown_encoding", "TEXT"),
+            ("files", "heartbeat_at", "TIMESTAMP"),
+            ("file_versions", "page_hashes", "TEXT"),
+        ]
+        for table, column, definition in added_columns:
+            existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+            if column not in existing:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        
+        conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_files_status_updated_at
+            ON files (status, updated_at)
+        """)
+        for name, columns in LIST_INDEXES:
+            indexed = [row[2] for row in conn.execute(f"PRAGMA index_info({name})")]
+            if indexed and indexed != [column.strip() for column in columns.split(",")]:
+                # 列を変えたインデックスは作り直す
+                conn.execute(f"DROP INDEX {name}")
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON files ({columns})")
+    
+    def _init_blob_references(self, conn: sqlite3.Connection) -> None:
+        """blobs の参照数を files の変更に合わせて更新するトリガーを作成
+
+        登録・再アップロード・削除のどの経路でも、ファイル行の変更と
+        同じトランザクションで参照数が増減する
+        """
+        conn.executescript("""
+            CREATE TRIGGER IF NOT EXISTS files_blob_insert
+            AFTER INSERT ON files WHEN NEW.blob_digest IS NOT NULL
+            BEGIN
+                INSERT INTO blobs (digest, ref_count) VALUES (NEW.blob_digest, 1)
+                ON CONFLICT (digest) DO UPDATE SET ref_count = ref_count + 1;
+            END;
+            
+            CREATE TRIGGER IF NOT EXISTS files_blob_update
+            AFTER UPDATE OF blob_digest ON files
+            WHEN OLD.blob_digest IS NOT NEW.blob_digest
+            BEGIN
+                UPDATE blobs SET ref_count = ref_count - 1 WHERE digest = OLD.blob_digest;
+                INSERT INTO blobs (digest, ref_count)
+                SELECT NEW.blob_digest, 1 WHERE NEW.blob_digest IS NOT NULL
+                ON CONFLICT (digest) DO UPDATE SET ref_count = ref_count + 1;
+            END;
+            
+            CREATE TRIGGER IF NOT EXISTS files_blob_delete
+            AFTER DELETE ON files WHEN OLD.blob_digest IS NOT NULL
+            BEGIN
+                UPDATE blobs SET ref_count = ref_count - 1 WHERE digest = OLD.blob_digest;
+            END;
+        """)
+    
+    def _init_list_version(self, conn: sqlite3.Connection) -> None:
+        """一覧の変更カウンターとそれを増やすトリガーを作成
+
+        一覧のETagを、一覧を読まずに判定するために使う。行の追加・削除と一覧に出る列の更新で増える。
+        DBを作り直しても以前の値に戻らないよう、作成時の時刻（マイクロ秒）から数える
+        """
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS files_list_version (
+                id INTEGER PRIMARY KEY CHECK (id = 0),
+                version INTEGER NOT NULL
+            )
+        """)
+        conn.execute(
+            "INSERT OR IGNORE INTO files_list_version (id, version) VALUES (0, ?)",
+            (time.time_ns() // 1000,)
+        )
+        conn.executescript(f"""
+            CREATE TRIGGER IF NOT EXISTS files_list_version_insert AFTER INSERT ON files
+            BEGIN
+                UPDATE files_list_version SET version = version + 1 WHERE id = 0;
+            END;
+            
+            CREATE TRIGGER IF NOT EXISTS files_list_version_update
+            AFTER UPDATE OF {", ".join(LIST_COLUMNS)} ON files
+            BEGIN
+                UPDATE files_list_version SET version = version + 1 WHERE id = 0;
+            END;
+            
+            CREATE TRIGGER IF NOT EXISTS files_list_version_delete AFTER DELETE ON files
+            BEGIN
+                UPDATE files_list_version SET version = version + 1 WHERE id = 0;
+            END;
+        """)
+    
+    def _init_search_index(self, conn: sqlite3.Connection) -> bool:
+        """Markdown本文の全文検索インデックス（FTS5）を作成
+
+        files の rowid は VACUUM で変わり得るため、固定の doc_id を
+        search_documents で割り当てて files_fts の rowid に使う。
+        本文を二重に持たないよう、files_fts は files の本文を展開するビュー
+        （files_search_content）を外部コンテンツにする。インデックスはトリガーで1件ずつ更新する。
+        """
+        try:
+            row = conn.execute(
+                "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'files_fts'"
+            ).fetchone()
+            
+            if row is not None and "files_search_content" not in row[0]:
+                # 本文の複製（files_fts_content）を持つ以前の定義は作り直す
+                conn.execute("DROP TABLE files_fts")
+                row = None
+            
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS search_documents (
+                    doc_id INTEGER PRIMARY KEY,
+                    file_id TEXT NOT NULL UNIQUE
+                )
+            """)
+            conn.execute("""
+                CREATE VIEW IF NOT EXISTS files_search_content AS
+                SELECT d.doc_id, f.filename, markdown_text(f.markdown_content, f.markdown_encoding) AS content
+                FROM search_documents d JOIN files f ON f.id = d.file_id
+            """)
+            
+            if row is None:
+                # 日本語は空白で区切られないため trigram で部分一致させる
+                conn.execute("""
+                    CREATE VIRTUAL TABLE files_fts USING fts5(
+                        filename, content, tokenize = 'trigram',
+                        content = 'files_search_content', content_rowid = 'doc_id'
+                    )
+                """)
+                
+                # 既存のファイルを一度だけ登録
+                conn.execute("""
+                    INSERT INTO search_documents (file_id)
+                    SELECT id FROM files WHERE id NOT IN (SELECT file_id FROM search_documents)
+                """)
+                conn.execute("INSERT INTO files_fts (files_fts) VALUES ('rebuild')")
+            
+            self._create_search_triggers(conn)
+            return True
+        except sqlite3.OperationalError as e:
+            # FTS5 が組み込まれていない SQLite では検索を無効にする
+            print(f"Full-text search disabled: {e}")
+            return False
+    
+    def _create_search_triggers(self, conn: sqlite3.Connection) -> None:
+        """全文検索インデックスを更新するトリガーを作成
+
+        定義を変えたときに既存DBにも反映されるよう、毎回作り直す。
+        外部コンテンツのインデックスから消すときは、索引したときの値を 'delete' で渡す
+        """
+        conn.executescript("""
+            DROP TRIGGER IF EXISTS files_search_insert;
+            DROP TRIGGER IF EXISTS files_search_update;
+            DROP TRIGGER IF EXISTS files_search_delete;
+            
+            CREATE TRIGGER files_search_insert AFTER INSERT ON files
+            BEGIN
+                INSERT INTO search_documents (file_id) VALUES (new.id);
+                INSERT INTO files_fts (rowid, filename, content)
+                VALUES ((SELECT doc_id FROM search_documents WHERE file_id = new.id),
+                        new.filename, markdown_text(new.markdown_content, new.markdown_encoding));
+            END;
+            
+            -- 本文の圧縮だけの更新（ハッシュが変わらない）では索引し直さない
+            CREATE TRIGGER files_search_update
+            AFTER UPDATE OF filename, markdown_content, markdown_encoding ON files
+            WHEN NOT (old.filename IS new.filename AND new.content_hash IS NOT NULL
+                      AND old.content_hash IS new.content_hash)
+            BEGIN
+                INSERT INTO files_fts (files_fts, rowid, filename, content)
+                VALUES ('delete', (SELECT doc_id FROM search_documents WHERE file_id = old.id),
+                        old.filename, markdown_text(old.markdown_content, old.markdown_encoding));
+                INSERT INTO files_fts (rowid, filename, content)
+                VALUES ((SELECT doc_id FROM search_documents WHERE file_id = new.id),
+                        new.filename, markdown_text(new.markdown_content, new.markdown_encoding));
+            END;
+            
+            CREATE TRIGGER files_search_delete AFTER DELETE ON files
+            BEGIN
+                INSERT INTO files_fts (files_fts, rowid, filename, content)
+                VALUES ('delete', (SELECT doc_id FROM search_documents WHERE file_id = old.id),
+                        old.filename, markdown_text(old.markdown_content, old.markdown_encoding));
+                DELETE FROM search_documents WHERE file_id = old.id;
+            END;
+        """)
+    
+    def search_files(self, match_query: str, like_terms: Optional[List[str]] = None,
+                     limit: int = 20,
+                     after: Optional[tuple] = None) -> List[Dict[str, Any]]:
+        """全文検索（関連度の高い順、after=(score, doc_id) 以降を返す）"""
+        try:
+            conditions = ["files_fts MATCH ?"]
+            params: List[Any] = [match_query]
+            # trigram で引けない短い語は、一致した行に対する絞り込みとして扱う
+            # （短いパターンの LIKE は FTS5 側で処理されて一致しないため instr を使う）
+            for term in like_terms or []:
+                conditions.append(
+                    "(instr(files_fts.content, ?) > 0 OR instr(files_fts.filename, ?) > 0)"
+                )
+                params.extend([term, term])
+            if after is not None:
+                conditions.append("(bm25(files_fts) > ? OR (bm25(files_fts) = ? AND files_fts.rowid > ?))")
+                params.extend([after[0], after[0], after[1]])
+            params.append(limit)
+            
+            with self._connect() as conn:
+                conn.row_factory = sqlite3.Row
+                cursor = conn.execute(f"""
+                    SELECT f.id, f.filename, f.status, f.updated_at,
+                           snippet(files_fts, 1, '<mark>', '</mark>', '…', 16) AS snippet,
+                           bm25(files_fts) AS score, files_fts.rowid AS doc_id
+                    FROM files_fts
+                    JOIN search_documents d ON d.doc_id = files_fts.rowid
+                    JOIN files f ON f.id = d.file_id
+                    WHERE {' AND '.join(conditions)}
+                    ORDER BY score, doc_id
+                    LIMIT ?
+                """, params)
+                return [dict(row) for row in cursor.fetchall()]
+        except Exception as e:
+            print(f"Error searching files: {e}")
+            return []
+    
     def insert_file(self, file_id: str, filename: str, original_path: str, 
-                   file_size: int, metadata: Optional[Dict] = None) -> bool:
+                   file_size: int, metadata: Optional[Dict] = None,
+                   blob_digest: Optional[str] = None) -> bool:
         """ファイル情報を挿入"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 conn.execute("""
-                    INSERT INTO files (id, filename, original_path, file_size, metadata)
-                    VALUES (?, ?, ?, ?, ?)
+                    INSERT INTO files (id, filename, original_path, file_size, metadata, blob_digest)
+                    VALUES (?, ?, ?, ?, ?, ?)
                 """, (file_id, filename, original_path, file_size, 
-                     json.dumps(metadata) if metadata else None))
+                     json.dumps(metadata) if metadata else None, blob_digest))
                 conn.commit()
                 return True
         except Exception as e:
@@ -84,78 +699,448 @@ class DatabaseManager:
     
     def update_file_status(self, file_id: str, status: str, 
                           markdown_content: Optional[str] = None,
-                          processing_time: Optional[float] = None) -> bool:
-        """ファイルの状態を更新"""
+                          processing_time: Optional[float] = None,
+                          markdown_path: Optional[str] = None) -> bool:
+        """ファイルの状態を更新
+
+        本文が変わる場合は、置き換えられる本文を版の履歴に移す。差分や圧縮は
+        書き込みロックを取る前に計算し、ロック中は前提にした本文が変わっていないかだけを確かめる
+        """
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                update_fields = ["status = ?", "updated_at = CURRENT_TIMESTAMP"]
-                params = [status]
-                
-                if markdown_content is not None:
-                    update_fields.append("markdown_content = ?")
-                    params.append(markdown_content)
-                
-                if processing_time is not None:
-                    update_fields.append("processing_time = ?")
-                    params.append(processing_time)
-                
-                params.append(file_id)
-                
-                query = f"""
-                    UPDATE files 
-                    SET {', '.join(update_fields)}
-                    WHERE id = ?
-                """
-                
-                conn.execute(query, params)
-                conn.commit()
-                return True
+            update_fields = ["status = ?", "updated_at = CURRENT_TIMESTAMP"]
+            params: List[Any] = [status]
+            if processing_time is not None:
+                update_fields.append("processing_time = ?")
+                params.append(processing_time)
+            if markdown_path is not None:
+                update_fields.append("markdown_path = ?")
+                params.append(markdown_path)
+            
+            if markdown_content is None:
+                with self._connect() as conn:
+                    conn.execute(f"""
+                        UPDATE files SET {', '.join(update_fields)} WHERE id = ?
+                    """, (*params, file_id))
+                    conn.commit()
+                    return True
+            
+            payload, encoding = markdown_codec.encode(markdown_content)
+            # ETag 用に本文を読まずに比較できるハッシュを保存
+            content_hash = hashlib.sha256(markdown_content.encode("utf-8")).hexdigest()
+            update_fields += ["markdown_content = ?", "markdown_encoding = ?", "content_hash = ?"]
+            params += [payload, encoding, content_hash]
+            
+            for _ in range(VERSION_COMMIT_ATTEMPTS):
+                prepared = self._prepare_version(file_id, markdown_content, content_hash)
+                if prepared is None:
+                    return True
+                with self._connect() as conn:
+                    conn.execute("BEGIN IMMEDIATE")
+                    base_hash, last_version = self._version_state(conn, file_id)
+                    if (base_hash, last_version) != (prepared["base_hash"],
+                                                     prepared["last_version"]):
+                        # 準備している間に他の書き込みで本文が変わったのでやり直す
+                        conn.rollback()
+                        continue
+                    history = prepared["history"]
+                    if history is not None:
+                        conn.execute("""
+                            INSERT INTO file_versions
+                                (file_id, version, kind, payload, encoding, content_hash,
+                                 size, page_hashes, created_at)
+                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                        """, (file_id, history["version"], history["kind"],
+                              history["payload"], history["encoding"],
+                              history["content_hash"], history["size"],
+                              history["page_hashes"], history["created_at"]))
+                    conn.execute(f"""
+                        UPDATE files SET {', '.join(update_fields)} WHERE id = ?
+                    """, (*params, file_id))
+                    conn.commit()
+                    return True
+            print(f"Error updating file status: {file_id} was updated concurrently")
+            return False
         except Exception as e:
             print(f"Error updating file status: {e}")
             return False
     
-    def get_file(self, file_id: str) -> Optional[Dict[str, Any]]:
-        """ファイル情報を取得"""
+    @staticmethod
+    def _version_state(conn: sqlite3.Connection, file_id: str) -> tuple:
+        """(files に保存されている本文のハッシュ, 履歴の最後の版の番号)"""
+        row = conn.execute("""
+            SELECT content_hash,
+                   (SELECT MAX(version) FROM file_versions WHERE file_id = files.id)
+            FROM files WHERE id = ?
+        """, (file_id,)).fetchone()
+        return (row[0], row[1]) if row else (None, None)
+    
+    def _prepare_version(self, file_id: str, markdown_content: str,
+                         content_hash: str) -> Optional[Dict[str, Any]]:
+        """置き換えられる本文を履歴に入れる行を作成（トランザクションの外で呼ぶ）
+
+        最新の版は files の本文なので、初めての変換では履歴に何も保存しない。
+        再変換では置き換えられる本文を、新しい本文からの差分として保存する。
+        直前の全文から VERSION_SNAPSHOT_INTERVAL 版離れたら全文で保存する
+        ファイルがなければ None
+        """
+        with self._connect() as conn:
+            current = conn.execute("""
+                SELECT markdown_content, markdown_encoding, content_hash, updated_at,
+                       (SELECT MAX(version) FROM file_versions WHERE file_id = files.id),
+                       (SELECT MAX(version) FROM file_versions
+                        WHERE file_id = files.id AND kind = 'snapshot')
+                FROM files WHERE id = ?
+            """, (file_id,)).fetchone()
+        if current is None:
+            return None
+        content, encoding, base_hash, updated_at, last_version, last_snapshot = current
+        prepared = {"base_hash": base_hash, "last_version": last_version, "history": None}
+        
+        base = markdown_codec.decode(content, encoding)
+        if base is None:
+            return prepared
+        old_hash = base_hash or hashlib.sha256(base.encode("utf-8")).hexdigest()
+        if old_hash == content_hash:
+            return prepared
+        
+        version = (last_version or 0) + 1
+        history = {
+            "version": version,
+            "kind": "snapshot",
+            "content_hash": old_hash,
+            "size": len(base.encode("utf-8")),
+            # 版どうしの比較で変更のないページを飛ばせるよう、ページごとのハッシュも保存
+            "page_hashes": json.dumps(markdown_delta.page_hashes(base)),
+            "created_at": updated_at
+        }
+        if version - (last_snapshot or 0) < VERSION_SNAPSHOT_INTERVAL:
+            delta = markdown_delta.make_delta(markdown_content, base)
+            # 本文の大半が変わった場合は全文で保存する
+            if len(delta) * 2 < history["size"]:
+                history.update(kind="delta", payload=delta, encoding=None)
+        if history["kind"] == "snapshot":
+            history["payload"], history["encoding"] = markdown_codec.encode(base)
+        prepared["history"] = history
+        return prepared
+    
+    def _read_versions(self, conn: sqlite3.Connection, file_id: str) -> Optional[Dict[str, Any]]:
+        """最新の版（files の本文）と、履歴に保存している版の一覧（本文なし）
+
+        本文がなければ None
+        """
+        current = conn.execute("""
+            SELECT markdown_content, markdown_encoding, content_hash, updated_at
+            FROM files WHERE id = ?
+        """, (file_id,)).fetchone()
+        if current is None or current[0] is None:
+            return None
+        conn.row_factory = sqlite3.Row
+        rows = conn.execute("""
+            SELECT version, kind, content_hash, size, length(payload) AS stored_size,
+                   page_hashes, created_at
+            FROM file_versions WHERE file_id = ? ORDER BY version
+        """, (file_id,)).fetchall()
+        return build_version_history(markdown_codec.decode(current[0], current[1]),
+                                     current[2], current[3], rows)
+    
+    def list_file_versions(self, file_id: str) -> List[Dict[str, Any]]:
+        """ファイルの版の一覧（古い順、本文は含めない。最後の版が現在の本文）"""
+        try:
+            with self._connect() as conn:
+                history = self._read_versions(conn, file_id)
+            if history is None:
+                return []
+            return [{key: value for key, value in version.items() if key != "page_hashes"}
+                    for version in history["versions"]]
+        except markdown_codec.MarkdownCodecError:
+            # 本文を展開できないのは設定の不一致なので、見つからない扱いにしない
+            raise
+        except Exception as e:
+            print(f"Error listing file versions: {e}")
+            return []
+    
+    def restore_file_versions(self, file_id: str,
+                              versions: List[int]) -> Dict[int, Dict[str, Any]]:
+        """指定した版の本文を復元（存在しない版は結果に含めない）
+
+        新しい全文または現在の本文から差分を順に適用する（1つの版あたり
+        VERSION_SNAPSHOT_INTERVAL 個未満）。複数の版は差分の列を共有して一度に復元する
+        """
+        try:
+            with self._connect() as conn:
+                # 復元中に新しい版が追加されても、読み始めた時点の履歴を使う
+                conn.execute("BEGIN")
+                try:
+                    history = self._read_versions(conn, file_id)
+                    if history is None:
+                        return {}
+                    
+                    def load(version: int) -> Dict[str, Any]:
+                        kind, payload, encoding = conn.execute("""
+                            SELECT kind, payload, encoding FROM file_versions
+                            WHERE file_id = ? AND version = ?
+                        """, (file_id, version)).fetchone()
+                        return {"kind": kind, "payload": payload, "encoding": encoding}
+                    
+                    return restore_from_history(history, versions, load)
+                finally:
+                    conn.rollback()
+        except markdown_codec.MarkdownCodecError:
+            # 本文を展開できないのは設定の不一致なので、見つからない扱いにしない
+            raise
+        except Exception as e:
+            print(f"Error restoring file versions: {e}")
+            return {}
+    
+    def get_file_version(self, file_id: str, version: int) -> Optional[Dict[str, Any]]:
+        """指定した版の本文を復元して取得"""
+        restored = self.restore_file_versions(file_id, [version]).get(version)
+        if restored is None:
+            return None
+        restored.pop("page_hashes", None)
+        return restored
+    
+    def _select_columns(self, columns: Optional[List[str]], default: str) -> str:
+        """SELECT する列のリストを作成（未知の列は拒否）"""
+        if columns is None:
+            return default
+        unknown = [column for column in columns if column not in FILE_COLUMNS]
+        if unknown:
+            raise ValueError(f"Unknown columns: {unknown}")
+        if "markdown_content" in columns and "markdown_encoding" not in columns:
+            # 本文の展開に圧縮方式が必要
+            columns = [*columns, "markdown_encoding"]
+        return ", ".join(columns)
+    
+    @staticmethod
+    def _row_to_dict(row: sqlite3.Row, columns: Optional[List[str]] = None) -> Dict[str, Any]:
+        """行を辞書に変換（圧縮された本文は展開する）"""
+        file_dict = dict(row)
+        if "markdown_encoding" in file_dict:
+            encoding = file_dict["markdown_encoding"]
+            if "markdown_content" in file_dict:
+                file_dict["markdown_content"] = markdown_codec.decode(
+                    file_dict["markdown_content"], encoding
+                )
+            if columns is not None and "markdown_encoding" not in columns:
+                del file_dict["markdown_encoding"]
+        return file_dict
+    
+    def get_file(self, file_id: str,
+                 columns: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
+        """ファイル情報を取得（columns を指定するとその列だけを読む）"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 conn.row_factory = sqlite3.Row
-                cursor = conn.execute("""
-                    SELECT * FROM files WHERE id = ?
+                cursor = conn.execute(f"""
+                    SELECT {self._select_columns(columns, "*")} FROM files WHERE id = ?
                 """, (file_id,))
                 row = cursor.fetchone()
                 
                 if row:
-                    file_dict = dict(row)
+                    file_dict = self._row_to_dict(row, columns)
                     if file_dict.get('metadata'):
                         file_dict['metadata'] = json.loads(file_dict['metadata'])
                     return file_dict
                 return None
+        except markdown_codec.MarkdownCodecError:
+            # 本文を展開できないのは設定の不一致なので、見つからない扱いにしない
+            raise
         except Exception as e:
             print(f"Error getting file: {e}")
             return None
     
-    def list_files(self, page: int = 1, per_page: int = 10) -> Dict[str, Any]:
-        """ファイル一覧を取得"""
+    def get_markdown_payload(self, file_id: str) -> Optional[Dict[str, Any]]:
+        """保存されている本文を展開せずに取得（圧縮済みのまま返すため）"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.execute("""
+                    SELECT markdown_content, markdown_encoding FROM files WHERE id = ?
+                """, (file_id,))
+                row = cursor.fetchone()
+                if row is None or row[0] is None:
+                    return None
+                return {"payload": row[0], "encoding": row[1]}
+        except Exception as e:
+            print(f"Error getting markdown payload: {e}")
+            return None
+    
+    def compress_markdown_batch(self, after_rowid: int = 0, limit: int = 200,
+                                codec: Optional[str] = None) -> Dict[str, int]:
+        """非圧縮で保存されている本文を rowid 順に limit 件ずつ圧縮"""
+        result = {"scanned": 0, "compressed": 0, "bytes_before": 0, "bytes_after": 0,
+                  "last_rowid": after_rowid}
+        try:
+            with self._connect() as conn:
+                rows = conn.execute("""
+                    SELECT rowid, id, markdown_content FROM files
+                    WHERE rowid > ? AND markdown_encoding IS NULL AND markdown_content IS NOT NULL
+                    ORDER BY rowid
+                    LIMIT ?
+                """, (after_rowid, limit)).fetchall()
+                
+                for rowid, file_id, content in rows:
+                    result["scanned"] += 1
+                    result["last_rowid"] = rowid
+                    payload, encoding = markdown_codec.encode(content, codec)
+                    if encoding is None:
+                        continue
+                    # 読み出した後に本文が更新されていれば触らない
+                    cursor = conn.execute("""
+                        UPDATE files
+                        SET markdown_content = ?, markdown_encoding = ?,
+                            content_hash = COALESCE(content_hash, ?)
+                        WHERE id = ? AND markdown_encoding IS NULL AND markdown_content = ?
+                    """, (payload, encoding, hashlib.sha256(content.encode("utf-8")).hexdigest(),
+                          file_id, content))
+                    if cursor.rowcount:
+                        result["compressed"] += 1
+                        result["bytes_before"] += len(content.encode("utf-8"))
+                        result["bytes_after"] += len(payload)
+                conn.commit()
+        except Exception as e:
+            print(f"Error compressing markdown: {e}")
+        return result
+    
+    def get_file_validator(self, file_id: str) -> Optional[Dict[str, Any]]:
+        """ETag の計算に必要な列だけを取得（Markdown本文は読まない）"""
+        try:
+            with self._connect() as conn:
+                conn.row_factory = sqlite3.Row
+                cursor = conn.execute("""
+                    SELECT id, filename, status, file_size, updated_at, content_hash,
+                           markdown_path
+                    FROM files WHERE id = ?
+                """, (file_id,))
+                row = cursor.fetchone()
+                return dict(row) if row else None
+        except Exception as e:
+            print(f"Error getting file validator: {e}")
+            return None
+    
+    def get_list_version(self) -> Optional[int]:
+        """一覧の変更カウンター（一覧の内容が変わるたびに増える）"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
+                row = conn.execute("SELECT version FROM files_list_version WHERE id = 0").fetchone()
+                return row[0] if row else None
+        except Exception as e:
+            print(f"Error getting list version: {e}")
+            return None
+    
+    def iter_files(self, columns: Optional[List[str]] = None,
+                   status: Optional[str] = None,
+                   updated_since: Optional[str] = None,
+                   batch_size: int = 500) -> Iterator[Dict[str, Any]]:
+        """条件に合うファイルを rowid 順に batch_size 件ずつ読み出す
+
+        件数に関わらずメモリ使用量は一定。バッチごとに接続を開き直し、rowid で続きから読むため、
+        ジェネレーターをスレッドをまたいで再開しても（StreamingResponse のスレッドプール）使える。
+        共有接続（メモリ上のDB）でも、読み出しの途中で他のスレッドを待たせない。
+        """
+        select = self._select_columns(columns, "*")
+        conditions = ["rowid > ?"]
+        params: List[Any] = []
+        if status is not None:
+            conditions.append("status = ?")
+            params.append(status)
+        if updated_since is not None:
+            conditions.append("updated_at >= ?")
+            params.append(updated_since)
+        
+        after_rowid = 0
+        while True:
+            try:
+                with self._connect() as conn:
+                    conn.row_factory = sqlite3.Row
+                    rows = conn.execute(f"""
+                        SELECT rowid AS iter_rowid, {select} FROM files
+                        WHERE {' AND '.join(conditions)}
+                        ORDER BY rowid
+                        LIMIT ?
+                    """, (after_rowid, *params, batch_size)).fetchall()
+            except Exception as e:
+                # 途中で打ち切られた出力を完了扱いにしないよう例外は呼び出し側に伝える
+                print(f"Error iterating files: {e}")
+                raise
+            if not rows:
+                return
+            for row in rows:
+                file_dict = self._row_to_dict(row, columns)
+                after_rowid = file_dict.pop("iter_rowid")
+                yield file_dict
+            if len(rows) < batch_size:
+                return
+    
+    def _build_list_query(self, filters: Optional[Dict[str, Any]] = None,
+                          sort: Optional[str] = None) -> Tuple[str, str, List[Any]]:
+        """一覧の WHERE 句・ORDER BY 句とパラメータを作成
+
+        sort は列名（昇順）または "-列名"（降順）。未指定なら作成日時の新しい順。
+        同じ値の行の順序がページ間で入れ替わらないよう、id を同じ向きで並べる
+        """
+        conditions = []
+        params: List[Any] = []
+        for key, value in (filters or {}).items():
+            if value is None or value == "":
+                continue
+            if key == "filename_prefix":
+                # LIKE ではインデックスが使えないため範囲検索にする
+                conditions.append("filename >= ? AND filename < ?")
+                params.extend([value, value[:-1] + chr(ord(value[-1]) + 1)])
+            elif key in LIST_FILTERS:
+                conditions.append(LIST_FILTERS[key])
+                params.append(value)
+            else:
+                raise ValueError(f"Unknown filter: {key}")
+        
+        sort = sort or "-created_at"
+        column = sort.lstrip("-")
+        if column not in LIST_SORT_COLUMNS:
+            raise ValueError(f"Unknown sort column: {column}")
+        direction = "DESC" if sort.startswith("-") else "ASC"
+        
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        return where, f"ORDER BY {column} {direction}, id {direction}", params
+    
+    def _build_list_statements(self, columns: Optional[List[str]] = None,
+                               filters: Optional[Dict[str, Any]] = None,
+                               sort: Optional[str] = None) -> Tuple[str, str, List[Any]]:
+        """一覧の総件数と1ページ分を取得する SQL とパラメータ（ページの SQL は LIMIT / OFFSET を取る）"""
+        where, order_by, params = self._build_list_query(filters, sort)
+        page_sql = f"""
+            SELECT {self._select_columns(columns, ", ".join(LIST_COLUMNS))}
+            FROM files {where}
+            {order_by}
+            LIMIT ? OFFSET ?
+        """
+        return f"SELECT COUNT(*) FROM files {where}", page_sql, params
+    
+    def list_files(self, page: int = 1, per_page: int = 10,
+                   columns: Optional[List[str]] = None,
+                   filters: Optional[Dict[str, Any]] = None,
+                   sort: Optional[str] = None) -> Dict[str, Any]:
+        """ファイル一覧を取得
+
+        columns を指定するとその列だけを読む。filters は LIST_FILTERS のキーと
+        filename_prefix で絞り込み、sort は LIST_SORT_COLUMNS の列で並び替える
+        """
+        try:
+            count_sql, page_sql, params = self._build_list_statements(columns, filters, sort)
+            with self._connect() as conn:
                 conn.row_factory = sqlite3.Row
                 
                 # 総件数を取得
-                cursor = conn.execute("SELECT COUNT(*) FROM files")
+                cursor = conn.execute(count_sql, params)
                 total_count = cursor.fetchone()[0]
                 
                 # ファイル一覧を取得
                 offset = (page - 1) * per_page
-                cursor = conn.execute("""
-                    SELECT id, filename, status, file_size, created_at, updated_at, processing_time
-                    FROM files 
-                    ORDER BY created_at DESC
-                    LIMIT ? OFFSET ?
-                """, (per_page, offset))
+                cursor = conn.execute(page_sql, (*params, per_page, offset))
                 
                 files = []
                 for row in cursor.fetchall():
-                    file_dict = dict(row)
+                    file_dict = self._row_to_dict(row, columns)
                     files.append(file_dict)
                 
                 return {
@@ -164,37 +1149,700 @@ class DatabaseManager:
                     "page": page,
                     "per_page": per_page
                 }
+        except markdown_codec.MarkdownCodecError:
+            # 本文を展開できないのは設定の不一致なので、見つからない扱いにしない
+            raise
         except Exception as e:
             print(f"Error listing files: {e}")
             return {"files": [], "total_count": 0, "page": page, "per_page": per_page}
     
+    def get_files(self, file_ids: List[str],
+                  columns: Optional[List[str]] = None) -> Dict[str, Dict[str, Any]]:
+        """複数のファイル情報をまとめて取得（IDをキーにした辞書）"""
+        files: Dict[str, Dict[str, Any]] = {}
+        try:
+            select = self._select_columns(columns, "*")
+            if columns is not None and "id" not in columns:
+                select = "id, " + select
+            
+            with self._connect() as conn:
+                conn.row_factory = sqlite3.Row
+                unique_ids = list(dict.fromkeys(file_ids))
+                for start in range(0, len(unique_ids), BATCH_CHUNK_SIZE):
+                    chunk = unique_ids[start:start + BATCH_CHUNK_SIZE]
+                    placeholders = ", ".join("?" for _ in chunk)
+                    cursor = conn.execute(f"""
+                        SELECT {select} FROM files WHERE id IN ({placeholders})
+                    """, chunk)
+                    for row in cursor.fetchall():
+                        file_dict = self._row_to_dict(row, columns)
+                        if file_dict.get('metadata'):
+                            file_dict['metadata'] = json.loads(file_dict['metadata'])
+                        files[file_dict["id"]] = file_dict
+            return files
+        except markdown_codec.MarkdownCodecError:
+            # 本文を展開できないのは設定の不一致なので、見つからない扱いにしない
+            raise
+        except Exception as e:
+            print(f"Error getting files: {e}")
+            return {}
+    
+    @staticmethod
+    def _artifact_paths(original_path: Optional[str], markdown_path: Optional[str],
+                        blob_digest: Optional[str]) -> List[str]:
+        """ファイル削除時に消すディスク上のファイル
+
+        ブロブストアのPDFは参照数が0になったときに削除するため含めない
+        """
+        paths = [markdown_path]
+        if not blob_digest:
+            paths.append(original_path)
+        return [path for path in paths if path]
+    
+    @staticmethod
+    def _remove_artifacts(paths: List[str]) -> None:
+        """ディスク上のファイルを削除（存在しないものは無視）"""
+        for path in paths:
+            try:
+                if os.path.exists(path):
+                    os.remove(path)
+            except OSError as e:
+                print(f"Error removing file {path}: {e}")
+    
+    def delete_files(self, file_ids: List[str]) -> List[str]:
+        """複数のファイルを1トランザクションで削除（削除できたIDを返す）"""
+        try:
+            unique_ids = list(dict.fromkeys(file_ids))
+            deleted: Dict[str, List[str]] = {}
+            with self._connect() as conn:
+                for start in range(0, len(unique_ids), BATCH_CHUNK_SIZE):
+                    chunk = unique_ids[start:start + BATCH_CHUNK_SIZE]
+                    placeholders = ", ".join("?" for _ in chunk)
+                    cursor = conn.execute(f"""
+                        SELECT id, original_path, markdown_path, blob_digest, markdown_encoding
+                        FROM files WHERE id IN ({placeholders})
+                    """, chunk)
+                    for (file_id, original_path, markdown_path, blob_digest,
+                         encoding) in cursor.fetchall():
+                        # 検索インデックスから外すには旧本文の展開が要る
+                        markdown_codec.check_decodable(encoding)
+                        deleted[file_id] = self._artifact_paths(
+                            original_path, markdown_path, blob_digest
+                        )
+                    conn.execute(
+                        f"DELETE FROM conversion_jobs WHERE file_id IN ({placeholders})", chunk
+                    )
+                    conn.execute(
+                        f"DELETE FROM file_versions WHERE file_id IN ({placeholders})", chunk
+                    )
+                    conn.execute(f"DELETE FROM files WHERE id IN ({placeholders})", chunk)
+                conn.commit()
+            
+            # コミット後に物理ファイルを削除
+            for paths in deleted.values():
+                self._remove_artifacts(paths)
+            return list(deleted)
+        except markdown_codec.MarkdownCodecError:
+            raise
+        except Exception as e:
+            print(f"Error deleting files: {e}")
+            return []
+    
     def delete_file(self, file_id: str) -> bool:
         """ファイルを削除"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                # ファイル情報を取得
-                file_info = self.get_file(file_id)
-                if not file_info:
+            with self._connect() as conn:
+                # 消す物理ファイルのパスだけを取得（本文は展開しない）
+                row = conn.execute("""
+                    SELECT original_path, markdown_path, blob_digest, markdown_encoding
+                    FROM files WHERE id = ?
+                """, (file_id,)).fetchone()
+                if not row:
                     return False
-                
-                # 物理ファイルを削除
-                if os.path.exists(file_info['original_path']):
-                    os.remove(file_info['original_path'])
+                # 検索インデックスから外すには旧本文の展開が要る
+                markdown_codec.check_decodable(row[3])
                 
                 # データベースから削除
+                conn.execute("DELETE FROM conversion_jobs WHERE file_id = ?", (file_id,))
+                conn.execute("DELETE FROM file_versions WHERE file_id = ?", (file_id,))
                 conn.execute("DELETE FROM files WHERE id = ?", (file_id,))
                 conn.commit()
-                return True
+            
+            # コミット後に物理ファイル（元のPDFとMarkdown）を削除
+            self._remove_artifacts(self._artifact_paths(*row[:3]))
+            return True
+        except markdown_codec.MarkdownCodecError:
+            raise
         except Exception as e:
             print(f"Error deleting file: {e}")
             return False
     
+    def update_file_source(self, file_id: str, filename: str, original_path: str,
+                           file_size: int, blob_digest: Optional[str] = None) -> bool:
+        """再アップロードされたPDFの情報でファイルを更新"""
+        try:
+            with self._connect() as conn:
+                conn.execute("""
+                    UPDATE files
+                    SET filename = ?, original_path = ?, file_size = ?, blob_digest = ?,
+                        conversion_attempts = 0, updated_at = CURRENT_TIMESTAMP
+                    WHERE id = ?
+                """, (filename, original_path, file_size, blob_digest, file_id))
+                conn.commit()
+                return True
+        except Exception as e:
+            print(f"Error updating file source: {e}")
+            return False
+    
+    def list_file_locations(self, after_rowid: int = 0,
+                            limit: int = 500) -> List[Dict[str, Any]]:
+        """保存先の移行用に、ファイルの保存先を rowid 順に取得"""
+        try:
+            with self._connect() as conn:
+                conn.row_factory = sqlite3.Row
+                cursor = conn.execute("""
+                    SELECT rowid, id, original_path, markdown_path, blob_digest
+                    FROM files
+                    WHERE rowid > ?
+                    ORDER BY rowid
+                    LIMIT ?
+                """, (after_rowid, limit))
+                return [dict(row) for row in cursor.fetchall()]
+        except Exception as e:
+            print(f"Error listing file locations: {e}")
+            return []
+    
+    def relocate_markdown(self, file_id: str, old_path: Optional[str], new_path: str) -> bool:
+        """Markdownの保存先を変更（その間に再変換されていれば変更しない）"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.execute("""
+                    UPDATE files SET markdown_path = ?
+                    WHERE id = ? AND markdown_path IS ?
+                """, (new_path, file_id, old_path))
+                conn.commit()
+                return cursor.rowcount > 0
+        except Exception as e:
+            print(f"Error relocating markdown: {e}")
+            return False
+    
+    def relocate_original(self, file_id: str, old_path: str, new_path: str,
+                          blob_digest: str) -> bool:
+        """元のPDFをブロブストアへ移した保存先に変更（その間に再アップロードされていれば変更しない）"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.execute("""
+                    UPDATE files SET original_path = ?, blob_digest = ?
+                    WHERE id = ? AND original_path = ? AND blob_digest IS NULL
+                """, (new_path, blob_digest, file_id, old_path))
+                conn.commit()
+                return cursor.rowcount > 0
+        except Exception as e:
+            print(f"Error relocating original: {e}")
+            return False
+    
+    def is_blob_referenced(self, digest: str) -> bool:
+        """ブロブを参照しているファイルがあるか"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.execute(
+                    "SELECT ref_count FROM blobs WHERE digest = ?", (digest,)
+                )
+                row = cursor.fetchone()
+                return bool(row and row[0] > 0)
+        except Exception as e:
+            print(f"Error checking blob reference: {e}")
+            # 判断できない場合は参照ありとして扱い、削除させない
+            return True
+    
+    def take_unreferenced_blobs(self) -> List[str]:
+        """参照数が0になったブロブの行を削除し、そのダイジェストを返す"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.execute("""
+                    DELETE FROM blobs WHERE ref_count <= 0 RETURNING digest
+                """)
+                digests = [row[0] for row in cursor.fetchall()]
+                conn.commit()
+                return digests
+        except Exception as e:
+            print(f"Error taking unreferenced blobs: {e}")
+            return []
+    
+    def get_blob_digests(self) -> List[str]:
+        """参照されているブロブのダイジェスト"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.execute("SELECT digest FROM blobs WHERE ref_count > 0")
+                return [row[0] for row in cursor.fetchall()]
+        except Exception as e:
+            print(f"Error getting blob digests: {e}")
+            return []
+    
+    def get_blob_statistics(self) -> Dict[str, Any]:
+        """ブロブストアの統計（ユニークなPDF数と参照数）"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.execute("""
+                    SELECT COUNT(*), COALESCE(SUM(ref_count), 0) FROM blobs WHERE ref_count > 0
+                """)
+                blob_count, reference_count = cursor.fetchone()
+                return {"blob_count": blob_count, "reference_count": reference_count}
+        except Exception as e:
+            print(f"Error getting blob statistics: {e}")
+            return {"blob_count": 0, "reference_count": 0}
+    
+    def get_file_statistics(self) -> Dict[str, Dict[str, Any]]:
+        """状態ごとのファイル数・合計サイズ・合計処理時間（本文は読まない）"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.execute("""
+                    SELECT status, COUNT(*), COALESCE(SUM(file_size), 0),
+                           COALESCE(SUM(processing_time), 0)
+                    FROM files GROUP BY status
+                """)
+                return {
+                    status: {"count": count, "total_size": total_size,
+                             "total_processing_time": total_processing_time}
+                    for status, count, total_size, total_processing_time in cursor.fetchall()
+                }
+        except Exception as e:
+            print(f"Error getting file statistics: {e}")
+            return {}
+    
+    def find_files_created_before(self, created_before: str) -> List[str]:
+        """created_before より前に登録されたファイルのIDを取得（created_at の索引を使う）"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.execute("""
+                    SELECT id FROM files WHERE created_at < ? ORDER BY created_at, id
+                """, (created_before,))
+                return [row[0] for row in cursor.fetchall()]
+        except Exception as e:
+            print(f"Error finding old files: {e}")
+            return []
+    
+    def find_cold_files(self, updated_before: str, limit: int = 100) -> List[Dict[str, Any]]:
+        """updated_before より前から更新されていない変換済み・失敗ファイルを取得"""
+        try:
+            with self._connect() as conn:
+                conn.row_factory = sqlite3.Row
+                cursor = conn.execute("""
+                    SELECT id, updated_at FROM files
+                    WHERE status IN ('completed', 'failed') AND updated_at < ?
+                    ORDER BY updated_at
+                    LIMIT ?
+                """, (updated_before, limit))
+                return [dict(row) for row in cursor.fetchall()]
+        except Exception as e:
+            print(f"Error finding cold files: {e}")
+            return []
+    
+    def get_file_version_rows(self, file_id: str) -> Optional[List[Dict[str, Any]]]:
+        """版の履歴の行を保存形式のまま取得（アーカイブ用、古い順）。失敗したら None"""
+        try:
+            with self._connect() as conn:
+                conn.row_factory = sqlite3.Row
+                rows = conn.execute("""
+                    SELECT version, kind, payload, encoding, content_hash, size, page_hashes, created_at
+                    FROM file_versions WHERE file_id = ? ORDER BY version
+                """, (file_id,)).fetchall()
+                return [dict(row) for row in rows]
+        except Exception as e:
+            print(f"Error getting file version rows: {e}")
+            return None
+    
+    def move_file_to_archive(self, file_id: str, expected_updated_at: str,
+                             location: Dict[str, Any], version_count: int = 0) -> bool:
+        """ファイルを files から外し、パックファイル上の位置を索引に登録
+
+        パックファイルへの書き込み後に更新されたファイルは移さない（False を返す）。
+        版の履歴はレコードに書いた数（version_count）と一致する場合だけ、同じトランザクションで削除する
+        """
+        try:
+            with self._connect() as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                row = conn.execute("""
+                    SELECT filename, original_path, markdown_path, blob_digest, created_at,
+                           (SELECT COUNT(*) FROM file_versions WHERE file_id = files.id)
+                    FROM files WHERE id = ? AND updated_at = ?
+                """, (file_id, expected_updated_at)).fetchone()
+                if row is None or row[5] != version_count:
+                    conn.rollback()
+                    return False
+                filename, original_path, markdown_path, blob_digest, created_at, _ = row
+                
+                conn.execute("""
+                    INSERT OR REPLACE INTO archived_files
+                        (id, filename, pack, offset, length, created_at, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                """, (file_id, filename, location["pack"], location["offset"],
+                      location["length"], created_at, expected_updated_at))
+                conn.execute("DELETE FROM conversion_jobs WHERE file_id = ?", (file_id,))
+                conn.execute("DELETE FROM conversion_logs WHERE file_id = ?", (file_id,))
+                conn.execute("DELETE FROM file_versions WHERE file_id = ?", (file_id,))
+                conn.execute("DELETE FROM files WHERE id = ?", (file_id,))
+                conn.commit()
+            
+            self._remove_artifacts(self._artifact_paths(original_path, markdown_path, blob_digest))
+            return True
+        except Exception as e:
+            print(f"Error moving file to archive: {e}")
+            return False
+    
+    def get_archived_file(self, file_id: str) -> Optional[Dict[str, Any]]:
+        """アーカイブ済みファイルの索引を取得"""
+        try:
+            with self._connect() as conn:
+                conn.row_factory = sqlite3.Row
+                row = conn.execute(
+                    "SELECT * FROM archived_files WHERE id = ?", (file_id,)
+                ).fetchone()
+                return dict(row) if row else None
+        except Exception as e:
+            print(f"Error getting archived file: {e}")
+            return None
+    
+    def get_archive_statistics(self) -> Dict[str, Any]:
+        """アーカイブ済みファイルの件数とパックファイル上のサイズ"""
+        try:
+            with self._connect() as conn:
+                files, packs, size = conn.execute("""
+                    SELECT COUNT(*), COUNT(DISTINCT pack), COALESCE(SUM(length), 0)
+                    FROM archived_files
+                """).fetchone()
+                return {"files": files, "packs": packs, "size_bytes": size}
+        except Exception as e:
+            print(f"Error getting archive statistics: {e}")
+            return {"files": 0, "packs": 0, "size_bytes": 0}
+    
+    def get_archive_pack_extents(self) -> Dict[str, int]:
+        """パックファイルごとの参照されている末尾の位置"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.execute("""
+                    SELECT pack, MAX(offset + length) FROM archived_files GROUP BY pack
+                """)
+                return dict(cursor.fetchall())
+        except Exception as e:
+            print(f"Error getting archive pack extents: {e}")
+            return {}
+    
+    def get_storage_status(self) -> Dict[str, Any]:
+        """DBファイルのページ数と空きページ数（断片化の目安）"""
+        try:
+            with self._connect() as conn:
+                page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+                page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+                freelist_count = conn.execute("PRAGMA freelist_count").fetchone()[0]
+                auto_vacuum = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+            return {
+                "auto_vacuum": {0: "none", 1: "full", 2: "incremental"}.get(auto_vacuum),
+                "page_size": page_size,
+                "page_count": page_count,
+                "freelist_count": freelist_count,
+                "size_bytes": page_size * page_count,
+                "free_bytes": page_size * freelist_count,
+                "free_ratio": round(freelist_count / page_count, 4) if page_count else 0
+            }
+        except Exception as e:
+            print(f"Error getting storage status: {e}")
+            return {}
+    
+    def incremental_vacuum(self, pages: int) -> int:
+        """空きページを最大 pages ページ返す（返したページ数）"""
+        try:
+            with self._connect() as conn:
+                before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+                # execute() では1ページ分しか実行されないため executescript で最後まで実行する
+                conn.executescript(f"PRAGMA incremental_vacuum({int(pages)});")
+                after = conn.execute("PRAGMA freelist_count").fetchone()[0]
+                # WALに書かれた変更をDBファイルへ反映してファイルを縮める（書き込みは待たない）
+                conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchall()
+                return int(before - after)
+        except Exception as e:
+            print(f"Error running incremental vacuum: {e}")
+            return 0
+    
+    def optimize(self, analyze: bool = False) -> bool:
+        """クエリプランナーの統計を更新（analyze=True なら全テーブルを ANALYZE）
+
+        ANALYZE はインデックスごとに ANALYSIS_LIMIT 行までの標本で統計を作る
+        （全行を読まないため、大きなDBでも短時間で終わる）
+        """
+        try:
+            with self._connect() as conn:
+                conn.execute(f"PRAGMA analysis_limit = {ANALYSIS_LIMIT}").fetchall()
+                if analyze:
+                    conn.execute("ANALYZE")
+                conn.execute("PRAGMA optimize").fetchall()
+                conn.commit()
+                return True
+        except Exception as e:
+            print(f"Error optimizing database: {e}")
+            return False
+    
+    def backup_to(self, destination: str, pages: int = 256,
+                  pause_seconds: float = 0.0) -> Dict[str, Any]:
+        """オンラインバックアップAPIでDBを destination にコピー
+
+        pages ページずつコピーし、各ステップの間に pause_seconds 待つ。
+        WALモードでは読み取りトランザクションを開いたままコピーするため、
+        その時点のスナップショットが得られ、書き込みは止まらない
+        （他の接続の書き込みでコピーがやり直しになることもない）。
+        """
+        source = self._connect()
+        source.isolation_level = None
+        target = sqlite3.connect(destination)
+        progress = {"steps": 0, "pages": 0}
+        
+        def on_progress(status: int, remaining: int, total: int) -> None:
+            progress["steps"] += 1
+            progress["pages"] = total
+            if pause_seconds:
+                time.sleep(pause_seconds)
+        
+        try:
+            source.execute("BEGIN")
+            source.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+            source.backup(target, pages=pages, progress=on_progress)
+            source.execute("COMMIT")
+            return progress
+        finally:
+            target.close()
+            source.close()
+    
+    def open_copy(self, path: str) -> "DatabaseManager":
+        """backup_to で作成したコピーを開く"""
+        return DatabaseManager(path)
+    
+    def enqueue_conversion_job(self, file_id: str, action: str,
+                               sort_key: float) -> Optional[int]:
+        """変換ジョブをキューに追加"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.execute("""
+                    INSERT INTO conversion_jobs (file_id, action, sort_key)
+                    VALUES (?, ?, ?)
+                """, (file_id, action, sort_key))
+                conn.commit()
+                return cursor.lastrowid
+        except Exception as e:
+            print(f"Error enqueuing conversion job: {e}")
+            return None
+    
+    def claim_conversion_job(self, worker_id: str,
+                             lease_seconds: float) -> Optional[Dict[str, Any]]:
+        """実行可能な変換ジョブを1件リースする
+
+        未着手のジョブと、リース期限切れ（ワーカー停止）のジョブが対象。
+        見積もりコスト順（sort_key）で取り出す。
+        """
+        conn = None
+        try:
+            conn = self._connect()
+            conn.isolation_level = None
+            conn.row_factory = sqlite3.Row
+            # 取り出しと確保の間に他のワーカーが割り込まないよう書き込みロックを取る
+            conn.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            row = conn.execute("""
+                SELECT j.id, j.file_id, j.action, j.attempts,
+                       f.filename, f.original_path, f.file_size
+                FROM conversion_jobs j
+                JOIN files f ON f.id = j.file_id
+                WHERE j.state = 'queued'
+                   OR (j.state = 'leased' AND j.lease_expires_at < ?)
+                ORDER BY j.sort_key
+                LIMIT 1
+            """, (now,)).fetchone()
+            
+            if not row:
+                conn.execute("COMMIT")
+                return None
+            
+            conn.execute("""
+                UPDATE conversion_jobs
+                SET state = 'leased', lease_owner = ?, lease_expires_at = ?,
+                    attempts = attempts + 1, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            """, (worker_id, now + lease_seconds, row["id"]))
+            conn.execute("COMMIT")
+            
+            job = dict(row)
+            job["attempts"] += 1
+            return job
+        except Exception as e:
+            if conn is not None and conn.in_transaction:
+                conn.execute("ROLLBACK")
+            print(f"Error claiming conversion job: {e}")
+            return None
+        finally:
+            if conn is not None:
+                conn.close()
+    
+    def heartbeat_conversion_job(self, job_id: int, worker_id: str,
+                                 lease_seconds: float) -> bool:
+        """リースを延長（リースを失っていた場合はFalse）"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.execute("""
+                    UPDATE conversion_jobs
+                    SET lease_expires_at = ?, updated_at = CURRENT_TIMESTAMP
+                    WHERE id = ? AND lease_owner = ? AND state = 'leased'
+                """, (time.time() + lease_seconds, job_id, worker_id))
+                conn.commit()
+                return cursor.rowcount == 1
+        except Exception as e:
+            print(f"Error extending conversion job lease: {e}")
+            return False
+    
+    def finish_conversion_job(self, job_id: int, worker_id: str, state: str) -> bool:
+        """リース中のジョブを完了状態（done / failed）にする"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.execute("""
+                    UPDATE conversion_jobs
+                    SET state = ?, lease_expires_at = NULL, updated_at = CURRENT_TIMESTAMP
+                    WHERE id = ? AND lease_owner = ? AND state = 'leased'
+                """, (state, job_id, worker_id))
+                conn.commit()
+                return cursor.rowcount == 1
+        except Exception as e:
+            print(f"Error finishing conversion job: {e}")
+            return False
+    
+    def cancel_conversion_jobs(self, file_id: str) -> int:
+        """ファイルの待機中・リース中のジョブをキャンセル"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.execute("""
+                    UPDATE conversion_jobs
+                    SET state = 'cancelled', lease_expires_at = NULL,
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE file_id = ? AND state IN ('queued', 'leased')
+                """, (file_id,))
+                conn.commit()
+                return cursor.rowcount
+        except Exception as e:
+            print(f"Error cancelling conversion jobs: {e}")
+            return 0
+    
+    def report_worker_status(self, worker_id: str, hostname: str, pid: int,
+                             state: str, jobs_done: int, rss_bytes: Optional[int]) -> bool:
+        """変換ワーカーの稼働状況を記録"""
+        try:
+            with self._connect() as conn:
+                conn.execute("""
+                    INSERT INTO conversion_workers
+                        (worker_id, hostname, pid, state, jobs_done, rss_bytes)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(worker_id) DO UPDATE SET
+                        state = excluded.state,
+                        jobs_done = excluded.jobs_done,
+                        rss_bytes = excluded.rss_bytes,
+                        last_seen_at = CURRENT_TIMESTAMP
+                """, (worker_id, hostname, pid, state, jobs_done, rss_bytes))
+                conn.commit()
+                return True
+        except Exception as e:
+            print(f"Error reporting worker status: {e}")
+            return False
+    
+    def list_worker_status(self, seen_within_seconds: Optional[float] = None) -> List[Dict[str, Any]]:
+        """変換ワーカーの稼働状況を取得"""
+        try:
+            with self._connect() as conn:
+                conn.row_factory = sqlite3.Row
+                if seen_within_seconds is None:
+                    cursor = conn.execute("""
+                        SELECT * FROM conversion_workers ORDER BY started_at
+                    """)
+                else:
+                    cursor = conn.execute("""
+                        SELECT * FROM conversion_workers
+                        WHERE last_seen_at >= datetime('now', ?)
+                        ORDER BY started_at
+                    """, (f"-{int(seen_within_seconds)} seconds",))
+                return [dict(row) for row in cursor.fetchall()]
+        except Exception as e:
+            print(f"Error listing worker status: {e}")
+            return []
+    
+    def find_stale_processing_files(self, stale_seconds: float,
+                                    limit: int = 100) -> List[Dict[str, Any]]:
+        """一定時間以上 PROCESSING のまま放置されているファイルを取得
+
+        キューで待機中・リース中のジョブがあるファイルと、
+        変換中のプロセスがハートビート（heartbeat_at）を更新しているファイルは対象外
+        """
+        try:
+            with self._connect() as conn:
+                conn.row_factory = sqlite3.Row
+                stale_before = f"-{int(stale_seconds)} seconds"
+                cursor = conn.execute("""
+                    SELECT f.id, f.filename, f.original_path, f.file_size,
+                           f.updated_at, f.heartbeat_at, f.conversion_attempts
+                    FROM files f
+                    WHERE f.status = 'processing'
+                      AND f.updated_at < datetime('now', ?)
+                      AND (f.heartbeat_at IS NULL OR f.heartbeat_at < datetime('now', ?))
+                      AND NOT EXISTS (
+                          SELECT 1 FROM conversion_jobs j
+                          WHERE j.file_id = f.id AND j.state IN ('queued', 'leased')
+                      )
+                    ORDER BY f.updated_at
+                    LIMIT ?
+                """, (stale_before, stale_before, limit))
+                return [dict(row) for row in cursor.fetchall()]
+        except Exception as e:
+            print(f"Error finding stale processing files: {e}")
+            return []
+    
+    def touch_conversions(self, file_ids: List[str]) -> int:
+        """このプロセスで待機中・変換中のファイルのハートビートを更新（更新件数を返す）"""
+        try:
+            unique_ids = list(dict.fromkeys(file_ids))
+            touched = 0
+            with self._connect() as conn:
+                for start in range(0, len(unique_ids), BATCH_CHUNK_SIZE):
+                    chunk = unique_ids[start:start + BATCH_CHUNK_SIZE]
+                    placeholders = ", ".join("?" for _ in chunk)
+                    cursor = conn.execute(f"""
+                        UPDATE files SET heartbeat_at = CURRENT_TIMESTAMP
+                        WHERE id IN ({placeholders}) AND status = 'processing'
+                    """, chunk)
+                    touched += cursor.rowcount
+                conn.commit()
+            return touched
+        except Exception as e:
+            print(f"Error touching conversions: {e}")
+            return 0
+    
+    def mark_recovery_attempt(self, file_id: str, expected_updated_at: str,
+                              expected_heartbeat_at: Optional[str] = None) -> bool:
+        """復旧の試行回数を加算（他のプロセスが先に復旧した・変換を続けている場合はFalse）"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.execute("""
+                    UPDATE files
+                    SET conversion_attempts = conversion_attempts + 1,
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE id = ? AND status = 'processing' AND updated_at = ?
+                      AND heartbeat_at IS ?
+                """, (file_id, expected_updated_at, expected_heartbeat_at))
+                conn.commit()
+                return cursor.rowcount == 1
+        except Exception as e:
+            print(f"Error marking recovery attempt: {e}")
+            return False
+    
     def add_conversion_log(self, file_id: str, action: str, status: str, 
                           message: Optional[str] = None, 
                           processing_time: Optional[float] = None) -> bool:
         """変換ログを追加"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 conn.execute("""
                     INSERT INTO conversion_logs (file_id, action, status, message, processing_time)
                     VALUES (?, ?, ?, ?, ?)
@@ -208,7 +1856,7 @@ class DatabaseManager:
     def get_conversion_logs(self, file_id: str) -> List[Dict[str, Any]]:
         """変換ログを取得"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 conn.row_factory = sqlite3.Row
                 cursor = conn.execute("""
                     SELECT * FROM conversion_logs 
@@ -228,13 +1876,17 @@ class DatabaseManager:
     def clear_all_data(self) -> bool:
         """テスト用：全データを削除"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 # 外部キー制約を一時的に無効化
                 conn.execute("PRAGMA foreign_keys = OFF")
                 
                 # 全テーブルのデータを削除
                 conn.execute("DELETE FROM conversion_logs")
+                conn.execute("DELETE FROM conversion_jobs")
+                conn.execute("DELETE FROM conversion_workers")
                 conn.execute("DELETE FROM files")
+                conn.execute("DELETE FROM archived_files")
+                conn.execute("DELETE FROM file_versions")
                 
                 # 外部キー制約を再有効化
                 conn.execute("PRAGMA foreign_keys = ON")
@@ -245,5 +1897,436 @@ class DatabaseManager:
             return False
 
 
+def _shard_path(db_path: str, index: int) -> str:
+    """シャードのDBファイルのパス（data/database.db -> data/database.shard0.db）"""
+    path = Path(db_path)
+    return str(path.with_name(f"{path.stem}.shard{index}{path.suffix}"))
+
+
+def _null_first(value: Any) -> tuple:
+    """SQLite と同じく NULL を最小として比較するためのキー"""
+    return (0, 0) if value is None else (1, value)
+
+
+# rowid を使うカーソルでシャード番号を表す位置（シャード番号 << 40 | rowid）
+SHARD_CURSOR_BITS = 40
+
+
+class ShardedDatabaseManager:
+    """ファイルIDで複数のSQLiteファイルに振り分けるデータベース管理クラス
+
+    1つのファイルに関する操作（ファイル行・変換ログ・変換ジョブ・アーカイブ索引）は
+    そのファイルのシャードだけで行う。シャードごとに書き込みロックが分かれるため、
+    書き込みはシャード数に応じて並行できる。一覧・検索・統計は全シャードに問い合わせて
+    結果をマージする。ワーカーの稼働状況はシャード0に記録する。
+
+    シャード数を変えるとファイルの振り分け先が変わるため、運用中は変更しないこと
+    """
+    
+    def __init__(self, db_path: Optional[str] = None, shard_count: int = 2):
+        if db_path is None:
+            db_path = default_db_path()
+        self.db_path = db_path
+        self.shards = [DatabaseManager(_shard_path(db_path, index)) for index in range(shard_count)]
+        # ラウンドロビンでジョブを取り出すシャード
+        self._next_claim = 0
+    
+    @property
+    def search_enabled(self) -> bool:
+        return all(shard.search_enabled for shard in self.shards)
+    
+    def shard_index(self, file_id: str) -> int:
+        """ファイルIDの振り分け先（プロセスをまたいで安定したハッシュ）"""
+        digest = hashlib.sha1(file_id.encode("utf-8")).digest()
+        return int.from_bytes(digest[:4], "big") % len(self.shards)
+    
+    def shard_for(self, file_id: str) -> DatabaseManager:
+        return self.shards[self.shard_index(file_id)]
+    
+    def _group_by_shard(self, file_ids: List[str]) -> Dict[int, List[str]]:
+        groups: Dict[int, List[str]] = {}
+        for file_id in dict.fromkeys(file_ids):
+            groups.setdefault(self.shard_index(file_id), []).append(file_id)
+        return groups
+    
+    # --- ジョブID・文書IDはシャード内の番号とシャード番号から作る ---
+    
+    def _global_id(self, index: int, local_id: Optional[int]) -> Optional[int]:
+        return None if local_id is None else local_id * len(self.shards) + index
+    
+    def _local_id(self, global_id: int) -> Tuple[int, int]:
+        """(シャード番号, シャード内の番号)"""
+        return global_id % len(self.shards), global_id // len(self.shards)
+    
+    # --- 1ファイルの操作（そのファイルのシャードだけを使う） ---
+    
+    def insert_file(self, file_id: str, *args: Any, **kwargs: Any) -> bool:
+        return self.shard_for(file_id).insert_file(file_id, *args, **kwargs)
+    
+    def update_file_status(self, file_id: str, *args: Any, **kwargs: Any) -> bool:
+        return self.shard_for(file_id).update_file_status(file_id, *args, **kwargs)
+    
+    def update_file_source(self, file_id: str, *args: Any, **kwargs: Any) -> bool:
+        return self.shard_for(file_id).update_file_source(file_id, *args, **kwargs)
+    
+    def get_file(self, file_id: str, columns: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
+        return self.shard_for(file_id).get_file(file_id, columns)
+    
+    def get_file_validator(self, file_id: str) -> Optional[Dict[str, Any]]:
+        return self.shard_for(file_id).get_file_validator(file_id)
+    
+    def get_markdown_payload(self, file_id: str) -> Optional[Dict[str, Any]]:
+        return self.shard_for(file_id).get_markdown_payload(file_id)
+    
+    def list_file_versions(self, file_id: str) -> List[Dict[str, Any]]:
+        return self.shard_for(file_id).list_file_versions(file_id)
+    
+    def restore_file_versions(self, file_id: str,
+                              versions: List[int]) -> Dict[int, Dict[str, Any]]:
+        return self.shard_for(file_id).restore_file_versions(file_id, versions)
+    
+    def get_file_version(self, file_id: str, version: int) -> Optional[Dict[str, Any]]:
+        return self.shard_for(file_id).get_file_version(file_id, version)
+    
+    def delete_file(self, file_id: str) -> bool:
+        return self.shard_for(file_id).delete_file(file_id)
+    
+    def relocate_markdown(self, file_id: str, *args: Any) -> bool:
+        return self.shard_for(file_id).relocate_markdown(file_id, *args)
+    
+    def relocate_original(self, file_id: str, *args: Any) -> bool:
+        return self.shard_for(file_id).relocate_original(file_id, *args)
+    
+    def mark_recovery_attempt(self, file_id: str, *args: Any) -> bool:
+        return self.shard_for(file_id).mark_recovery_attempt(file_id, *args)
+    
+    def add_conversion_log(self, file_id: str, *args: Any, **kwargs: Any) -> bool:
+        return self.shard_for(file_id).add_conversion_log(file_id, *args, **kwargs)
+    
+    def get_conversion_logs(self, file_id: str) -> List[Dict[str, Any]]:
+        return self.shard_for(file_id).get_conversion_logs(file_id)
+    
+    def move_file_to_archive(self, file_id: str, *args: Any) -> bool:
+        return self.shard_for(file_id).move_file_to_archive(file_id, *args)
+    
+    def get_file_version_rows(self, file_id: str) -> Optional[List[Dict[str, Any]]]:
+        return self.shard_for(file_id).get_file_version_rows(file_id)
+    
+    def get_archived_file(self, file_id: str) -> Optional[Dict[str, Any]]:
+        return self.shard_for(file_id).get_archived_file(file_id)
+    
+    def cancel_conversion_jobs(self, file_id: str) -> int:
+        return self.shard_for(file_id).cancel_conversion_jobs(file_id)
+    
+    def enqueue_conversion_job(self, file_id: str, action: str, sort_key: float) -> Optional[int]:
+        index = self.shard_index(file_id)
+        return self._global_id(index, self.shards[index].enqueue_conversion_job(file_id, action, sort_key))
+    
+    def claim_conversion_job(self, worker_id: str,
+                             lease_seconds: float) -> Optional[Dict[str, Any]]:
+        """シャードを順番に見て、最初に見つかったジョブをリースする"""
+        start = self._next_claim
+        self._next_claim = (start + 1) % len(self.shards)
+        for offset in range(len(self.shards)):
+            index = (start + offset) % len(self.shards)
+            job = self.shards[index].claim_conversion_job(worker_id, lease_seconds)
+            if job:
+                job["id"] = self._global_id(index, job["id"])
+                return job
+        return None
+    
+    def heartbeat_conversion_job(self, job_id: int, worker_id: str, lease_seconds: float) -> bool:
+        index, local_id = self._local_id(job_id)
+        return self.shards[index].heartbeat_conversion_job(local_id, worker_id, lease_seconds)
+    
+    def finish_conversion_job(self, job_id: int, worker_id: str, state: str) -> bool:
+        index, local_id = self._local_id(job_id)
+        return self.shards[index].finish_conversion_job(local_id, worker_id, state)
+    
+    # --- 複数ファイルの操作（シャードごとにまとめて実行） ---
+    
+    def get_files(self, file_ids: List[str],
+                  columns: Optional[List[str]] = None) -> Dict[str, Dict[str, Any]]:
+        files: Dict[str, Dict[str, Any]] = {}
+        for index, ids in self._group_by_shard(file_ids).items():
+            files.update(self.shards[index].get_files(ids, columns))
+        return files
+    
+    def touch_conversions(self, file_ids: List[str]) -> int:
+        return sum(
+            self.shards[index].touch_conversions(ids)
+            for index, ids in self._group_by_shard(file_ids).items()
+        )
+    
+    def delete_files(self, file_ids: List[str]) -> List[str]:
+        deleted: List[str] = []
+        for index, ids in self._group_by_shard(file_ids).items():
+            deleted.extend(self.shards[index].delete_files(ids))
+        return deleted
+    
+    # --- 全シャードへの問い合わせとマージ ---
+    
+    def list_files(self, page: int = 1, per_page: int = 10,
+                   columns: Optional[List[str]] = None,
+                   filters: Optional[Dict[str, Any]] = None,
+                   sort: Optional[str] = None) -> Dict[str, Any]:
+        """各シャードの先頭 page * per_page 件を並び順でk-wayマージしてページを切り出す
+
+        page * per_page は LIST_MAX_OFFSET まで（各シャードから読む行数の上限）
+        """
+        try:
+            if page * per_page > LIST_MAX_OFFSET:
+                raise ValueError(f"page * per_page exceeds LIST_MAX_OFFSET ({LIST_MAX_OFFSET})")
+            sort = sort or "-created_at"
+            column = sort.lstrip("-")
+            if column not in LIST_SORT_COLUMNS:
+                raise ValueError(f"Unknown sort column: {column}")
+            # 各シャードと同じく (並び替えの列, id) の順でマージする
+            extra = [] if columns is None else [name for name in (column, "id") if name not in columns]
+            shard_columns = None if columns is None else [*columns, *extra]
+            
+            results = [
+                shard.list_files(1, page * per_page, shard_columns, filters, sort)
+                for shard in self.shards
+            ]
+            merged = heapq.merge(
+                *(result["files"] for result in results),
+                key=lambda row: (_null_first(row[column]), row["id"]),
+                reverse=sort.startswith("-")
+            )
+            files = list(itertools.islice(merged, (page - 1) * per_page, page * per_page))
+            for file_dict in files:
+                for name in extra:
+                    del file_dict[name]
+            
+            return {
+                "files": files,
+                "total_count": sum(result["total_count"] for result in results),
+                "page": page,
+                "per_page": per_page
+            }
+        except markdown_codec.MarkdownCodecError:
+            # 本文を展開できないのは設定の不一致なので、見つからない扱いにしない
+            raise
+        except Exception as e:
+            print(f"Error listing files: {e}")
+            return {"files": [], "total_count": 0, "page": page, "per_page": per_page}
+    
+    def get_list_version(self) -> Optional[int]:
+        """各シャードの変更カウンターの合計（どのシャードが変わっても増える）"""
+        total = 0
+        for shard in self.shards:
+            version = shard.get_list_version()
+            if version is None:
+                return None
+            total += version
+        return total
+    
+    def iter_files(self, *args: Any, **kwargs: Any) -> Iterator[Dict[str, Any]]:
+        for shard in self.shards:
+            yield from shard.iter_files(*args, **kwargs)
+    
+    def search_files(self, match_query: str, like_terms: Optional[List[str]] = None,
+                     limit: int = 20,
+                     after: Optional[tuple] = None) -> List[Dict[str, Any]]:
+        """各シャードの検索結果を関連度順にマージ
+
+        関連度（bm25）はシャードごとの統計で計算されるため、順位はおおよそのもの
+        """
+        results = []
+        for index, shard in enumerate(self.shards):
+            shard_after = None
+            if after is not None:
+                # 全体の doc_id が after より大きい行 = シャード内の doc_id が次の値より大きい行
+                shard_after = (after[0], (after[1] - index) // len(self.shards))
+            rows = shard.search_files(match_query, like_terms, limit, shard_after)
+            for row in rows:
+                row["doc_id"] = self._global_id(index, row["doc_id"])
+            results.append(rows)
+        merged = heapq.merge(*results, key=lambda row: (row["score"], row["doc_id"]))
+        return list(itertools.islice(merged, limit))
+    
+    def get_file_statistics(self) -> Dict[str, Dict[str, Any]]:
+        """各シャードの状態ごとの集計を合計"""
+        totals: Dict[str, Dict[str, Any]] = {}
+        for shard in self.shards:
+            for status, stat in shard.get_file_statistics().items():
+                total = totals.setdefault(
+                    status, {"count": 0, "total_size": 0, "total_processing_time": 0}
+                )
+                for key, value in stat.items():
+                    total[key] += value
+        return totals
+    
+    def find_files_created_before(self, created_before: str) -> List[str]:
+        file_ids: List[str] = []
+        for shard in self.shards:
+            file_ids.extend(shard.find_files_created_before(created_before))
+        return file_ids
+    
+    def find_cold_files(self, updated_before: str, limit: int = 100) -> List[Dict[str, Any]]:
+        merged = heapq.merge(
+            *(shard.find_cold_files(updated_before, limit) for shard in self.shards),
+            key=lambda row: row["updated_at"]
+        )
+        return list(itertools.islice(merged, limit))
+    
+    def find_stale_processing_files(self, stale_seconds: float,
+                                    limit: int = 100) -> List[Dict[str, Any]]:
+        merged = heapq.merge(
+            *(shard.find_stale_processing_files(stale_seconds, limit) for shard in self.shards),
+            key=lambda row: row["updated_at"]
+        )
+        return list(itertools.islice(merged, limit))
+    
+    def _scan_shards(self, after_rowid: int, limit: int,
+                     scan: Callable[[int, int, int], tuple]) -> tuple:
+        """rowid 順のバッチ処理をシャード順に続ける
+
+        カーソルは「シャード番号 << SHARD_CURSOR_BITS | rowid」で表す。
+        scan(シャード番号, シャード内の rowid, 件数) は (走査した件数, 最後の rowid, 結果) を返す。
+        戻り値は (次のカーソル, 各シャードの結果のリスト)
+        """
+        index = after_rowid >> SHARD_CURSOR_BITS
+        local_rowid = after_rowid & ((1 << SHARD_CURSOR_BITS) - 1)
+        scanned = 0
+        results = []
+        while index < len(self.shards) and scanned < limit:
+            requested = limit - scanned
+            count, last_rowid, result = scan(index, local_rowid, requested)
+            results.append(result)
+            scanned += count
+            if count:
+                after_rowid = (index << SHARD_CURSOR_BITS) | last_rowid
+            if count < requested:
+                # このシャードは走査し終えた
+                index += 1
+                local_rowid = 0
+        return after_rowid, results
+    
+    def list_file_locations(self, after_rowid: int = 0,
+                            limit: int = 500) -> List[Dict[str, Any]]:
+        def scan(index: int, after: int, count: int) -> tuple:
+            rows = self.shards[index].list_file_locations(after, count)
+            last_rowid = rows[-1]["rowid"] if rows else after
+            for row in rows:
+                row["rowid"] = (index << SHARD_CURSOR_BITS) | row["rowid"]
+            return len(rows), last_rowid, rows
+        
+        _, results = self._scan_shards(after_rowid, limit, scan)
+        return [row for rows in results for row in rows]
+    
+    def compress_markdown_batch(self, after_rowid: int = 0, limit: int = 200,
+                                codec: Optional[str] = None) -> Dict[str, int]:
+        def scan(index: int, after: int, count: int) -> tuple:
+            result = self.shards[index].compress_markdown_batch(after, count, codec)
+            return result["scanned"], result["last_rowid"], result
+        
+        last_rowid, results = self._scan_shards(after_rowid, limit, scan)
+        total = {"scanned": 0, "compressed": 0, "bytes_before": 0, "bytes_after": 0}
+        for result in results:
+            for key in total:
+                total[key] += result[key]
+        total["last_rowid"] = last_rowid
+        return total
+    
+    # --- ブロブの参照数はシャードごとに持つため、削除前に全シャードを確認する ---
+    
+    def is_blob_referenced(self, digest: str) -> bool:
+        return any(shard.is_blob_referenced(digest) for shard in self.shards)
+    
+    def take_unreferenced_blobs(self) -> List[str]:
+        candidates = {digest for shard in self.shards for digest in shard.take_unreferenced_blobs()}
+        return [digest for digest in candidates if not self.is_blob_referenced(digest)]
+    
+    def get_blob_statistics(self) -> Dict[str, Any]:
+        """参照数は合計、PDF数は複数シャードから参照されるものを1つと数える"""
+        digests: set = set()
+        reference_count = 0
+        for shard in self.shards:
+            digests.update(shard.get_blob_digests())
+            reference_count += shard.get_blob_statistics()["reference_count"]
+        return {"blob_count": len(digests), "reference_count": reference_count}
+    
+    def get_archive_statistics(self) -> Dict[str, Any]:
+        stats = [shard.get_archive_statistics() for shard in self.shards]
+        return {
+            "files": sum(stat["files"] for stat in stats),
+            "packs": len(self.get_archive_pack_extents()),
+            "size_bytes": sum(stat["size_bytes"] for stat in stats)
+        }
+    
+    def get_archive_pack_extents(self) -> Dict[str, int]:
+        extents: Dict[str, int] = {}
+        for shard in self.shards:
+            for pack, end in shard.get_archive_pack_extents().items():
+                extents[pack] = max(end, extents.get(pack, 0))
+        return extents
+    
+    # --- DBファイルの管理（全シャード） ---
+    
+    def get_storage_status(self) -> Dict[str, Any]:
+        """全シャードの合計（シャードごとの値は shards に入れる）"""
+        shards = [shard.get_storage_status() for shard in self.shards]
+        page_count = sum(status.get("page_count", 0) for status in shards)
+        freelist_count = sum(status.get("freelist_count", 0) for status in shards)
+        return {
+            "auto_vacuum": shards[0].get("auto_vacuum"),
+            "page_count": page_count,
+            "freelist_count": freelist_count,
+            "size_bytes": sum(status.get("size_bytes", 0) for status in shards),
+            "free_bytes": sum(status.get("free_bytes", 0) for status in shards),
+            "free_ratio": round(freelist_count / page_count, 4) if page_count else 0,
+            "shards": shards
+        }
+    
+    def incremental_vacuum(self, pages: int) -> int:
+        return sum(shard.incremental_vacuum(pages) for shard in self.shards)
+    
+    def optimize(self, analyze: bool = False) -> bool:
+        return all([shard.optimize(analyze) for shard in self.shards])
+    
+    def enable_incremental_vacuum(self) -> Dict[str, Any]:
+        results = [shard.enable_incremental_vacuum() for shard in self.shards]
+        return {"migrated": any(result["migrated"] for result in results),
+                "auto_vacuum": results[0]["auto_vacuum"]}
+    
+    def backup_to(self, destination: str, pages: int = 256,
+                  pause_seconds: float = 0.0) -> Dict[str, Any]:
+        """シャードごとにコピー（シャード間で同じ時点のスナップショットにはならない）"""
+        progress = {"steps": 0, "pages": 0}
+        for index, shard in enumerate(self.shards):
+            result = shard.backup_to(_shard_path(destination, index), pages, pause_seconds)
+            progress["steps"] += result["steps"]
+            progress["pages"] += result["pages"]
+        return progress
+    
+    def open_copy(self, path: str) -> "ShardedDatabaseManager":
+        return ShardedDatabaseManager(path, len(self.shards))
+    
+    # --- ワーカーの稼働状況（シャード0） ---
+    
+    def report_worker_status(self, *args: Any, **kwargs: Any) -> bool:
+        return self.shards[0].report_worker_status(*args, **kwargs)
+    
+    def list_worker_status(self, *args: Any, **kwargs: Any) -> List[Dict[str, Any]]:
+        return self.shards[0].list_worker_status(*args, **kwargs)
+    
+    def clear_all_data(self) -> bool:
+        return all([shard.clear_all_data() for shard in self.shards])
+
+
+def create_database_manager(db_path: Optional[str] = None,
+                            shard_count: Optional[int] = None
+                            ) -> Union[DatabaseManager, "ShardedDatabaseManager"]:
+    """DATABASE_SHARDS が2以上ならシャード分割したデータベース管理を作成"""
+    if shard_count is None:
+        shard_count = int(os.getenv("DATABASE_SHARDS", "1"))
+    # メモリ上のDBは書き込みを共有接続で直列化するため分割しない
+    if shard_count > 1 and not is_ephemeral():
+        return ShardedDatabaseManager(db_path, shard_count)
+    return DatabaseManager(db_path)
+
+
 # グローバルインスタンス
-db_manager = DatabaseManager()
+db_manager = create_database_manager()
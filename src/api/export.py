@@ -0,0 +1,50 @@
+"""
+エクスポートコマンド
+
+変換済みドキュメントを NDJSON または tar アーカイブとして書き出す。
+
+使い方:
+    python -m src.api.export --format ndjson --output corpus.ndjson
+    python -m src.api.export --format tar --since "2024-01-01 00:00:00" > corpus.tar
+"""
+
+import argparse
+import sys
+from typing import List, Optional
+
+from .models import FileStatus
+from .services.export_service import EXPORT_FORMATS, ExportService
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """コマンドラインエントリーポイント"""
+    parser = argparse.ArgumentParser(description="変換済みドキュメントのエクスポート")
+    parser.add_argument("--format", choices=list(EXPORT_FORMATS), default="ndjson",
+                        help="出力形式")
+    parser.add_argument("--status", default=FileStatus.COMPLETED.value,
+                        help="対象の状態（'all' ですべて）")
+    parser.add_argument("--since", default=None,
+                        help="この日時以降に更新されたものだけを出力（例: 2024-01-01 00:00:00）")
+    parser.add_argument("--output", default="-", help="出力先ファイル（'-' で標準出力）")
+    parser.add_argument("--batch-size", type=int, default=500, help="1回に読み出す行数")
+    args = parser.parse_args(argv)
+
+    status = None if args.status == "all" else args.status
+    chunks = ExportService(batch_size=args.batch_size).iter_export(
+        args.format, status=status, updated_since=args.since
+    )
+
+    if args.output == "-":
+        output = sys.stdout.buffer
+        for chunk in chunks:
+            output.write(chunk)
+        output.flush()
+        return
+
+    with open(args.output, "wb") as output:
+        for chunk in chunks:
+            output.write(chunk)
+
+
+if __name__ == "__main__":
+    main()
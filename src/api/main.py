@@ -4,22 +4,62 @@ PDF to Markdown API
 PDFファイルをMarkdown形式に変換するAPI
 """
 
+import asyncio
+import os
 import time
 import uuid
+from contextlib import asynccontextmanager
 from datetime import datetime
-from typing import List, Optional
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+from urllib.parse import quote
 
-from fastapi import FastAPI, File, UploadFile, HTTPException, Query, Path
-from fastapi.responses import JSONResponse
+from fastapi import (
+    FastAPI, File, Form, UploadFile, HTTPException, Query, Path, Header, Request
+)
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from fastapi.responses import FileResponse as StaticFileResponse
 from fastapi.middleware.cors import CORSMiddleware
 
 from .models import (
-    FileResponse, FileListResponse, ErrorResponse, HealthResponse,
-    UploadResponse, ConversionResponse
+    FileResponse, FileFieldsResponse, FileListResponse, ErrorResponse, HealthResponse,
+    UploadResponse, ConversionResponse, FileStatus, BatchGetRequest, BatchDeleteRequest
 )
 from .services.pdf_service import PDFService
 from .services.file_service import FileService
-from .database import db_manager
+from .services.recovery_service import RecoveryService
+from .services.export_service import EXPORT_FORMATS, ExportService
+from .services.search_service import SearchService
+from .services.conversion_scheduler import conversion_scheduler
+from .services.response_cache import file_response_cache
+from .services.blob_store import blob_store
+from .services.backup_service import BackupInProgressError, backup_service
+from .services.maintenance_service import maintenance_service
+from .compression import (
+    CompressionMiddleware, MINIMUM_SIZE, THREAD_MINIMUM_SIZE, accepts_encoding, compress_body,
+    encoded_etag, negotiate_encoding, strip_etag_encoding
+)
+from . import markdown_codec
+from .database import LIST_MAX_OFFSET, check_ephemeral_mode, db_manager
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    """起動・終了時の処理"""
+    # 本文を保存できない圧縮方式の設定や、データを共有できないエフェメラルモードの構成なら起動しない
+    markdown_codec.check_codec()
+    check_ephemeral_mode(pdf_service.conversion_mode)
+    
+    # 前回のプロセス停止で PROCESSING のまま残ったファイルを復旧
+    result = await asyncio.to_thread(recovery_service.recover_stale_files)
+    if result["stale_files"]:
+        print(f"Startup recovery: {result}")
+    
+    sweeper = asyncio.create_task(recovery_service.run_periodic())
+    maintenance = asyncio.create_task(maintenance_service.run_periodic())
+    yield
+    sweeper.cancel()
+    maintenance.cancel()
+
 
 # アプリケーションの作成
 app = FastAPI(
@@ -27,7 +67,8 @@ app = FastAPI(
     description="PDFファイルをMarkdown形式に変換するAPI",
     version="1.0.0",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    lifespan=lifespan
 )
 
 # CORS設定
@@ -39,16 +80,134 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.exception_handler(markdown_codec.MarkdownCodecError)
+async def markdown_codec_error_handler(request: Request, exc: Exception) -> JSONResponse:
+    """保存されている本文を展開できない場合（圧縮方式の設定や zstandard の有無の不一致）"""
+    print(f"Markdown codec error: {exc}")
+    return JSONResponse(
+        status_code=500,
+        content={"detail": "保存されている本文を展開できません（MARKDOWN_CODEC と zstandard の設定を確認してください）"}
+    )
+
+# Accept-Encoding に応じたレスポンス圧縮
+app.add_middleware(CompressionMiddleware, minimum_size=MINIMUM_SIZE)
+
+# 監視用のリクエストはアイドル判定に含めない
+IDLE_EXEMPT_PATHS = {"/health", "/maintenance"}
+
+
+@app.middleware("http")
+async def record_activity(request: Request,
+                          call_next: Callable[[Request], Awaitable[Response]]) -> Response:
+    """リクエストを記録して、処理中はDBメンテナンスを控える"""
+    if request.url.path not in IDLE_EXEMPT_PATHS:
+        maintenance_service.record_activity()
+    return await call_next(request)
+
 # サービスの初期化
 pdf_service = PDFService()
 file_service = FileService()
+recovery_service = RecoveryService(pdf_service)
+export_service = ExportService()
+search_service = SearchService()
 
 # 起動時刻を記録
 start_time = time.time()
 
 
+def _matching_etag(if_none_match: Optional[str], etag: Optional[str]) -> Optional[str]:
+    """If-None-Match のうち現在のETagと一致したもの（一致しなければNone）
+
+    If-None-Match は弱い比較で判定し、圧縮方式ごとのETag（"<値>-gzip"）も同じ版として扱う
+    """
+    if not if_none_match or not etag:
+        return None
+    current = strip_etag_encoding(etag)
+    for tag in (tag.strip() for tag in if_none_match.split(",")):
+        if tag == "*":
+            return etag
+        if strip_etag_encoding(tag) == current:
+            return tag
+    return None
+
+
+def _etag_matches(if_none_match: Optional[str], etag: Optional[str]) -> bool:
+    """If-None-Match ヘッダーが現在のETagと一致するか判定"""
+    return _matching_etag(if_none_match, etag) is not None
+
+
+def _not_modified(if_none_match: Optional[str], etag: str,
+                  headers: Optional[Dict[str, str]] = None) -> Optional[Response]:
+    """If-None-Match が一致すれば 304 Not Modified（ETag はクライアントが持っている表現のもの）"""
+    matched = _matching_etag(if_none_match, etag)
+    if matched is None:
+        return None
+    return Response(status_code=304, headers={**(headers or {}), "ETag": matched})
+
+
+def _conditional_response(body: bytes, etag: Optional[str],
+                          if_none_match: Optional[str],
+                          encoding: Optional[str] = None) -> Response:
+    """ETag付きのJSONレスポンス（一致すれば 304 Not Modified）"""
+    not_modified = _not_modified(if_none_match, etag) if etag else None
+    if not_modified is not None:
+        return not_modified
+    headers: Dict[str, str] = {}
+    if etag:
+        headers["ETag"] = encoded_etag(etag, encoding)
+    if encoding:
+        headers["Content-Encoding"] = encoding
+        headers["Vary"] = "Accept-Encoding"
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+def _parse_fields(fields: Optional[str]) -> Optional[List[str]]:
+    """fields パラメータを解析（不正な場合は 400）"""
+    try:
+        return file_service.parse_fields(fields)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=400,
+            detail=f"不明なフィールドが指定されました: {e}"
+        )
+
+
+async def _encode_file_body(file_id: str, body: bytes, etag: Optional[str],
+                            accept_encoding: Optional[str]) -> tuple[bytes, Optional[str]]:
+    """ファイルレスポンスを圧縮（キャッシュ済みの圧縮結果があれば再利用）"""
+    encoding = negotiate_encoding(accept_encoding)
+    if encoding is None or len(body) < MINIMUM_SIZE:
+        return body, None
+    
+    encoded = file_response_cache.get_encoded(file_id, etag, encoding)
+    if encoded is None:
+        if len(body) >= THREAD_MINIMUM_SIZE:
+            encoded = await asyncio.to_thread(compress_body, body, encoding)
+        else:
+            encoded = compress_body(body, encoding)
+        file_response_cache.put_encoded(file_id, etag, encoding, encoded)
+    return encoded, encoding
+
+
+def _delete_file_locked(file_id: str) -> bool:
+    """実行中の変換をキャンセルしてからファイルを削除
+
+    ファイルごとのロックはスレッドのロックのため、イベントループ上では取得しない
+    """
+    with pdf_service.file_lock(file_id):
+        pdf_service.cancel_conversion(file_id)
+        return file_service.delete_file(file_id)
+
+
+def _delete_files_locked(file_ids: List[str]) -> List[str]:
+    """実行中の変換をキャンセルしてから複数のファイルを削除（削除できたIDを返す）"""
+    with pdf_service.file_locks(file_ids):
+        pdf_service.cancel_local_conversions(file_ids)
+        return file_service.delete_files(file_ids)
+
+
 @app.get("/health", response_model=HealthResponse, tags=["Health"])
-async def health_check():
+async def health_check() -> HealthResponse:
     """ヘルスチェック"""
     uptime = time.time() - start_time
     return HealthResponse(
@@ -59,25 +218,37 @@ async def health_check():
 
 
 @app.post("/upload", response_model=UploadResponse, tags=["Files"])
-async def upload_pdf(file: UploadFile = File(...)):
+async def upload_pdf(
+    file: UploadFile = File(...),
+    priority: Optional[int] = Form(
+        None, ge=-10, le=10, description="変換優先度（大きいほど優先、省略時は見積もりコスト順）"
+    )
+) -> UploadResponse:
     """PDFファイルをアップロードしてMarkdownに変換"""
     try:
         # ファイルの内容を読み込み
         file_content = await file.read()
         
         # PDF変換処理
-        result = await pdf_service.process_pdf_upload(file_content, file.filename)
+        result = await pdf_service.process_pdf_upload(
+            file_content, file.filename or "", priority=priority
+        )
         
         if result["success"]:
+            if result["status"] == FileStatus.PROCESSING:
+                message = "PDFファイルを受け付けました。変換は非同期で実行されます"
+            else:
+                message = "PDFファイルのアップロードと変換が完了しました"
             return UploadResponse(
-                message="PDFファイルのアップロードと変換が完了しました",
+                message=message,
                 id=result["file_id"],
                 markdown=result["markdown"],
                 status=result["status"]
             )
         else:
             raise HTTPException(
-                status_code=400,
+                # 新しい更新や削除でキャンセルされた場合は競合として返す
+                status_code=409 if result.get("cancelled") else 400,
                 detail=result["error"]
             )
             
@@ -90,8 +261,16 @@ async def upload_pdf(file: UploadFile = File(...)):
         )
 
 
-@app.get("/files/{file_id}", response_model=FileResponse, tags=["Files"])
-async def get_file(file_id: str = Path(..., description="ファイルID")):
+@app.get("/files/{file_id}", response_model=FileResponse, tags=["Files"],
+         responses={304: {"description": "ETag が一致（変更なし）"}})
+async def get_file(
+    file_id: str = Path(..., description="ファイルID"),
+    fields: Optional[str] = Query(
+        None, description="返すフィールド（カンマ区切り、例: status,processing_time）"
+    ),
+    if_none_match: Optional[str] = Header(None, description="前回取得時のETag"),
+    accept_encoding: Optional[str] = Header(None, include_in_schema=False)
+) -> Response:
     """指定されたIDのファイル情報を取得"""
     # ファイルIDの妥当性を検証
     if not file_service.validate_file_id(file_id):
@@ -100,6 +279,37 @@ async def get_file(file_id: str = Path(..., description="ファイルID")):
             detail="無効なファイルID形式です"
         )
     
+    # フィールド指定時は必要な列だけをDBから読む（キャッシュは使わない）
+    field_names = _parse_fields(fields)
+    if field_names is not None:
+        file_data = file_service.get_file_fields(file_id, field_names)
+        if not file_data:
+            raise HTTPException(
+                status_code=404,
+                detail="ファイルが見つかりません"
+            )
+        etag = file_data.pop("etag")
+        payload = FileFieldsResponse(**file_data).model_dump_json(exclude_unset=True).encode("utf-8")
+        return _conditional_response(payload, etag, if_none_match)
+    
+    # キャッシュ済みのシリアライズ結果があればそのまま返す
+    cached = file_response_cache.get(file_id)
+    if cached is not None:
+        if _etag_matches(if_none_match, cached.etag):
+            return _conditional_response(b"", cached.etag, if_none_match)
+        encoded, encoding = await _encode_file_body(
+            file_id, cached.body, cached.etag, accept_encoding
+        )
+        return _conditional_response(encoded, cached.etag, if_none_match, encoding)
+    
+    # 条件付きリクエストは本文を読まずにETagだけ比較する
+    if if_none_match:
+        etag = file_service.get_file_etag(file_id)
+        not_modified = _not_modified(if_none_match, etag) if etag else None
+        if not_modified is not None:
+            return not_modified
+    
+    generation = file_response_cache.generation()
     file_data = file_service.get_file(file_id)
     if not file_data:
         raise HTTPException(
@@ -107,7 +317,7 @@ async def get_file(file_id: str = Path(..., description="ファイルID")):
             detail="ファイルが見つかりません"
         )
     
-    return FileResponse(
+    payload = FileResponse(
         id=file_data["id"],
         filename=file_data["filename"],
         markdown=file_data["markdown"],
@@ -116,30 +326,143 @@ async def get_file(file_id: str = Path(..., description="ファイルID")):
         updated_at=file_data["updated_at"],
         file_size=file_data["file_size"],
         processing_time=file_data.get("processing_time")
+    ).model_dump_json().encode("utf-8")
+    
+    # 変換中のファイルは別プロセスのワーカーが更新するためキャッシュしない
+    if file_data["status"] != FileStatus.PROCESSING:
+        file_response_cache.put(
+            file_id, file_data["updated_at"], payload, generation, etag=file_data["etag"]
+        )
+    
+    if _etag_matches(if_none_match, file_data["etag"]):
+        return _conditional_response(b"", file_data["etag"], if_none_match)
+    encoded, encoding = await _encode_file_body(
+        file_id, payload, file_data["etag"], accept_encoding
     )
+    return _conditional_response(encoded, file_data["etag"], if_none_match, encoding)
 
 
-@app.get("/files", response_model=FileListResponse, tags=["Files"])
+@app.get("/files", response_model=FileListResponse, tags=["Files"],
+         responses={304: {"description": "ETag が一致（変更なし）"}})
 async def list_files(
     page: int = Query(1, ge=1, description="ページ番号"),
-    per_page: int = Query(10, ge=1, le=100, description="1ページあたりの件数")
-):
-    """ファイル一覧を取得"""
-    result = file_service.list_files(page, per_page)
+    per_page: int = Query(10, ge=1, le=100, description="1ページあたりの件数"),
+    fields: Optional[str] = Query(
+        None, description="返すフィールド（カンマ区切り、例: status,processing_time）"
+    ),
+    status: Optional[FileStatus] = Query(None, description="状態で絞り込み"),
+    filename_prefix: Optional[str] = Query(
+        None, min_length=1, max_length=255, description="ファイル名の前方一致"
+    ),
+    created_from: Optional[datetime] = Query(None, description="作成日時の下限（この日時を含む）"),
+    created_to: Optional[datetime] = Query(None, description="作成日時の上限（この日時を含まない）"),
+    min_size: Optional[int] = Query(None, ge=0, description="ファイルサイズの下限（バイト）"),
+    max_size: Optional[int] = Query(None, ge=0, description="ファイルサイズの上限（バイト）"),
+    sort: str = Query(
+        "-created_at", pattern=r"^-?(created_at|processing_time|file_size)$",
+        description="並び順（created_at / processing_time / file_size、先頭に - で降順）"
+    ),
+    if_none_match: Optional[str] = Header(None, description="前回取得時のETag")
+) -> Response:
+    """ファイル一覧を取得（状態・ファイル名・作成日時・サイズで絞り込み可能）"""
+    if page * per_page > LIST_MAX_OFFSET:
+        raise HTTPException(
+            status_code=400,
+            detail=f"page × per_page は {LIST_MAX_OFFSET} 以下にしてください（絞り込みや並び順で範囲を狭めてください）"
+        )
+    field_names = _parse_fields(fields)
+    filters = {
+        "status": status.value if status else None,
+        "filename_prefix": filename_prefix,
+        "created_from": created_from,
+        "created_to": created_to,
+        "min_size": min_size,
+        "max_size": max_size,
+    }
+    filters = {key: value for key, value in filters.items() if value is not None}
+    
+    # 条件付きリクエストは一覧を読まずに、DBの変更カウンターから作ったETagだけ比較する
+    # （一覧より先に取得するため、間に更新があってもETagが古くなるだけで、変更を見落とさない）
+    etag = file_service.get_list_etag(page, per_page, field_names, filters, sort)
+    not_modified = _not_modified(if_none_match, etag) if etag else None
+    if not_modified is not None:
+        return not_modified
+    
+    result = file_service.list_files(
+        page, per_page, fields=field_names, filters=filters, sort=sort
+    )
+    
+    files = result["files"]
+    if field_names is not None:
+        files = [
+            FileFieldsResponse(**file_info).model_dump(mode="json", exclude_unset=True)
+            for file_info in files
+        ]
     
-    return FileListResponse(
-        files=result["files"],
+    body = FileListResponse(
+        files=files,
         total_count=result["total_count"],
         page=result["page"],
         per_page=result["per_page"]
-    )
+    ).model_dump_json().encode("utf-8")
+    return _conditional_response(body, etag, None)
+
+
+@app.post("/files:batchGet", tags=["Files"])
+async def batch_get_files(request: BatchGetRequest) -> Dict[str, Any]:
+    """複数のファイル情報をまとめて取得（IDごとの結果をリクエスト順に返す）"""
+    field_names = _parse_fields(",".join(request.fields) if request.fields is not None else None)
+    valid_ids = [file_id for file_id in request.ids if file_service.validate_file_id(file_id)]
+    files = file_service.get_files(valid_ids, field_names)
+    
+    valid_id_set = set(valid_ids)
+    results = []
+    for file_id in request.ids:
+        if file_id in files:
+            if field_names is None:
+                file_data = FileResponse(**files[file_id]).model_dump(mode="json")
+            else:
+                file_data = FileFieldsResponse(**files[file_id]).model_dump(
+                    mode="json", exclude_unset=True
+                )
+            results.append({"id": file_id, "found": True, "file": file_data})
+        elif file_id in valid_id_set:
+            results.append({"id": file_id, "found": False, "error": "ファイルが見つかりません"})
+        else:
+            results.append({"id": file_id, "found": False, "error": "無効なファイルID形式です"})
+    
+    return {"results": results}
+
+
+@app.post("/files:batchDelete", tags=["Files"])
+async def batch_delete_files(request: BatchDeleteRequest) -> Dict[str, Any]:
+    """複数のファイルをまとめて削除（IDごとの結果をリクエスト順に返す）"""
+    valid_ids = [file_id for file_id in request.ids if file_service.validate_file_id(file_id)]
+    
+    # 実行中の変換をキャンセルしてから1トランザクションで削除（ロック待ちがあるためスレッドで実行）
+    deleted = set(await asyncio.to_thread(_delete_files_locked, valid_ids))
+    
+    valid_id_set = set(valid_ids)
+    results = []
+    for file_id in request.ids:
+        if file_id in deleted:
+            results.append({"id": file_id, "deleted": True})
+        elif file_id in valid_id_set:
+            results.append({"id": file_id, "deleted": False, "error": "ファイルが見つかりません"})
+        else:
+            results.append({"id": file_id, "deleted": False, "error": "無効なファイルID形式です"})
+    
+    return {"results": results, "deleted_count": len(deleted)}
 
 
 @app.put("/files/{file_id}", response_model=FileResponse, tags=["Files"])
 async def update_file(
     file_id: str = Path(..., description="ファイルID"),
-    file: UploadFile = File(...)
-):
+    file: UploadFile = File(...),
+    priority: Optional[int] = Form(
+        None, ge=-10, le=10, description="変換優先度（大きいほど優先、省略時は見積もりコスト順）"
+    )
+) -> FileResponse:
     """指定されたIDのファイルを新しいPDFで更新・再変換"""
     # ファイルIDの妥当性を検証
     if not file_service.validate_file_id(file_id):
@@ -153,7 +476,9 @@ async def update_file(
         file_content = await file.read()
         
         # 再変換処理
-        result = await pdf_service.reconvert_pdf(file_id, file_content, file.filename)
+        result = await pdf_service.reconvert_pdf(
+            file_id, file_content, file.filename or "", priority=priority
+        )
         
         if result["success"]:
             # 更新後のファイル情報を取得
@@ -176,7 +501,8 @@ async def update_file(
             )
         else:
             raise HTTPException(
-                status_code=400,
+                # 新しい更新や削除でキャンセルされた場合は競合として返す
+                status_code=409 if result.get("cancelled") else 400,
                 detail=result["error"]
             )
             
@@ -190,7 +516,7 @@ async def update_file(
 
 
 @app.delete("/files/{file_id}", tags=["Files"])
-async def delete_file(file_id: str = Path(..., description="ファイルID")):
+async def delete_file(file_id: str = Path(..., description="ファイルID")) -> Dict[str, str]:
     """指定されたIDのファイルを削除"""
     # ファイルIDの妥当性を検証
     if not file_service.validate_file_id(file_id):
@@ -199,7 +525,8 @@ async def delete_file(file_id: str = Path(..., description="ファイルID")):
             detail="無効なファイルID形式です"
         )
     
-    success = file_service.delete_file(file_id)
+    # 実行中の変換をキャンセルしてから削除（ロック待ちがあるためスレッドで実行）
+    success = await asyncio.to_thread(_delete_file_locked, file_id)
     if not success:
         raise HTTPException(
             status_code=404,
@@ -209,8 +536,97 @@ async def delete_file(file_id: str = Path(..., description="ファイルID")):
     return {"message": "ファイルが正常に削除されました"}
 
 
+@app.get("/files/{file_id}/markdown", tags=["Files"],
+         responses={
+             200: {"content": {"text/markdown": {}}, "description": "変換されたMarkdown"},
+             206: {"description": "Range で指定された部分"},
+             304: {"description": "ETag が一致（変更なし）"}
+         })
+async def download_markdown(
+    file_id: str = Path(..., description="ファイルID"),
+    if_none_match: Optional[str] = Header(None, description="前回取得時のETag"),
+    accept_encoding: Optional[str] = Header(None, include_in_schema=False),
+    range_header: Optional[str] = Header(None, alias="Range", include_in_schema=False)
+) -> Response:
+    """変換されたMarkdownをファイルから直接返す（Range対応）
+
+    保存時の圧縮方式をクライアントが受け付ける場合は、圧縮済みの本文をそのまま返す
+    """
+    # ファイルIDの妥当性を検証
+    if not file_service.validate_file_id(file_id):
+        raise HTTPException(
+            status_code=400,
+            detail="無効なファイルID形式です"
+        )
+    
+    location = file_service.get_markdown_location(file_id)
+    if not location:
+        raise HTTPException(
+            status_code=404,
+            detail="ファイルが見つかりません"
+        )
+    
+    if location["status"] != FileStatus.COMPLETED:
+        raise HTTPException(
+            status_code=409,
+            detail="Markdownへの変換が完了していません"
+        )
+    
+    headers = {"ETag": location["etag"], "Cache-Control": "no-cache"}
+    not_modified = _not_modified(if_none_match, location["etag"], headers)
+    if not_modified is not None:
+        return not_modified
+    
+    download_name = f"{os.path.splitext(location['filename'])[0]}.md"
+    
+    if range_header is None:
+        stored = await asyncio.to_thread(db_manager.get_markdown_payload, file_id)
+        encoding = markdown_codec.http_encoding(stored["encoding"]) if stored else None
+        if stored and encoding and accepts_encoding(accept_encoding, encoding):
+            quoted_name = quote(download_name)
+            if quoted_name == download_name:
+                disposition = f'inline; filename="{download_name}"'
+            else:
+                disposition = f"inline; filename*=utf-8''{quoted_name}"
+            return Response(
+                content=stored["payload"],
+                media_type="text/markdown; charset=utf-8",
+                headers={
+                    **headers,
+                    "ETag": encoded_etag(location["etag"], encoding),
+                    "Content-Encoding": encoding,
+                    "Content-Disposition": disposition,
+                    "Vary": "Accept-Encoding"
+                }
+            )
+    
+    markdown_path = location["markdown_path"] or str(pdf_service.markdown_path_for(file_id))
+    if os.path.exists(markdown_path):
+        # 本文をメモリに読み込まず、ファイルからチャンク単位で送信する
+        return StaticFileResponse(
+            markdown_path,
+            media_type="text/markdown; charset=utf-8",
+            filename=download_name,
+            content_disposition_type="inline",
+            headers=headers
+        )
+    
+    # ファイルが残っていない古いデータはDBの内容を返す
+    file_data = file_service.get_file(file_id)
+    if not file_data:
+        raise HTTPException(
+            status_code=404,
+            detail="ファイルが見つかりません"
+        )
+    return Response(
+        content=file_data["markdown"],
+        media_type="text/markdown; charset=utf-8",
+        headers=headers
+    )
+
+
 @app.get("/files/{file_id}/logs", tags=["Files"])
-async def get_file_logs(file_id: str = Path(..., description="ファイルID")):
+async def get_file_logs(file_id: str = Path(..., description="ファイルID")) -> Dict[str, Any]:
     """指定されたIDのファイルの変換ログを取得"""
     # ファイルIDの妥当性を検証
     if not file_service.validate_file_id(file_id):
@@ -229,8 +645,85 @@ async def get_file_logs(file_id: str = Path(..., description="ファイルID")):
     return {"logs": logs}
 
 
+@app.get("/files/{file_id}/versions", tags=["Files"])
+async def list_file_versions(
+    file_id: str = Path(..., description="ファイルID")
+) -> Dict[str, Any]:
+    """Markdownの版の一覧を取得（再変換・更新のたびに版が増える）"""
+    # ファイルIDの妥当性を検証
+    if not file_service.validate_file_id(file_id):
+        raise HTTPException(
+            status_code=400,
+            detail="無効なファイルID形式です"
+        )
+    
+    versions = file_service.get_file_versions(file_id)
+    if versions is None:
+        raise HTTPException(
+            status_code=404,
+            detail="ファイルが見つかりません"
+        )
+    
+    return {"file_id": file_id, "versions": versions}
+
+
+@app.get("/files/{file_id}/versions/{version}", tags=["Files"])
+async def get_file_version(
+    file_id: str = Path(..., description="ファイルID"),
+    version: int = Path(..., ge=1, description="版の番号")
+) -> Dict[str, Any]:
+    """指定した版のMarkdownを取得"""
+    # ファイルIDの妥当性を検証
+    if not file_service.validate_file_id(file_id):
+        raise HTTPException(
+            status_code=400,
+            detail="無効なファイルID形式です"
+        )
+    
+    # 差分を適用して復元するためスレッドで実行
+    data = await asyncio.to_thread(file_service.get_file_version, file_id, version)
+    if not data:
+        raise HTTPException(
+            status_code=404,
+            detail="指定された版が見つかりません"
+        )
+    
+    return data
+
+
+@app.get("/files/{file_id}/diff", tags=["Files"],
+         responses={200: {"content": {"text/x-diff": {}}, "description": "unified diff"}})
+async def diff_file_versions(
+    file_id: str = Path(..., description="ファイルID"),
+    from_version: Optional[int] = Query(None, alias="from", ge=1,
+                                        description="比較元の版（省略時は to の1つ前）"),
+    to_version: Optional[int] = Query(None, alias="to", ge=1,
+                                      description="比較先の版（省略時は最新の版）")
+) -> StreamingResponse:
+    """2つの版のMarkdownの差分を unified diff 形式でストリーミング"""
+    # ファイルIDの妥当性を検証
+    if not file_service.validate_file_id(file_id):
+        raise HTTPException(
+            status_code=400,
+            detail="無効なファイルID形式です"
+        )
+    
+    diff = await asyncio.to_thread(file_service.diff_versions, file_id, from_version, to_version)
+    if not diff:
+        raise HTTPException(
+            status_code=404,
+            detail="指定された版が見つかりません"
+        )
+    
+    return StreamingResponse(
+        diff["chunks"],
+        media_type="text/x-diff; charset=utf-8",
+        headers={"X-Diff-From": str(diff["from"]), "X-Diff-To": str(diff["to"])}
+    )
+
+
 @app.get("/statistics", tags=["Statistics"])
-async def get_statistics():
+async def get_statistics() -> Dict[str, Any]:
     """ファイル統計情報を取得"""
     stats = file_service.get_file_statistics()
     
@@ -240,13 +733,89 @@ async def get_statistics():
             detail=f"統計情報の取得に失敗しました: {stats['error']}"
         )
     
+    # 重複排除後に実際に保存されているPDFの数
+    stats["blobs"] = db_manager.get_blob_statistics()
+    stats["archive"] = db_manager.get_archive_statistics()
     return stats
 
 
+@app.get("/workers", tags=["Workers"])
+async def get_worker_status(
+    active_within: Optional[int] = Query(
+        300, ge=1, description="この秒数以内に稼働報告があったワーカーのみ表示"
+    )
+) -> Dict[str, Any]:
+    """変換ワーカーの稼働状況とメモリ使用量を取得"""
+    workers = db_manager.list_worker_status(seen_within_seconds=active_within)
+    for worker in workers:
+        rss_bytes = worker.get("rss_bytes")
+        worker["rss_mb"] = round(rss_bytes / (1024 * 1024), 2) if rss_bytes else None
+    
+    return {
+        "scheduler": conversion_scheduler.get_status(),
+        "workers": workers
+    }
+
+
+@app.get("/search", tags=["Search"])
+async def search_files(
+    q: str = Query(..., min_length=1, max_length=200, description="検索語（空白区切りでAND検索）"),
+    limit: int = Query(20, ge=1, le=100, description="1ページあたりの件数"),
+    cursor: Optional[str] = Query(None, description="前のレスポンスの next_cursor")
+) -> Dict[str, Any]:
+    """Markdown本文とファイル名を全文検索（関連度順）"""
+    if not db_manager.search_enabled:
+        raise HTTPException(
+            status_code=503,
+            detail="全文検索はこの環境では利用できません"
+        )
+    
+    try:
+        return search_service.search(q, limit=limit, cursor=cursor)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=400,
+            detail=str(e)
+        )
+
+
+@app.get("/export", tags=["Export"])
+async def export_files(
+    export_format: str = Query(
+        "ndjson", alias="format", pattern="^(ndjson|tar)$", description="出力形式（ndjson または tar）"
+    ),
+    status: str = Query(
+        "completed", pattern="^(processing|completed|failed|all)$",
+        description="対象の状態（all ですべて）"
+    ),
+    since: Optional[str] = Query(
+        None, description="この日時以降に更新されたものだけを出力（例: 2024-01-01 00:00:00）"
+    )
+) -> StreamingResponse:
+    """変換済みドキュメントをストリーミングでエクスポート"""
+    chunks = export_service.iter_export(
+        export_format,
+        status=None if status == "all" else status,
+        updated_since=since
+    )
+    return StreamingResponse(
+        chunks,
+        media_type=EXPORT_FORMATS[export_format],
+        headers={"Content-Disposition": f'attachment; filename="export.{export_format}"'}
+    )
+
+
 @app.post("/cleanup", tags=["Maintenance"])
-async def cleanup_old_files(days: int = Query(30, ge=1, le=365, description="削除対象の日数")):
+async def cleanup_old_files(
+    days: int = Query(30, ge=1, le=365, description="削除対象の日数"),
+    mode: str = Query(
+        "delete", pattern="^(delete|archive)$",
+        description="delete: 削除 / archive: パックファイルへ移して保管"
+    )
+) -> Dict[str, Any]:
     """古いファイルをクリーンアップ"""
-    result = file_service.cleanup_old_files(days)
+    # パックファイルの書き込みや大量の削除で止まらないよう、スレッドで実行
+    result = await asyncio.to_thread(file_service.cleanup_old_files, days, mode)
     
     if not result["success"]:
         raise HTTPException(
@@ -254,6 +823,14 @@ async def cleanup_old_files(days: int = Query(30, ge=1, le=365, description="削
             detail=f"クリーンアップに失敗しました: {result['error']}"
         )
     
+    if mode == "archive":
+        return {
+            "message": f"{days}日以上更新されていないファイルのアーカイブが完了しました",
+            "archived_count": result["archived_count"],
+            "skipped": result["skipped"],
+            "errors": result["errors"]
+        }
+    
     return {
         "message": f"{days}日より古いファイルのクリーンアップが完了しました",
         "deleted_count": result["deleted_count"],
@@ -261,8 +838,31 @@ async def cleanup_old_files(days: int = Query(30, ge=1, le=365, description="削
     }
 
 
+@app.post("/backup", tags=["Maintenance"])
+async def create_backup() -> Dict[str, Any]:
+    """DB・PDF・Markdownのスナップショットを作成（サービスは止めない）"""
+    try:
+        return await asyncio.to_thread(backup_service.create_snapshot)
+    except BackupInProgressError:
+        raise HTTPException(
+            status_code=409,
+            detail="別のバックアップが実行中です"
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"バックアップに失敗しました: {str(e)}"
+        )
+
+
+@app.get("/maintenance", tags=["Maintenance"])
+async def get_maintenance_status() -> Dict[str, Any]:
+    """DBの断片化（空きページ）とメンテナンスの実施状況を取得"""
+    return await asyncio.to_thread(maintenance_service.get_status)
+
+
 @app.post("/test/reset-db", tags=["Testing"])
-async def reset_test_database():
+async def reset_test_database() -> Dict[str, str]:
     """テスト用：データベースをリセット（テスト環境のみ）"""
     import os
     if os.getenv("ENVIRONMENT") != "test":
@@ -272,6 +872,8 @@ async def reset_test_database():
         )
     
     if db_manager.clear_all_data():
+        file_response_cache.clear()
+        await asyncio.to_thread(blob_store.collect_garbage)
         return {"message": "テストデータベースがリセットされました"}
     else:
         raise HTTPException(
@@ -281,7 +883,7 @@ async def reset_test_database():
 
 
 @app.exception_handler(HTTPException)
-async def http_exception_handler(request, exc):
+async def http_exception_handler(request: Request, exc: HTTPException) -> JSONResponse:
     """HTTP例外のハンドラー"""
     return JSONResponse(
         status_code=exc.status_code,
@@ -294,7 +896,7 @@ async def http_exception_handler(request, exc):
 
 
 @app.exception_handler(Exception)
-async def general_exception_handler(request, exc):
+async def general_exception_handler(request: Request, exc: Exception) -> JSONResponse:
     """一般例外のハンドラー"""
     return JSONResponse(
         status_code=500,
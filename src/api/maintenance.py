@@ -0,0 +1,37 @@
+"""
+DBメンテナンスコマンド
+
+起動時には行わない、時間のかかる一度きりのメンテナンスを実行する。
+
+使い方:
+    python -m src.api.maintenance enable-incremental-vacuum
+        （既存のDBを auto_vacuum = INCREMENTAL に移行する。VACUUM でDB全体を書き直すため、
+          実行中は書き込みが待たされる。空き容量としてDBと同じ程度の大きさが必要）
+    python -m src.api.maintenance status
+"""
+
+import argparse
+import json
+from typing import List, Optional
+
+from .database import db_manager
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """コマンドラインエントリーポイント"""
+    parser = argparse.ArgumentParser(description="DBメンテナンス")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("enable-incremental-vacuum",
+                          help="既存のDBを auto_vacuum = INCREMENTAL に移行（VACUUM）")
+    subparsers.add_parser("status", help="DBの断片化の状況を表示")
+    args = parser.parse_args(argv)
+
+    if args.command == "enable-incremental-vacuum":
+        result = db_manager.enable_incremental_vacuum()
+    else:
+        result = db_manager.get_storage_status()
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""
+Markdown本文の圧縮
+
+files.markdown_content に保存する本文を zlib（MARKDOWN_CODEC=zstd なら zstd）で圧縮する。
+圧縮した本文は BLOB として保存し、方式を files.markdown_encoding に記録する
+（NULL は非圧縮のテキスト）。
+
+zstd は zstandard がインストールされていても明示した場合だけ使う。インストール状況で
+方式が変わると、zstandard のないプロセス（ワーカーや別の環境）で本文を展開できなくなるため。
+扱えない方式の本文は MarkdownCodecError にして、存在しないファイルとは区別する。
+
+zstd では学習済み辞書を使うこともできる。辞書は MARKDOWN_DICT_DIR に
+<dict_id>.zdict として置き、MARKDOWN_ZSTD_DICT_ID で新しく保存する本文に使う辞書を選ぶ。
+辞書で圧縮した本文の方式は "zstd:<dict_id>" になる。
+"""
+
+import os
+import zlib
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union, overload
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# この大きさ未満の本文は圧縮しない（バイト）
+MINIMUM_SIZE = int(os.getenv("MARKDOWN_COMPRESSION_MINIMUM_SIZE", "256"))
+
+# 保存した本文をそのまま返せる Content-Encoding（保存時の方式 -> HTTP の方式）
+HTTP_ENCODINGS = {
+    "zstd": "zstd",
+    # zlib 形式はそのまま HTTP の deflate として返せる
+    "zlib": "deflate",
+}
+
+CODECS = ("zlib", "zstd", "none")
+
+_dictionaries: Dict[int, "zstandard.ZstdCompressionDict"] = {}
+
+
+class MarkdownCodecError(RuntimeError):
+    """本文の圧縮方式をこのプロセスで扱えない（設定や依存関係の不一致）"""
+
+
+def default_codec() -> str:
+    """新しく保存する本文の圧縮方式（none で圧縮しない）"""
+    return os.getenv("MARKDOWN_CODEC") or "zlib"
+
+
+def check_codec(codec: Optional[str] = None) -> None:
+    """圧縮方式を使えるか確かめる（使えなければ MarkdownCodecError）"""
+    codec = codec or default_codec()
+    if codec not in CODECS:
+        raise MarkdownCodecError(f"Unknown MARKDOWN_CODEC: {codec}")
+    if codec == "zstd" and zstandard is None:
+        raise MarkdownCodecError("MARKDOWN_CODEC=zstd requires the zstandard package")
+
+
+def dictionary_dir() -> Path:
+    return Path(os.getenv("MARKDOWN_DICT_DIR", "data/dictionaries"))
+
+
+def load_dictionary(dict_id: int) -> "zstandard.ZstdCompressionDict":
+    """学習済み辞書を読み込む（読み込んだ辞書はプロセス内で再利用）"""
+    if dict_id not in _dictionaries:
+        try:
+            data = (dictionary_dir() / f"{dict_id}.zdict").read_bytes()
+        except OSError as e:
+            raise MarkdownCodecError(f"zstd dictionary {dict_id} is not available: {e}") from e
+        _dictionaries[dict_id] = zstandard.ZstdCompressionDict(data)
+    return _dictionaries[dict_id]
+
+
+def train_dictionary(samples: List[bytes], size: int = 112 * 1024) -> int:
+    """本文のサンプルから zstd 辞書を学習して保存し、辞書IDを返す"""
+    if zstandard is None:
+        raise RuntimeError("辞書の学習には zstandard が必要です")
+    dictionary = zstandard.train_dictionary(size, samples)
+    dict_id = int(dictionary.dict_id())
+    directory = dictionary_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    (directory / f"{dict_id}.zdict").write_bytes(dictionary.as_bytes())
+    _dictionaries[dict_id] = dictionary
+    return dict_id
+
+
+def encode(text: str, codec: Optional[str] = None) -> Tuple[Union[str, bytes], Optional[str]]:
+    """本文を圧縮して (保存する値, 方式) を返す
+
+    小さい本文や圧縮しても小さくならない本文はテキストのまま返す（方式は None）
+    """
+    codec = codec or default_codec()
+    check_codec(codec)
+    data = text.encode("utf-8")
+    if codec == "none" or len(data) < MINIMUM_SIZE:
+        return text, None
+
+    if codec == "zstd":
+        dict_id = os.getenv("MARKDOWN_ZSTD_DICT_ID")
+        if dict_id:
+            compressor = zstandard.ZstdCompressor(level=9, dict_data=load_dictionary(int(dict_id)))
+            encoding = f"zstd:{dict_id}"
+        else:
+            compressor = zstandard.ZstdCompressor(level=9)
+            encoding = "zstd"
+        payload = compressor.compress(data)
+    else:
+        payload = zlib.compress(data, 9)
+        encoding = "zlib"
+
+    if len(payload) >= len(data):
+        return text, None
+    return payload, encoding
+
+
+def check_decodable(encoding: Optional[str]) -> None:
+    """保存されている方式の本文をこのプロセスで展開できるか確かめる（展開はしない）"""
+    if encoding is None or encoding == "zlib":
+        return
+    if encoding.startswith("zstd"):
+        if zstandard is None:
+            raise MarkdownCodecError("zstd で圧縮された本文の展開には zstandard が必要です")
+        _, _, dict_id = encoding.partition(":")
+        if dict_id:
+            load_dictionary(int(dict_id))
+        return
+    raise MarkdownCodecError(f"Unknown markdown encoding: {encoding}")
+
+
+@overload
+def decode(payload: None, encoding: Optional[str]) -> None: ...
+
+
+@overload
+def decode(payload: Union[str, bytes], encoding: Optional[str]) -> str: ...
+
+
+def decode(payload: Union[str, bytes, None], encoding: Optional[str]) -> Optional[str]:
+    """保存されている本文をテキストに戻す"""
+    if payload is None:
+        return None
+    if isinstance(payload, str):
+        # 圧縮していない本文は TEXT のまま保存している
+        if encoding is None:
+            return payload
+        raise MarkdownCodecError(f"Markdown stored as text is marked as {encoding}")
+    if encoding is None:
+        return payload.decode("utf-8")
+    check_decodable(encoding)
+    if encoding == "zlib":
+        return zlib.decompress(payload).decode("utf-8")
+    if encoding.startswith("zstd"):
+        _, _, dict_id = encoding.partition(":")
+        if dict_id:
+            decompressor = zstandard.ZstdDecompressor(dict_data=load_dictionary(int(dict_id)))
+        else:
+            decompressor = zstandard.ZstdDecompressor()
+        data: bytes = decompressor.decompress(payload)
+        return data.decode("utf-8")
+    raise MarkdownCodecError(f"Unknown markdown encoding: {encoding}")
+
+
+def http_encoding(encoding: Optional[str]) -> Optional[str]:
+    """保存した本文をそのまま返す場合の Content-Encoding（返せなければ None）"""
+    return HTTP_ENCODINGS.get(encoding) if encoding else None
@@ -0,0 +1,265 @@
+"""
+Markdownの差分
+
+版の履歴（file_versions）に保存する差分を作成・適用する。
+差分は元にする版からの行単位の編集操作の列で、JSON を zlib で圧縮して保存する。
+
+    ["=", n]          元の版の n 行をそのまま使う
+    ["-", n]          元の版の n 行を捨てる
+    ["+", [行, ...]]  新しい行を挿入する
+
+行は改行文字を含めたまま扱うため、適用すると元の本文と完全に一致する。
+
+履歴は逆方向の差分で持つ。最新の版は files の本文そのもので、版 v の差分は
+版 v+1 から版 v を作る。一定の版数ごとに全文（snapshot）も保存する。
+
+版どうしの比較用に、本文をページに分けたハッシュと unified diff も作成する。
+ページの区切りは変換時に挿入する "---" の行と、pdfminer が出力する改ページ文字。
+"""
+
+import bisect
+import difflib
+import hashlib
+import json
+import re
+import zlib
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence
+
+from . import markdown_codec
+
+
+def _split_lines(text: str) -> List[str]:
+    """改行文字（\\n）で行に分ける（改行文字は行に含める）"""
+    lines = text.split("\n")
+    result = [line + "\n" for line in lines[:-1]]
+    if lines[-1]:
+        result.append(lines[-1])
+    return result
+
+
+def _hash_page(lines: List[str]) -> str:
+    return hashlib.sha256("".join(lines).encode("utf-8")).hexdigest()
+
+
+def make_delta(old: str, new: str) -> bytes:
+    """old から new への差分を作成
+
+    ページのハッシュで対応を取り、変更のあったページの範囲だけを行単位で比較する
+    （本文全体を行単位で比較すると、大きな本文では行数の2乗に近い時間がかかる）
+    """
+    old_pages = split_pages(old)
+    new_pages = split_pages(new)
+    operations: List[list] = []
+
+    def emit(op: str, value: Any) -> None:
+        if operations and operations[-1][0] == op:
+            operations[-1][1] += value
+        else:
+            operations.append([op, value])
+
+    pages = difflib.SequenceMatcher(None, [_hash_page(page) for page in old_pages],
+                                    [_hash_page(page) for page in new_pages], autojunk=False)
+    for tag, p1, p2, q1, q2 in pages.get_opcodes():
+        old_lines = [line for page in old_pages[p1:p2] for line in page]
+        if tag == "equal":
+            emit("=", len(old_lines))
+            continue
+        new_lines = [line for page in new_pages[q1:q2] for line in page]
+        matcher = difflib.SequenceMatcher(None, old_lines, new_lines)
+        for op, i1, i2, j1, j2 in matcher.get_opcodes():
+            if op == "equal":
+                emit("=", i2 - i1)
+                continue
+            if i2 > i1:
+                emit("-", i2 - i1)
+            if j2 > j1:
+                emit("+", new_lines[j1:j2])
+    return zlib.compress(json.dumps(operations, ensure_ascii=False).encode("utf-8"), 9)
+
+
+def apply_delta(old: str, delta: bytes) -> str:
+    """old に差分を適用して新しい本文を返す"""
+    old_lines = _split_lines(old)
+    position = 0
+    result: List[str] = []
+    for op, value in json.loads(zlib.decompress(delta)):
+        if op == "=":
+            result.extend(old_lines[position:position + value])
+            position += value
+        elif op == "-":
+            position += value
+        elif op == "+":
+            result.extend(value)
+        else:
+            raise ValueError(f"Unknown delta operation: {op}")
+    if position != len(old_lines):
+        raise ValueError("Delta does not match the base version")
+    return "".join(result)
+
+
+def restore_versions(targets: Iterable[int], current_version: int, current: str,
+                     snapshots: Sequence[int],
+                     load: Callable[[int], Dict[str, Any]]) -> Dict[int, str]:
+    """履歴から指定した版の本文を復元する
+
+    新しい版から順に、直近の新しい全文（なければ最新の本文）に差分を適用して下っていく。
+    複数の版を指定すると、途中まで同じ差分の列を共有する。
+    snapshots は全文で保存している版の番号、load(版) は保存している行
+    （kind / payload / encoding）を返す
+    """
+    results: Dict[int, str] = {}
+    text = current
+    position: Optional[int] = None
+    for target in sorted(set(targets), reverse=True):
+        if target == current_version:
+            text, position = current, current_version
+            results[target] = text
+            continue
+        top = min((version for version in snapshots if version >= target), default=None)
+        # 途中まで復元した本文から下る方が近ければ続きから適用する
+        if position is None or (top is not None and top < position):
+            if top is None:
+                text, position = current, current_version
+            else:
+                row = load(top)
+                text, position = markdown_codec.decode(row["payload"], row["encoding"]), top
+        while position > target:
+            position -= 1
+            row = load(position)
+            if row["kind"] == "snapshot":
+                text = markdown_codec.decode(row["payload"], row["encoding"])
+            else:
+                text = apply_delta(text, row["payload"])
+        results[target] = text
+    return results
+
+
+def split_pages(text: str) -> List[List[str]]:
+    """本文をページごとの行（改行文字を含む）に分ける（区切りの行はそのページの末尾に含める）"""
+    pages: List[List[str]] = [[]]
+    for line in _split_lines(text):
+        pages[-1].append(line)
+        if line.strip() == "---" or "\f" in line:
+            pages.append([])
+    if not pages[-1] and len(pages) > 1:
+        pages.pop()
+    return pages
+
+
+def page_hashes(text: str) -> List[str]:
+    """ページごとの SHA-256"""
+    return [_hash_page(page) for page in split_pages(text)]
+
+
+# ページの区切りの行（split_pages と同じ条件: 空白を除くと "---" の行か、改ページ文字を含む行）
+_PAGE_BREAK = re.compile(r"^[^\S\n]*---[^\S\n]*(?:\n|\Z)|^[^\n]*\f[^\n]*(?:\n|\Z)", re.MULTILINE)
+
+
+def split_page_texts(text: str) -> List[str]:
+    """本文をページごとの文字列に分ける（split_pages と同じ区切りで、行には分けない）"""
+    pages: List[str] = []
+    start = 0
+    for match in _PAGE_BREAK.finditer(text):
+        pages.append(text[start:match.end()])
+        start = match.end()
+    if start < len(text) or not pages:
+        pages.append(text[start:])
+    return pages
+
+
+def _page_starts(pages: Sequence[str]) -> List[int]:
+    """各ページの先頭の行番号（末尾に全体の行数）"""
+    starts = [0]
+    for page in pages:
+        starts.append(starts[-1] + page.count("\n") + (0 if not page or page.endswith("\n") else 1))
+    return starts
+
+
+def _lines_between(pages: Sequence[str], starts: Sequence[int], start: int, stop: int) -> List[str]:
+    """行番号 start から stop までの行（その範囲にかかるページだけを行に分ける）"""
+    first = bisect.bisect_right(starts, start) - 1
+    lines: List[str] = []
+    index = first
+    while index < len(pages) and starts[index] < stop:
+        lines.extend(_split_lines(pages[index]))
+        index += 1
+    return lines[start - starts[first]:stop - starts[first]]
+
+
+def _format_range(start: int, stop: int) -> str:
+    """hunk ヘッダーの範囲（difflib.unified_diff と同じ形式）"""
+    beginning = start + 1
+    length = stop - start
+    if length == 1:
+        return str(beginning)
+    if not length:
+        beginning -= 1
+    return f"{beginning},{length}"
+
+
+def _diff_line(prefix: str, line: str) -> str:
+    if line.endswith("\n"):
+        return prefix + line
+    return prefix + line + "\n\\ No newline at end of file\n"
+
+
+def iter_unified_diff(old: str, new: str, old_label: str, new_label: str,
+                      old_hashes: Optional[Sequence[str]] = None,
+                      new_hashes: Optional[Sequence[str]] = None,
+                      context: int = 3) -> Iterator[str]:
+    """old から new への unified diff を hunk ごとに出力
+
+    ページのハッシュで対応を取り、変更のないページは行の比較をせずに飛ばす
+    （行に分けるのは変更のあるページと、前後の文脈行を含むページだけ）
+    """
+    old_pages = split_page_texts(old)
+    new_pages = split_page_texts(new)
+    if old_hashes is None or len(old_hashes) != len(old_pages):
+        old_hashes = [hashlib.sha256(page.encode("utf-8")).hexdigest() for page in old_pages]
+    if new_hashes is None or len(new_hashes) != len(new_pages):
+        new_hashes = [hashlib.sha256(page.encode("utf-8")).hexdigest() for page in new_pages]
+
+    # 各ページの先頭の行番号
+    old_starts = _page_starts(old_pages)
+    new_starts = _page_starts(new_pages)
+
+    # 変更のあるページの範囲（間の変更のないページが文脈行に収まるほど短ければまとめる）
+    regions: List[List[int]] = []
+    pages = difflib.SequenceMatcher(None, old_hashes, new_hashes, autojunk=False)
+    for tag, i1, i2, j1, j2 in pages.get_opcodes():
+        if tag == "equal":
+            continue
+        if regions and old_starts[i1] - old_starts[regions[-1][1]] <= 2 * context:
+            regions[-1][1] = i2
+            regions[-1][3] = j2
+        else:
+            regions.append([i1, i2, j1, j2])
+
+    header_sent = False
+    previous_end = 0
+    for index, (i1, i2, j1, j2) in enumerate(regions):
+        # 前後の変更のないページから文脈行を足す（両方の版で同じ行）
+        before = min(context, old_starts[i1] - previous_end)
+        next_start = old_starts[regions[index + 1][0]] if index + 1 < len(regions) else old_starts[-1]
+        after = min(context, next_start - old_starts[i2])
+        previous_end = old_starts[i2]
+        a_offset = old_starts[i1] - before
+        b_offset = new_starts[j1] - before
+        a = _lines_between(old_pages, old_starts, a_offset, old_starts[i2] + after)
+        b = _lines_between(new_pages, new_starts, b_offset, new_starts[j2] + after)
+
+        for group in difflib.SequenceMatcher(None, a, b).get_grouped_opcodes(context):
+            if not header_sent:
+                yield f"--- {old_label}\n+++ {new_label}\n"
+                header_sent = True
+            hunk = [
+                f"@@ -{_format_range(a_offset + group[0][1], a_offset + group[-1][2])}"
+                f" +{_format_range(b_offset + group[0][3], b_offset + group[-1][4])} @@\n"
+            ]
+            for op, a1, a2, b1, b2 in group:
+                if op == "equal":
+                    hunk.extend(_diff_line(" ", line) for line in a[a1:a2])
+                    continue
+                hunk.extend(_diff_line("-", line) for line in a[a1:a2])
+                hunk.extend(_diff_line("+", line) for line in b[b1:b2])
+            yield "".join(hunk)
@@ -0,0 +1,40 @@
+"""
+保存先レイアウト移行コマンド
+
+フラットなディレクトリに保存された既存のPDFとMarkdownを、ブロブストアと
+ハッシュで分散したディレクトリに移す。APIや変換ワーカーを動かしたまま実行できる。
+
+使い方:
+    python -m src.api.migrate_layout --batch-size 500 --pause 0.5
+    python -m src.api.migrate_layout --dry-run
+"""
+
+import argparse
+from typing import List, Optional
+
+from .services.layout_migration_service import LayoutMigrationService
+from .services.pdf_service import PDFService
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """コマンドラインエントリーポイント"""
+    parser = argparse.ArgumentParser(description="保存先レイアウトの移行")
+    parser.add_argument("--markdown-dir", default="data/markdown", help="Markdownの保存先")
+    parser.add_argument("--batch-size", type=int, default=500, help="1バッチで処理するファイル数")
+    parser.add_argument("--pause", type=float, default=0.0,
+                        help="バッチの間に待つ秒数（稼働中のサービスへの負荷を抑える）")
+    parser.add_argument("--dry-run", action="store_true", help="移行対象の数だけを表示")
+    args = parser.parse_args(argv)
+
+    service = LayoutMigrationService(
+        PDFService(markdown_dir=args.markdown_dir),
+        batch_size=args.batch_size,
+        pause_seconds=args.pause,
+        dry_run=args.dry_run
+    )
+    totals = service.migrate()
+    print(f"Layout migration {'(dry run) ' if args.dry_run else ''}finished: {totals}")
+
+
+if __name__ == "__main__":
+    main()
@@ -27,6 +27,18 @@ class FileResponse(BaseModel):
     processing_time: Optional[float] = Field(None, description="処理時間（秒）")
 
 
+class FileFieldsResponse(BaseModel):
+    """フィールドを指定したファイルレスポンス（指定したフィールドのみ返す）"""
+    id: str = Field(..., description="ファイルID")
+    filename: Optional[str] = Field(None, description="ファイル名")
+    markdown: Optional[str] = Field(None, description="変換されたMarkdown")
+    status: Optional[FileStatus] = Field(None, description="処理状態")
+    created_at: Optional[datetime] = Field(None, description="作成日時")
+    updated_at: Optional[datetime] = Field(None, description="更新日時")
+    file_size: Optional[int] = Field(None, description="ファイルサイズ（バイト）")
+    processing_time: Optional[float] = Field(None, description="処理時間（秒）")
+
+
 class FileListResponse(BaseModel):
     """ファイル一覧レスポンス"""
     files: List[dict] = Field(..., description="ファイル一覧")
@@ -35,6 +47,21 @@ class FileListResponse(BaseModel):
     per_page: int = Field(10, description="1ページあたりの件数")
 
 
+# 一括操作1回あたりの最大ID数
+BATCH_MAX_IDS = 1000
+
+
+class BatchGetRequest(BaseModel):
+    """一括取得リクエスト"""
+    ids: List[str] = Field(..., min_length=1, max_length=BATCH_MAX_IDS, description="ファイルIDの一覧")
+    fields: Optional[List[str]] = Field(None, description="返すフィールド（省略時はすべて）")
+
+
+class BatchDeleteRequest(BaseModel):
+    """一括削除リクエスト"""
+    ids: List[str] = Field(..., min_length=1, max_length=BATCH_MAX_IDS, description="ファイルIDの一覧")
+
+
 class ErrorResponse(BaseModel):
     """エラーレスポンス"""
     detail: str = Field(..., description="エラーの詳細")
@@ -0,0 +1,45 @@
+"""
+ディスク整合性チェックコマンド
+
+どのファイルからも参照されていないPDF・Markdownを報告する。
+--delete を付けると、I/O を使い切らないよう速度を制限して削除する。
+
+使い方:
+    python -m src.api.reconcile
+    python -m src.api.reconcile --delete --max-deletes-per-second 20
+"""
+
+import argparse
+import json
+from typing import List, Optional
+
+from .services.pdf_service import PDFService
+from .services.reconcile_service import ReconcileService
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """コマンドラインエントリーポイント"""
+    parser = argparse.ArgumentParser(description="参照されていないディスク上のファイルの検出・削除")
+    parser.add_argument("--upload-dir", default="data/uploads", help="アップロードの保存先")
+    parser.add_argument("--markdown-dir", default="data/markdown", help="Markdownの保存先")
+    parser.add_argument("--delete", action="store_true", help="孤立ファイルを削除する")
+    parser.add_argument("--min-age", type=float, default=3600.0,
+                        help="この秒数より新しいファイルは対象外（書き込み中のファイルを守る）")
+    parser.add_argument("--max-deletes-per-second", type=float, default=50.0,
+                        help="1秒あたりの最大削除数（0で無制限）")
+    parser.add_argument("--max-scans-per-second", type=float, default=0.0,
+                        help="1秒あたりの最大走査数（0で無制限）")
+    args = parser.parse_args(argv)
+
+    service = ReconcileService(
+        PDFService(upload_dir=args.upload_dir, markdown_dir=args.markdown_dir),
+        delete=args.delete,
+        min_age_seconds=args.min_age,
+        max_deletes_per_second=args.max_deletes_per_second,
+        max_scans_per_second=args.max_scans_per_second
+    )
+    print(json.dumps(service.reconcile(), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -6,5 +6,21 @@
 
 from .pdf_service import PDFService
 from .file_service import FileService
+from .conversion_scheduler import ConversionScheduler
+from .recovery_service import RecoveryService
+from .response_cache import ResponseCache
+from .export_service import ExportService
+from .search_service import SearchService
+from .blob_store import BlobStore
+from .layout_migration_service import LayoutMigrationService
+from .reconcile_service import ReconcileService
+from .archive_service import ArchiveService
+from .backup_service import BackupService
+from .maintenance_service import MaintenanceService
 
-__all__ = ["PDFService", "FileService"]
+__all__ = [
+    "PDFService", "FileService", "ConversionScheduler", "RecoveryService", "ResponseCache",
+    "ExportService", "SearchService", "BlobStore",
+    "LayoutMigrationService", "ReconcileService", "ArchiveService",
+    "BackupService", "MaintenanceService"
+]
@@ -0,0 +1,266 @@
+"""
+アーカイブサービス
+
+長期間更新されていないファイルを files テーブルとファイルごとのディレクトリから外し、
+追記専用の圧縮パックファイル（data/archive/pack-<番号>.pack）にまとめて保存する。
+パックファイル上の位置は archived_files テーブルに記録し、GET /files/{file_id} から
+そのまま読み出せる。
+
+レコードの形式:
+    MAGIC(4) | 情報の長さ(4) | PDFの長さ(4) | 情報のCRC32(4) | PDFのCRC32(4)
+    | zlib圧縮したファイル情報・変換ログ・版の履歴(JSON) | zlib圧縮した元のPDF
+ファイル情報だけを読めるよう、情報とPDFは別々に圧縮する。
+版の履歴（file_versions の行）もレコードに移し、DB からは削除する。
+"""
+
+import base64
+import json
+import os
+import struct
+import threading
+import zlib
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from types import ModuleType
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+fcntl: Optional[ModuleType]
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from ..database import build_version_history, data_dir, db_manager, restore_from_history
+from .blob_store import blob_store
+
+
+RECORD_MAGIC = b"PDFA"
+RECORD_HEADER = struct.Struct(">4sIIII")
+
+# パックファイルをこの大きさで切り替える（バイト）
+DEFAULT_PACK_SIZE = 256 * 1024 * 1024
+
+
+class ArchiveService:
+    """パックファイルへのアーカイブと読み出しを担当するサービス"""
+
+    def __init__(self, root: Optional[str] = None, pack_size: Optional[int] = None):
+        if root is None:
+            root = os.getenv("ARCHIVE_DIR") or str(data_dir() / "archive")
+        if pack_size is None:
+            pack_size = int(os.getenv("ARCHIVE_PACK_SIZE", str(DEFAULT_PACK_SIZE)))
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.pack_size = pack_size
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _write_lock(self) -> Iterator[None]:
+        """パックファイルへの追記を直列化するロック（複数プロセス間でも有効）"""
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            with open(self.root / ".lock", "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _current_pack(self, record_size: int) -> Path:
+        """追記先のパックファイル（大きくなったら次の番号に切り替える）"""
+        packs = sorted(self.root.glob("pack-*.pack"))
+        if packs:
+            latest = packs[-1]
+            size = latest.stat().st_size
+            if size == 0 or size + record_size <= self.pack_size:
+                return latest
+            number = int(latest.stem.split("-")[1]) + 1
+        else:
+            number = 1
+        return self.root / f"pack-{number:06d}.pack"
+
+    @staticmethod
+    def _encode_record(info: Dict[str, Any], pdf: bytes) -> bytes:
+        info_data = zlib.compress(json.dumps(info, ensure_ascii=False).encode("utf-8"), 9)
+        pdf_data = zlib.compress(pdf, 6)
+        header = RECORD_HEADER.pack(RECORD_MAGIC, len(info_data), len(pdf_data),
+                                    zlib.crc32(info_data), zlib.crc32(pdf_data))
+        return header + info_data + pdf_data
+
+    def _append(self, record: bytes) -> Dict[str, Any]:
+        """レコードをパックファイルに追記して位置を返す"""
+        with self._write_lock():
+            pack = self._current_pack(len(record))
+            with open(pack, "ab") as f:
+                offset = f.tell()
+                f.write(record)
+                f.flush()
+                # 索引に登録する前にディスクへ書き込んでおく
+                os.fsync(f.fileno())
+        return {"pack": pack.name, "offset": offset, "length": len(record)}
+
+    def _read_record(self, location: Dict[str, Any], with_pdf: bool = False) -> Dict[str, Any]:
+        """パックファイルからレコードを読む（with_pdf=False ならPDFは読まない）"""
+        with open(self.root / location["pack"], "rb") as f:
+            f.seek(location["offset"])
+            magic, info_length, pdf_length, info_crc, pdf_crc = RECORD_HEADER.unpack(
+                f.read(RECORD_HEADER.size)
+            )
+            if magic != RECORD_MAGIC:
+                raise ValueError(f"Broken archive record: {location}")
+            info_data = f.read(info_length)
+            if zlib.crc32(info_data) != info_crc:
+                raise ValueError(f"Archive record checksum mismatch: {location}")
+            record: Dict[str, Any] = json.loads(zlib.decompress(info_data))
+            if with_pdf:
+                pdf_data = f.read(pdf_length)
+                if zlib.crc32(pdf_data) != pdf_crc:
+                    raise ValueError(f"Archive record checksum mismatch: {location}")
+                record["pdf"] = zlib.decompress(pdf_data)
+        return record
+
+    def archive_file(self, file_id: str) -> bool:
+        """ファイルをパックファイルへ移す（移せなかったら False）"""
+        file_info = db_manager.get_file(file_id)
+        if not file_info or file_info["status"] not in ("completed", "failed"):
+            return False
+
+        try:
+            with open(file_info["original_path"], "rb") as f:
+                pdf = f.read()
+        except FileNotFoundError:
+            pdf = b""
+
+        versions = db_manager.get_file_version_rows(file_id)
+        if versions is None:
+            return False
+
+        file_info.pop("markdown_encoding", None)
+        info = {"file": file_info, "logs": db_manager.get_conversion_logs(file_id),
+                "versions": [self._pack_version(row) for row in versions]}
+        location = self._append(self._encode_record(info, pdf))
+        # 追記の間に更新されたファイルは移さない（書いたレコードは参照されないまま残る）
+        return db_manager.move_file_to_archive(file_id, file_info["updated_at"], location,
+                                               len(versions))
+
+    @staticmethod
+    def _pack_version(row: Dict[str, Any]) -> Dict[str, Any]:
+        """版の履歴の行を JSON に入れられる形にする（BLOB は base64）"""
+        packed = dict(row)
+        payload = packed.pop("payload")
+        packed["stored_size"] = len(payload)
+        if isinstance(payload, bytes):
+            packed["payload_base64"] = base64.b64encode(payload).decode("ascii")
+        else:
+            packed["payload"] = payload
+        return packed
+
+    @staticmethod
+    def _unpack_version(packed: Dict[str, Any]) -> Dict[str, Any]:
+        row = dict(packed)
+        if "payload_base64" in row:
+            row["payload"] = base64.b64decode(row.pop("payload_base64"))
+        return row
+
+    def archive_cold_files(self, days: int = 30, batch_size: int = 100) -> Dict[str, Any]:
+        """days 日以上更新されていないファイルをすべてアーカイブ"""
+        cutoff = datetime.now(timezone.utc) - timedelta(days=days)
+        cutoff_text = cutoff.strftime("%Y-%m-%d %H:%M:%S")
+        result: Dict[str, Any] = {"archived_count": 0, "skipped": 0, "errors": 0,
+                                  "cutoff_date": cutoff.isoformat()}
+
+        while True:
+            rows = db_manager.find_cold_files(cutoff_text, batch_size)
+            archived = 0
+            for row in rows:
+                try:
+                    if self.archive_file(row["id"]):
+                        archived += 1
+                    else:
+                        result["skipped"] += 1
+                except Exception as e:
+                    print(f"Error archiving {row['id']}: {e}")
+                    result["errors"] += 1
+            result["archived_count"] += archived
+            # 移せたものがなければ同じ行を取り続けるので終了
+            if len(rows) < batch_size or archived == 0:
+                break
+
+        if result["archived_count"]:
+            blob_store.collect_garbage()
+        return result
+
+    def get_file(self, file_id: str) -> Optional[Dict[str, Any]]:
+        """アーカイブ済みファイルの情報を取得（files テーブルの行と同じ形）"""
+        location = db_manager.get_archived_file(file_id)
+        if location is None:
+            return None
+        try:
+            file_info: Dict[str, Any] = self._read_record(location)["file"]
+            return file_info
+        except Exception as e:
+            print(f"Error reading archived file {file_id}: {e}")
+            return None
+
+    def _read_versions(self, file_id: str) -> Optional[Tuple[Dict[str, Any], Dict[int, Dict[str, Any]]]]:
+        """アーカイブ済みファイルの版の一覧と、版ごとの保存している行"""
+        location = db_manager.get_archived_file(file_id)
+        if location is None:
+            return None
+        record = self._read_record(location)
+        file_info = record["file"]
+        if file_info.get("markdown_content") is None:
+            return None
+        rows = {packed["version"]: self._unpack_version(packed)
+                for packed in record.get("versions", [])}
+        history = build_version_history(file_info["markdown_content"], file_info.get("content_hash"),
+                                        file_info["updated_at"], list(rows.values()))
+        return history, rows
+
+    def list_file_versions(self, file_id: str) -> List[Dict[str, Any]]:
+        """アーカイブ済みファイルの版の一覧（DatabaseManager.list_file_versions と同じ形）"""
+        try:
+            loaded = self._read_versions(file_id)
+        except Exception as e:
+            print(f"Error reading archived versions {file_id}: {e}")
+            return []
+        if loaded is None:
+            return []
+        return [{key: value for key, value in version.items() if key != "page_hashes"}
+                for version in loaded[0]["versions"]]
+
+    def restore_file_versions(self, file_id: str,
+                              versions: List[int]) -> Dict[int, Dict[str, Any]]:
+        """アーカイブ済みファイルの指定した版の本文を復元"""
+        try:
+            loaded = self._read_versions(file_id)
+            if loaded is None:
+                return {}
+            history, rows = loaded
+            return restore_from_history(history, versions, rows.__getitem__)
+        except Exception as e:
+            print(f"Error restoring archived versions {file_id}: {e}")
+            return {}
+
+    def get_file_version(self, file_id: str, version: int) -> Optional[Dict[str, Any]]:
+        """アーカイブ済みファイルの指定した版の本文を復元して取得"""
+        restored = self.restore_file_versions(file_id, [version]).get(version)
+        if restored is None:
+            return None
+        restored.pop("page_hashes", None)
+        return restored
+
+    def get_original(self, file_id: str) -> Optional[bytes]:
+        """アーカイブ済みファイルの元のPDFを取得"""
+        location = db_manager.get_archived_file(file_id)
+        if location is None:
+            return None
+        pdf: bytes = self._read_record(location, with_pdf=True)["pdf"]
+        return pdf
+
+
+# グローバルインスタンス
+archive_service = ArchiveService()
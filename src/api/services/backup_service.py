@@ -0,0 +1,187 @@
+"""
+バックアップサービス
+
+サービスを止めずに、DB・アップロードされたPDF・Markdown・アーカイブの
+スナップショットを data/backups/<日時>/ に作成する。
+
+1. SQLite のオンラインバックアップAPIで、読み取りトランザクション中のDBを
+   少しずつコピーする（書き込みは止まらない）
+2. コピーしたDBが参照しているファイルだけをハードリンクで取り込む。
+   PDFは内容アドレスで書き換えられず、Markdownは置き換えで書き込まれるため、
+   リンクした時点の完全な内容が残る
+3. DBのスナップショットより後に書き換えられたMarkdownは、スナップショットの本文で書き直す
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Optional, Union
+
+from ..database import DatabaseManager, ShardedDatabaseManager, data_dir, db_manager
+from .archive_service import archive_service
+
+
+class BackupInProgressError(Exception):
+    """別のバックアップが実行中"""
+
+
+class BackupService:
+    """オンラインスナップショットを作成するサービス"""
+
+    def __init__(self, backup_dir: Optional[str] = None, pages: int = 256,
+                 pause_seconds: float = 0.0):
+        if backup_dir is None:
+            backup_dir = os.getenv("BACKUP_DIR") or str(data_dir() / "backups")
+        self.backup_dir = Path(backup_dir)
+        self.pages = pages
+        self.pause_seconds = pause_seconds
+        self._running = threading.Lock()
+
+    @staticmethod
+    def _snapshot_path(files_dir: Path, path: str) -> Path:
+        """スナップショット内の保存先（DBに記録されたパスの構成をそのまま使う）"""
+        relative = Path(path)
+        if relative.is_absolute():
+            relative = relative.relative_to(relative.anchor)
+        return files_dir / relative
+
+    @staticmethod
+    def _link_or_copy(source: str, target: Path) -> str:
+        """ハードリンクで取り込む（別デバイスならコピー）"""
+        target.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            os.link(source, target)
+            return "linked"
+        except FileExistsError:
+            return "exists"
+        except OSError:
+            shutil.copy2(source, target)
+            return "copied"
+
+    @staticmethod
+    def _copy_prefix(source: Path, target: Path, length: int) -> None:
+        """ファイルの先頭 length バイトをコピー（追記中のパックファイル用）"""
+        with open(source, "rb") as src, open(target, "wb") as dst:
+            remaining = length
+            while remaining > 0:
+                chunk = src.read(min(remaining, 1024 * 1024))
+                if not chunk:
+                    break
+                dst.write(chunk)
+                remaining -= len(chunk)
+
+    def _snapshot_markdown(self, row: Dict[str, Any], files_dir: Path,
+                           result: Dict[str, Any]) -> None:
+        """Markdownを取り込み、DBのスナップショットと内容が違えば書き直す"""
+        target = self._snapshot_path(files_dir, row["markdown_path"])
+        content = row.get("markdown_content")
+        try:
+            self._link_or_copy(row["markdown_path"], target)
+        except FileNotFoundError:
+            if content is None:
+                result["missing"] += 1
+                return
+        else:
+            if content is None or row.get("content_hash") is None:
+                return
+            if hashlib.sha256(target.read_bytes()).hexdigest() == row["content_hash"]:
+                return
+            # ハードリンク先（稼働中のファイル）に書き込まないよう、先にリンクを外す
+            target.unlink()
+
+        target.parent.mkdir(parents=True, exist_ok=True)
+        target.write_text(content, encoding="utf-8")
+        result["markdown_rewritten"] += 1
+
+    def _snapshot_archive(self, snapshot_db: Union[DatabaseManager, ShardedDatabaseManager],
+                          target_dir: Path,
+                          result: Dict[str, Any]) -> None:
+        """スナップショットが参照している範囲のパックファイルを取り込む"""
+        packs = sorted(archive_service.root.glob("pack-*.pack"))
+        latest = packs[-1].name if packs else None
+        for pack, end in snapshot_db.get_archive_pack_extents().items():
+            source = archive_service.root / pack
+            target = target_dir / "archive" / pack
+            target.parent.mkdir(parents=True, exist_ok=True)
+            if pack == latest:
+                # 追記中のパックファイルはスナップショットが参照している所までコピー
+                self._copy_prefix(source, target, end)
+            else:
+                self._link_or_copy(str(source), target)
+            result["packs"] += 1
+
+    def create_snapshot(self, name: Optional[str] = None) -> Dict[str, Any]:
+        """スナップショットを作成して内容の概要を返す"""
+        if not self._running.acquire(blocking=False):
+            raise BackupInProgressError("別のバックアップが実行中です")
+        try:
+            return self._create_snapshot(name)
+        finally:
+            self._running.release()
+
+    def _create_snapshot(self, name: Optional[str]) -> Dict[str, Any]:
+        started = datetime.now(timezone.utc)
+        name = name or started.strftime("%Y%m%dT%H%M%SZ")
+        target_dir = self.backup_dir / name
+        if target_dir.exists():
+            raise FileExistsError(f"Backup already exists: {target_dir}")
+        # 完成するまでは .partial として作り、最後に名前を変える
+        work_dir = self.backup_dir / f"{name}.partial"
+        if work_dir.exists():
+            shutil.rmtree(work_dir)
+        work_dir.mkdir(parents=True)
+
+        result: Dict[str, Any] = {
+            "name": name,
+            "created_at": started.isoformat(),
+            "database_pages": 0,
+            "files": 0,
+            "linked": 0,
+            "copied": 0,
+            "markdown_rewritten": 0,
+            "missing": 0,
+            "packs": 0,
+        }
+
+        try:
+            database_path = work_dir / "database.db"
+            progress = db_manager.backup_to(str(database_path), self.pages, self.pause_seconds)
+            result["database_pages"] = progress["pages"]
+
+            snapshot_db = db_manager.open_copy(str(database_path))
+            files_dir = work_dir / "files"
+            columns = ["id", "original_path", "markdown_path", "markdown_content", "content_hash"]
+            for row in snapshot_db.iter_files(columns=columns):
+                result["files"] += 1
+                try:
+                    outcome = self._link_or_copy(
+                        row["original_path"], self._snapshot_path(files_dir, row["original_path"])
+                    )
+                    if outcome in ("linked", "copied"):
+                        result[outcome] += 1
+                except FileNotFoundError:
+                    result["missing"] += 1
+                if row["markdown_path"]:
+                    self._snapshot_markdown(row, files_dir, result)
+
+            self._snapshot_archive(snapshot_db, work_dir, result)
+
+            result["completed_at"] = datetime.now(timezone.utc).isoformat()
+            (work_dir / "manifest.json").write_text(
+                json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8"
+            )
+            os.rename(work_dir, target_dir)
+        except Exception:
+            shutil.rmtree(work_dir, ignore_errors=True)
+            raise
+
+        result["path"] = str(target_dir)
+        return result
+
+
+# グローバルインスタンス
+backup_service = BackupService()
@@ -0,0 +1,106 @@
+"""
+ブロブストア
+
+アップロードされたPDFを内容のSHA-256で名前付けして保存する。
+同じ内容のPDFは1つだけ保存し、参照しているファイルがなくなったときに削除する。
+参照数は DB の blobs テーブルで管理する（files のトリガーで増減）。
+"""
+
+import hashlib
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from types import ModuleType
+from typing import Iterator, Optional
+
+fcntl: Optional[ModuleType]
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from ..database import data_dir, db_manager
+
+
+class BlobStore:
+    """内容アドレス方式のPDF保存先
+
+    保存先は <root>/<先頭2文字>/<次の2文字>/<sha256>.pdf
+    """
+
+    def __init__(self, root: Optional[str] = None):
+        if root is None:
+            root = os.getenv("BLOB_STORE_DIR") or str(data_dir() / "uploads" / "blobs")
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def digest(content: bytes) -> str:
+        """内容のダイジェスト（SHA-256）"""
+        return hashlib.sha256(content).hexdigest()
+
+    def path_for(self, digest: str) -> Path:
+        """ダイジェストに対応する保存先"""
+        return self.root / digest[:2] / digest[2:4] / f"{digest}.pdf"
+
+    @contextmanager
+    def lock(self) -> Iterator[None]:
+        """保存と参照の登録・未参照ブロブの削除を直列化するロック
+
+        保存してから参照を登録するまでの間に、同じブロブが未参照として
+        削除されないようにする（複数のAPIプロセス間でも有効）
+        """
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            with open(self.root / ".lock", "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def put(self, content: bytes) -> str:
+        """PDFを保存してダイジェストを返す（同じ内容が保存済みなら書き込まない）
+
+        lock() の中で呼び出し、同じロックの中で参照を登録すること
+        """
+        digest = self.digest(content)
+        path = self.path_for(digest)
+        if path.exists():
+            return digest
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # 書きかけのファイルが見えないよう一時ファイルに書いてから置き換える
+        fd, temp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(content)
+            os.replace(temp_path, path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return digest
+
+    def collect_garbage(self) -> int:
+        """参照数が0になったブロブを削除（削除した数を返す）"""
+        removed = 0
+        with self.lock():
+            for digest in db_manager.take_unreferenced_blobs():
+                try:
+                    self.path_for(digest).unlink()
+                    removed += 1
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    print(f"Error removing blob {digest}: {e}")
+        return removed
+
+
+# グローバルインスタンス
+blob_store = BlobStore()
@@ -0,0 +1,187 @@
+"""
+変換スケジューラ
+
+PDF変換ジョブを見積もりコストの小さい順（Shortest-Job-First）に実行する。
+待ち時間に応じたエージングで大きなジョブの飢餓を防ぐ。
+"""
+
+import asyncio
+import heapq
+import itertools
+import os
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from io import BytesIO
+from typing import Any, Callable, List, Optional
+
+import pypdf
+
+
+# 見積もりの係数（秒）
+SECONDS_PER_PAGE = 0.05
+SECONDS_PER_MB = 0.5
+
+# 明示的な優先度1段階あたりの前倒し量（秒）
+PRIORITY_STEP_SECONDS = 10.0
+
+
+class ConversionCancelled(Exception):
+    """変換が新しい更新や削除によってキャンセルされた"""
+
+
+@dataclass
+class JobEstimate:
+    """変換ジョブのコスト見積もり"""
+    page_count: int
+    file_size: int
+    cost: float
+
+
+def estimate_job_cost(file_content: bytes) -> JobEstimate:
+    """PDFのページ数とファイルサイズから変換コストを見積もる"""
+    file_size = len(file_content)
+    page_count = 0
+
+    try:
+        # ページツリー全体は辿らず、トレーラーから /Pages の /Count だけを読む
+        trailer: Any = pypdf.PdfReader(BytesIO(file_content)).trailer
+        page_count = int(trailer["/Root"]["/Pages"]["/Count"])
+    except Exception:
+        # ページ数が取れない場合はサイズから概算（1ページ約50KB）
+        page_count = max(1, file_size // (50 * 1024))
+
+    cost = page_count * SECONDS_PER_PAGE + (file_size / (1024 * 1024)) * SECONDS_PER_MB
+    return JobEstimate(page_count=page_count, file_size=file_size, cost=round(cost, 4))
+
+
+def compute_sort_key(estimate: JobEstimate, enqueued_at: float,
+                     priority: Optional[int] = None,
+                     aging_rate: float = 1.0) -> float:
+    """キュー内の並び順キーを計算（小さいほど先に実行）
+
+    実効優先度 = cost - aging_rate * (now - enqueued_at) - priority * step
+    のうち now は全ジョブ共通なので、残りの項だけで静的なキーになる。
+    """
+    boost = (priority or 0) * PRIORITY_STEP_SECONDS
+    return estimate.cost + aging_rate * enqueued_at - boost
+
+
+@dataclass(order=True)
+class _QueuedJob:
+    """キュー内のジョブ"""
+    sort_key: float
+    seq: int
+    func: Callable[..., Any] = field(compare=False)
+    args: tuple = field(compare=False)
+    future: Future = field(compare=False)
+    estimate: JobEstimate = field(compare=False)
+    priority: Optional[int] = field(compare=False)
+    enqueued_at: float = field(compare=False)
+    cancel_event: Optional[threading.Event] = field(compare=False, default=None)
+
+
+class ConversionScheduler:
+    """見積もりコスト順に変換ジョブを実行するスケジューラ"""
+
+    def __init__(self, max_workers: Optional[int] = None,
+                 aging_rate: Optional[float] = None):
+        if max_workers is None:
+            max_workers = int(os.getenv(
+                "CONVERSION_WORKERS", str(min(4, os.cpu_count() or 1))
+            ))
+        if aging_rate is None:
+            aging_rate = float(os.getenv("CONVERSION_AGING_RATE", "1.0"))
+
+        self.max_workers = max(1, max_workers)
+        self.aging_rate = aging_rate
+        self._queue: List[_QueuedJob] = []
+        self._seq = itertools.count()
+        self._condition = threading.Condition()
+        self._workers: List[threading.Thread] = []
+        self._running = 0
+
+    def _ensure_workers(self) -> None:
+        """ワーカースレッドを必要に応じて起動"""
+        while len(self._workers) < self.max_workers:
+            worker = threading.Thread(
+                target=self._worker_loop,
+                name=f"conversion-worker-{len(self._workers)}",
+                daemon=True
+            )
+            self._workers.append(worker)
+            worker.start()
+
+    def _worker_loop(self) -> None:
+        """キューからジョブを取り出して実行"""
+        while True:
+            with self._condition:
+                while not self._queue:
+                    self._condition.wait()
+                job = heapq.heappop(self._queue)
+                self._running += 1
+
+            try:
+                if job.future.set_running_or_notify_cancel():
+                    # 待機中にキャンセルされたジョブは実行しない
+                    if job.cancel_event is not None and job.cancel_event.is_set():
+                        job.future.set_exception(ConversionCancelled())
+                        continue
+                    try:
+                        job.future.set_result(job.func(*job.args))
+                    except BaseException as e:
+                        job.future.set_exception(e)
+            finally:
+                with self._condition:
+                    self._running -= 1
+
+    def submit(self, func: Callable[..., Any], *args: Any,
+               estimate: JobEstimate, priority: Optional[int] = None,
+               cancel_event: Optional[threading.Event] = None) -> Future:
+        """ジョブをキューに追加
+
+        cancel_event がセットされたジョブは、実行前であればスキップされる
+        """
+        enqueued_at = time.time()
+        job = _QueuedJob(
+            sort_key=compute_sort_key(estimate, enqueued_at, priority, self.aging_rate),
+            seq=next(self._seq),
+            func=func,
+            args=args,
+            future=Future(),
+            estimate=estimate,
+            priority=priority,
+            enqueued_at=enqueued_at,
+            cancel_event=cancel_event
+        )
+
+        with self._condition:
+            self._ensure_workers()
+            heapq.heappush(self._queue, job)
+            self._condition.notify()
+
+        return job.future
+
+    async def run(self, func: Callable[..., Any], *args: Any,
+                  estimate: JobEstimate, priority: Optional[int] = None,
+                  cancel_event: Optional[threading.Event] = None) -> Any:
+        """ジョブを投入し、完了を待って結果を返す"""
+        future = self.submit(
+            func, *args, estimate=estimate, priority=priority, cancel_event=cancel_event
+        )
+        return await asyncio.wrap_future(future)
+
+    def get_status(self) -> dict:
+        """キューの状態を取得"""
+        with self._condition:
+            return {
+                "workers": self.max_workers,
+                "running": self._running,
+                "queued": len(self._queue),
+                "queued_cost": round(sum(job.estimate.cost for job in self._queue), 4)
+            }
+
+
+# グローバルインスタンス
+conversion_scheduler = ConversionScheduler()
@@ -0,0 +1,100 @@
+"""
+エクスポートサービス
+
+変換済みドキュメントを NDJSON または .md ファイルの tar アーカイブとして
+ストリーミング出力する。1件ずつ読み出して書き出すため、件数に関わらず
+メモリ使用量は一定。
+"""
+
+import json
+import tarfile
+from datetime import datetime
+from typing import Any, Dict, Iterator, Optional
+
+from ..database import db_manager
+from ..models import FileStatus
+
+
+# エクスポートで読み出す列
+EXPORT_COLUMNS = [
+    "id", "filename", "status", "file_size", "created_at", "updated_at",
+    "processing_time", "markdown_content"
+]
+
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "tar": "application/x-tar",
+}
+
+
+class ExportService:
+    """変換済みドキュメントのエクスポートサービス"""
+
+    def __init__(self, batch_size: int = 500):
+        self.batch_size = batch_size
+
+    def _iter_rows(self, status: Optional[str],
+                   updated_since: Optional[str]) -> Iterator[Dict[str, Any]]:
+        return db_manager.iter_files(
+            columns=EXPORT_COLUMNS,
+            status=status,
+            updated_since=updated_since,
+            batch_size=self.batch_size
+        )
+
+    def iter_ndjson(self, status: Optional[str] = FileStatus.COMPLETED,
+                    updated_since: Optional[str] = None) -> Iterator[bytes]:
+        """1ドキュメント1行の NDJSON を出力"""
+        for row in self._iter_rows(status, updated_since):
+            document = {
+                "id": row["id"],
+                "filename": row["filename"],
+                "status": row["status"],
+                "file_size": row["file_size"],
+                "created_at": row["created_at"],
+                "updated_at": row["updated_at"],
+                "processing_time": row["processing_time"],
+                "markdown": row["markdown_content"] or ""
+            }
+            yield (json.dumps(document, ensure_ascii=False) + "\n").encode("utf-8")
+
+    def iter_tar(self, status: Optional[str] = FileStatus.COMPLETED,
+                 updated_since: Optional[str] = None) -> Iterator[bytes]:
+        """<id>.md を並べた tar アーカイブを出力
+
+        tarfile の "w|" モードでもストリーム出力できるが、書き込み先のファイルオブジェクトを
+        介さずにチャンクを返せるよう、ヘッダーと本文を自前で連結する
+        """
+        for row in self._iter_rows(status, updated_since):
+            data = (row["markdown_content"] or "").encode("utf-8")
+
+            info = tarfile.TarInfo(name=f"{row['id']}.md")
+            info.size = len(data)
+            info.mode = 0o644
+            info.mtime = self._to_timestamp(row["updated_at"])
+            yield info.tobuf(format=tarfile.PAX_FORMAT, encoding="utf-8")
+            yield data
+
+            # 本文は512バイト境界まで埋める
+            padding = -len(data) % tarfile.BLOCKSIZE
+            if padding:
+                yield tarfile.NUL * padding
+
+        # アーカイブの終端（空ブロック2つ）
+        yield tarfile.NUL * (tarfile.BLOCKSIZE * 2)
+
+    def iter_export(self, export_format: str, status: Optional[str] = FileStatus.COMPLETED,
+                    updated_since: Optional[str] = None) -> Iterator[bytes]:
+        """指定された形式でエクスポート"""
+        if export_format == "tar":
+            return self.iter_tar(status, updated_since)
+        return self.iter_ndjson(status, updated_since)
+
+    @staticmethod
+    def _to_timestamp(value: Optional[str]) -> int:
+        if not value:
+            return 0
+        try:
+            return int(datetime.fromisoformat(value).timestamp())
+        except (TypeError, ValueError):
+            return 0
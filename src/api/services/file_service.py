@@ -4,24 +4,124 @@
 ファイルの取得、一覧表示、削除などの処理を担当
 """
 
+import hashlib
 import os
-from datetime import datetime
-from typing import Optional, Dict, Any, List
+from datetime import datetime, timezone
+from typing import Optional, Dict, Any, List, Tuple
 from pathlib import Path
 
+from .. import markdown_codec, markdown_delta
 from ..database import db_manager
 from ..models import FileStatus
+from .response_cache import file_response_cache
+from .blob_store import blob_store
+from .archive_service import archive_service
+
+
+# レスポンスのフィールド名 -> files テーブルの列名
+FILE_FIELD_COLUMNS = {
+    "id": "id",
+    "filename": "filename",
+    "markdown": "markdown_content",
+    "status": "status",
+    "created_at": "created_at",
+    "updated_at": "updated_at",
+    "file_size": "file_size",
+    "processing_time": "processing_time",
+}
+
+# ETag の計算に使う列
+ETAG_COLUMNS = ("id", "updated_at", "status", "filename", "file_size", "content_hash")
 
 
 class FileService:
     """ファイル管理サービス"""
     
-    def __init__(self):
+    def __init__(self) -> None:
         pass
     
+    @staticmethod
+    def _make_etag(file_info: Dict[str, Any], fields: Optional[List[str]] = None) -> str:
+        """ファイル情報から強いETagを生成
+
+        本文は content_hash で代表させ、状態やファイル名の変更も反映する
+        """
+        validator = "|".join(str(file_info.get(key) or "") for key in ETAG_COLUMNS)
+        if fields is not None:
+            # フィールド指定のレスポンスは表現が異なるため別のETagにする
+            validator += "|" + ",".join(fields)
+        return '"' + hashlib.sha256(validator.encode("utf-8")).hexdigest()[:32] + '"'
+    
+    def parse_fields(self, fields: Optional[str]) -> Optional[List[str]]:
+        """fields パラメータを解析（未知のフィールドは ValueError）"""
+        if fields is None:
+            return None
+        
+        names = [name.strip() for name in fields.split(",") if name.strip()]
+        unknown = [name for name in names if name not in FILE_FIELD_COLUMNS]
+        if unknown:
+            raise ValueError(", ".join(unknown))
+        
+        # id は常に返す
+        return list(dict.fromkeys(["id"] + names))
+    
+    def _project(self, file_info: Dict[str, Any], fields: List[str]) -> Dict[str, Any]:
+        """指定されたフィールドだけのレスポンス用データを作成"""
+        projected = {name: file_info.get(FILE_FIELD_COLUMNS[name]) for name in fields}
+        if "markdown" in projected:
+            projected["markdown"] = projected["markdown"] or ""
+        return projected
+    
+    def get_file_fields(self, file_id: str, fields: List[str]) -> Optional[Dict[str, Any]]:
+        """指定されたフィールドだけを取得（指定されない列はDBから読まない）"""
+        columns = list(dict.fromkeys(
+            list(ETAG_COLUMNS) + [FILE_FIELD_COLUMNS[name] for name in fields]
+        ))
+        file_info = db_manager.get_file(file_id, columns=columns) or archive_service.get_file(file_id)
+        if not file_info:
+            return None
+        
+        projected = self._project(file_info, fields)
+        projected["etag"] = self._make_etag(file_info, fields)
+        return projected
+    
+    def get_file_etag(self, file_id: str) -> Optional[str]:
+        """Markdown本文を読まずにファイルのETagを取得"""
+        validator = db_manager.get_file_validator(file_id) or archive_service.get_file(file_id)
+        return self._make_etag(validator) if validator else None
+    
+    def get_list_etag(self, page: int, per_page: int,
+                      fields: Optional[List[str]] = None,
+                      filters: Optional[Dict[str, Any]] = None,
+                      sort: Optional[str] = None) -> Optional[str]:
+        """一覧を読まずに一覧のETagを取得（DBの変更カウンターと取得条件から作る）"""
+        version = db_manager.get_list_version()
+        if version is None:
+            return None
+        validator = "|".join([
+            str(version), str(page), str(per_page), sort or "",
+            ",".join(fields) if fields is not None else "*",
+            ",".join(f"{key}={value}" for key, value in sorted((filters or {}).items()))
+        ])
+        return '"' + hashlib.sha256(validator.encode("utf-8")).hexdigest()[:32] + '"'
+    
+    def get_markdown_location(self, file_id: str) -> Optional[Dict[str, Any]]:
+        """保存済みMarkdownファイルの場所とETagを取得（本文は読まない）"""
+        validator = db_manager.get_file_validator(file_id)
+        if not validator:
+            return None
+        
+        return {
+            "id": validator["id"],
+            "filename": validator["filename"],
+            "status": validator["status"],
+            "markdown_path": validator.get("markdown_path"),
+            "etag": self._make_etag(validator)
+        }
+    
     def get_file(self, file_id: str) -> Optional[Dict[str, Any]]:
-        """ファイル情報を取得"""
-        file_info = db_manager.get_file(file_id)
+        """ファイル情報を取得（アーカイブ済みならパックファイルから読む）"""
+        file_info = db_manager.get_file(file_id) or archive_service.get_file(file_id)
         if not file_info:
             return None
         
@@ -29,17 +129,71 @@ class FileService:
         return {
             "id": file_info["id"],
             "filename": file_info["filename"],
-            "markdown": file_info.get("markdown_content", ""),
+            "markdown": file_info.get("markdown_content") or "",
             "status": file_info["status"],
             "created_at": file_info["created_at"],
             "updated_at": file_info["updated_at"],
             "file_size": file_info["file_size"],
-            "processing_time": file_info.get("processing_time")
+            "processing_time": file_info.get("processing_time"),
+            "etag": self._make_etag(file_info)
         }
     
-    def list_files(self, page: int = 1, per_page: int = 10) -> Dict[str, Any]:
-        """ファイル一覧を取得"""
-        result = db_manager.list_files(page, per_page)
+    def get_files(self, file_ids: List[str],
+                  fields: Optional[List[str]] = None) -> Dict[str, Dict[str, Any]]:
+        """複数のファイル情報をまとめて取得（見つかったものだけをIDで引ける辞書）"""
+        if fields is None:
+            rows = db_manager.get_files(file_ids)
+            return {
+                file_id: self._project(file_info, list(FILE_FIELD_COLUMNS))
+                for file_id, file_info in rows.items()
+            }
+        
+        rows = db_manager.get_files(file_ids, columns=[FILE_FIELD_COLUMNS[name] for name in fields])
+        return {file_id: self._project(file_info, fields) for file_id, file_info in rows.items()}
+    
+    @staticmethod
+    def _list_options(filters: Optional[Dict[str, Any]],
+                      sort: Optional[str]) -> Dict[str, Any]:
+        """一覧の絞り込み・並び替え条件（指定されたものだけ）"""
+        options: Dict[str, Any] = {}
+        if filters:
+            options["filters"] = {
+                key: (FileService._format_timestamp(value) if isinstance(value, datetime) else value)
+                for key, value in filters.items()
+            }
+        if sort:
+            options["sort"] = sort
+        return options
+    
+    @staticmethod
+    def _format_timestamp(value: datetime) -> str:
+        """DBの CURRENT_TIMESTAMP と同じ形式（UTC）に変換"""
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    
+    def list_files(self, page: int = 1, per_page: int = 10,
+                   fields: Optional[List[str]] = None,
+                   filters: Optional[Dict[str, Any]] = None,
+                   sort: Optional[str] = None) -> Dict[str, Any]:
+        """ファイル一覧を取得（fields を指定するとその列だけを読む）
+
+        filters: status, filename_prefix, created_from, created_to, min_size, max_size
+        sort: created_at / processing_time / file_size（先頭に "-" で降順）
+        """
+        options = self._list_options(filters, sort)
+        if fields is not None:
+            columns = [FILE_FIELD_COLUMNS[name] for name in fields]
+            result = db_manager.list_files(page, per_page, columns=columns, **options)
+            files = [self._project(file_info, fields) for file_info in result["files"]]
+            return {
+                "files": files,
+                "total_count": result["total_count"],
+                "page": result["page"],
+                "per_page": result["per_page"]
+            }
+        
+        result = db_manager.list_files(page, per_page, **options)
         
         # レスポンス用のデータを整形
         files = []
@@ -74,6 +228,7 @@ class FileService:
             FileStatus.COMPLETED, 
             markdown_content
         ):
+            file_response_cache.invalidate(file_id)
             # 更新後のファイル情報を取得
             return self.get_file(file_id)
         
@@ -81,7 +236,20 @@ class FileService:
     
     def delete_file(self, file_id: str) -> bool:
         """ファイルを削除"""
-        return db_manager.delete_file(file_id)
+        deleted = db_manager.delete_file(file_id)
+        file_response_cache.invalidate(file_id)
+        if deleted:
+            blob_store.collect_garbage()
+        return deleted
+    
+    def delete_files(self, file_ids: List[str]) -> List[str]:
+        """複数のファイルをまとめて削除（削除できたIDを返す）"""
+        deleted = db_manager.delete_files(file_ids)
+        for file_id in deleted:
+            file_response_cache.invalidate(file_id)
+        if deleted:
+            blob_store.collect_garbage()
+        return deleted
     
     def get_file_status(self, file_id: str) -> Optional[str]:
         """ファイルの状態を取得"""
@@ -92,34 +260,89 @@ class FileService:
         """変換ログを取得"""
         return db_manager.get_conversion_logs(file_id)
     
+    def _version_source(self, file_id: str) -> Tuple[Any, List[Dict[str, Any]]]:
+        """版の履歴の読み出し先（アーカイブ済みならパックファイル）と版の一覧"""
+        versions = db_manager.list_file_versions(file_id)
+        if versions:
+            return db_manager, versions
+        return archive_service, archive_service.list_file_versions(file_id)
+    
+    def get_file_versions(self, file_id: str) -> Optional[List[Dict[str, Any]]]:
+        """Markdownの版の一覧を取得（ファイルがなければ None）"""
+        _, versions = self._version_source(file_id)
+        if not versions and not self.get_file_etag(file_id):
+            return None
+        return versions
+    
+    def get_file_version(self, file_id: str, version: int) -> Optional[Dict[str, Any]]:
+        """指定した版のMarkdownを取得"""
+        data = (db_manager.get_file_version(file_id, version)
+                or archive_service.get_file_version(file_id, version))
+        if not data:
+            return None
+        return {
+            "file_id": file_id,
+            "version": data["version"],
+            "markdown": data["markdown_content"],
+            "content_hash": data["content_hash"],
+            "size": data["size"],
+            "created_at": data["created_at"]
+        }
+    
+    def diff_versions(self, file_id: str, from_version: Optional[int] = None,
+                      to_version: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """2つの版の unified diff を準備（版がなければ None）
+
+        to を省略すると最新の版、from を省略すると to の1つ前の版と比較する。
+        chunks は hunk ごとに差分を出力するイテレータ
+        """
+        source, rows = self._version_source(file_id)
+        versions = {row["version"]: row for row in rows}
+        if not versions:
+            return None
+        if to_version is None:
+            to_version = max(versions)
+        if from_version is None:
+            from_version = to_version - 1
+        if from_version not in versions or to_version not in versions:
+            return None
+        
+        result = {"from": from_version, "to": to_version, "chunks": iter(())}
+        # 本文が同じなら復元せずに空の差分を返す
+        if versions[from_version]["content_hash"] == versions[to_version]["content_hash"]:
+            return result
+        
+        # 2つの版は同じ差分の列を共有するため、一度に復元する
+        restored = source.restore_file_versions(file_id, [from_version, to_version])
+        old = restored.get(from_version)
+        new = restored.get(to_version)
+        if old is None or new is None:
+            return None
+        chunks = markdown_delta.iter_unified_diff(
+            old["markdown_content"], new["markdown_content"],
+            f"{file_id}@v{from_version}\t{old['created_at']}",
+            f"{file_id}@v{to_version}\t{new['created_at']}",
+            old["page_hashes"], new["page_hashes"]
+        )
+        result["chunks"] = (chunk.encode("utf-8") for chunk in chunks)
+        return result
+    
     def get_file_statistics(self) -> Dict[str, Any]:
         """ファイル統計情報を取得"""
         try:
-            # 全ファイル数を取得
-            all_files = db_manager.list_files(page=1, per_page=10000)
-            total_files = all_files["total_count"]
+            # 状態ごとの集計をデータベースで行う（本文も行そのものも読まない）
+            statistics = db_manager.get_file_statistics()
+            total_files = sum(stat["count"] for stat in statistics.values())
             
             # 状態別のファイル数を集計
             status_counts = {"processing": 0, "completed": 0, "failed": 0}
-            total_size = 0
-            total_processing_time = 0
-            
-            # ファイルリストが存在する場合のみ処理
-            if all_files["files"]:
-                for file_info in all_files["files"]:
-                    status = file_info.get("status", "unknown")
-                    if status in status_counts:
-                        status_counts[status] += 1
-                    
-                    # ファイルサイズの安全な取得
-                    file_size = file_info.get("file_size", 0)
-                    if isinstance(file_size, (int, float)) and file_size >= 0:
-                        total_size += file_size
-                    
-                    # 処理時間の安全な取得
-                    processing_time = file_info.get("processing_time")
-                    if isinstance(processing_time, (int, float)) and processing_time >= 0:
-                        total_processing_time += processing_time
+            for status in status_counts:
+                if status in statistics:
+                    status_counts[status] = statistics[status]["count"]
+            total_size = sum(stat["total_size"] for stat in statistics.values())
+            total_processing_time = sum(
+                stat["total_processing_time"] for stat in statistics.values()
+            )
             
             # 平均処理時間の安全な計算
             average_processing_time = 0
@@ -146,28 +369,36 @@ class FileService:
                 "average_processing_time": 0
             }
     
-    def cleanup_old_files(self, days: int = 30) -> Dict[str, Any]:
-        """古いファイルをクリーンアップ"""
+    def cleanup_old_files(self, days: int = 30, mode: str = "delete") -> Dict[str, Any]:
+        """古いファイルをクリーンアップ
+
+        mode="archive" では削除せず、days 日以上更新されていないファイルをパックファイルへ移す
+        """
+        if mode == "archive":
+            return self.archive_old_files(days)
+        
         try:
             # 指定日数より古いファイルを検索
             from datetime import timedelta
-            cutoff_date = datetime.now() - timedelta(days=days)
-            
-            # データベースから古いファイルを取得
-            # 注: 実際の実装では、より効率的なクエリを使用
-            all_files = db_manager.list_files(page=1, per_page=10000)
-            old_files = []
+            cutoff_date = datetime.now(timezone.utc) - timedelta(days=days)
             
-            for file_info in all_files["files"]:
-                created_at = datetime.fromisoformat(file_info["created_at"].replace('Z', '+00:00'))
-                if created_at < cutoff_date:
-                    old_files.append(file_info["id"])
+            # created_at は SQLite の CURRENT_TIMESTAMP（UTC）と同じ形式で比べる
+            old_files = db_manager.find_files_created_before(
+                cutoff_date.strftime("%Y-%m-%d %H:%M:%S")
+            )
             
             # 古いファイルを削除
             deleted_count = 0
             for file_id in old_files:
-                if db_manager.delete_file(file_id):
-                    deleted_count += 1
+                try:
+                    if db_manager.delete_file(file_id):
+                        deleted_count += 1
+                except markdown_codec.MarkdownCodecError as e:
+                    # 本文を展開できないファイルは残して、ほかのファイルの削除を続ける
+                    print(f"Error cleaning up file {file_id}: {e}")
+                file_response_cache.invalidate(file_id)
+            if deleted_count:
+                blob_store.collect_garbage()
             
             return {
                 "success": True,
@@ -183,6 +414,18 @@ class FileService:
                 "deleted_count": 0
             }
     
+    def archive_old_files(self, days: int = 30) -> Dict[str, Any]:
+        """古いファイルをアーカイブ"""
+        try:
+            result = archive_service.archive_cold_files(days)
+            return {"success": True, **result}
+        except Exception as e:
+            return {
+                "success": False,
+                "error": str(e),
+                "archived_count": 0
+            }
+    
     def get_current_time(self) -> datetime:
         """現在時刻を取得"""
         return datetime.now()
@@ -0,0 +1,152 @@
+"""
+保存先レイアウト移行サービス
+
+フラットな data/uploads・data/markdown に保存された既存ファイルを、
+ブロブストアとハッシュで分散したディレクトリ構成に移す。
+サービスを止めずに実行できるよう、少しずつ移して DB の保存先を
+条件付きで書き換える（その間に再変換されたファイルは触らない）。
+"""
+
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from ..database import db_manager
+from .blob_store import blob_store
+from .pdf_service import PDFService
+
+
+class LayoutMigrationService:
+    """既存ファイルを新しい保存先レイアウトへ移行するサービス"""
+
+    def __init__(self, pdf_service: PDFService, batch_size: int = 500,
+                 pause_seconds: float = 0.0, dry_run: bool = False):
+        self.pdf_service = pdf_service
+        self.batch_size = batch_size
+        self.pause_seconds = pause_seconds
+        self.dry_run = dry_run
+
+    @staticmethod
+    def _link_or_copy(source: str, target: Path) -> None:
+        """移行先にハードリンクを作成（別デバイスならコピー）
+
+        移行先がすでにある場合（前回の中断や、移行中の再変換）は上書きしない
+        """
+        target.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            os.link(source, target)
+            return
+        except FileExistsError:
+            return
+        except OSError:
+            pass
+
+        fd, temp_path = tempfile.mkstemp(dir=target.parent, suffix=".tmp")
+        os.close(fd)
+        try:
+            shutil.copy2(source, temp_path)
+            os.link(temp_path, target)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(temp_path)
+
+    def _migrate_markdown(self, row: Dict[str, Any]) -> Optional[bool]:
+        """Markdownを分散ディレクトリへ移す（対象外ならNone）"""
+        target = self.pdf_service.markdown_path_for(row["id"])
+        source = row["markdown_path"]
+        if source is None:
+            # markdown_path を記録する前に保存されたファイル
+            legacy = self.pdf_service.markdown_dir / f"{row['id']}.md"
+            if not legacy.exists():
+                return None
+            source_path = str(legacy)
+        else:
+            if Path(source) == target or not os.path.exists(source):
+                return None
+            source_path = source
+
+        if self.dry_run:
+            return True
+
+        # 新しい場所にリンクを作ってから保存先を切り替え、最後に古い方を消す。
+        # 切り替え前に読んだリクエストも古いパスで読み切れる
+        self._link_or_copy(source_path, target)
+        if not db_manager.relocate_markdown(row["id"], source, str(target)):
+            return False
+        os.remove(source_path)
+        return True
+
+    def _migrate_upload(self, row: Dict[str, Any]) -> Optional[bool]:
+        """元のPDFをブロブストアへ移す（対象外ならNone）"""
+        source = row["original_path"]
+        if row["blob_digest"] is not None or not os.path.exists(source):
+            return None
+
+        if self.dry_run:
+            return True
+
+        with open(source, "rb") as f:
+            content = f.read()
+
+        with blob_store.lock():
+            digest = blob_store.digest(content)
+            target = blob_store.path_for(digest)
+            existed = target.exists()
+            blob_store.put(content)
+            if not db_manager.relocate_original(row["id"], source, str(target), digest):
+                # 移行中に再アップロードされた。自分で書いたブロブは参照がないので消す
+                if not existed:
+                    target.unlink()
+                return False
+        os.remove(source)
+        return True
+
+    def migrate_batch(self, after_rowid: int = 0) -> Dict[str, Any]:
+        """rowid が after_rowid より大きいファイルを1バッチ分移行"""
+        rows = db_manager.list_file_locations(after_rowid, self.batch_size)
+        result = {
+            "scanned": len(rows),
+            "markdown_moved": 0,
+            "uploads_moved": 0,
+            "skipped": 0,
+            "errors": 0,
+            "last_rowid": rows[-1]["rowid"] if rows else after_rowid
+        }
+
+        for row in rows:
+            for key, migrate in (("markdown_moved", self._migrate_markdown),
+                                 ("uploads_moved", self._migrate_upload)):
+                try:
+                    moved = migrate(row)
+                except Exception as e:
+                    print(f"Error migrating {row['id']}: {e}")
+                    result["errors"] += 1
+                    continue
+                if moved:
+                    result[key] += 1
+                elif moved is False:
+                    result["skipped"] += 1
+
+        return result
+
+    def migrate(self) -> Dict[str, int]:
+        """すべてのファイルを移行（バッチの間に pause_seconds 待つ）"""
+        totals = {"scanned": 0, "markdown_moved": 0, "uploads_moved": 0, "skipped": 0, "errors": 0}
+        after_rowid = 0
+
+        while True:
+            result = self.migrate_batch(after_rowid)
+            for key in totals:
+                totals[key] += result[key]
+            if result["scanned"] < self.batch_size:
+                break
+            after_rowid = result["last_rowid"]
+            print(f"Migrated up to rowid {after_rowid}: {totals}")
+            if self.pause_seconds:
+                time.sleep(self.pause_seconds)
+
+        return totals
@@ -0,0 +1,124 @@
+"""
+DBメンテナンスサービス
+
+大量削除で空いたページを、リクエストや変換がない間に少しずつ返して
+DBファイルを縮める（PRAGMA incremental_vacuum）。
+あわせてクエリプランナーの統計を定期的に更新する（PRAGMA optimize / ANALYZE）。
+"""
+
+import asyncio
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+from ..database import db_manager
+from .conversion_scheduler import conversion_scheduler
+
+
+class MaintenanceService:
+    """アイドル時に空きページの回収と統計の更新を行うサービス"""
+
+    def __init__(self, step_pages: Optional[int] = None,
+                 idle_seconds: Optional[float] = None,
+                 optimize_interval_seconds: Optional[float] = None,
+                 analyze_interval_seconds: Optional[float] = None):
+        self.step_pages = step_pages if step_pages is not None else int(
+            os.getenv("VACUUM_STEP_PAGES", "256")
+        )
+        self.idle_seconds = idle_seconds if idle_seconds is not None else float(
+            os.getenv("MAINTENANCE_IDLE_SECONDS", "10")
+        )
+        self.optimize_interval_seconds = (
+            optimize_interval_seconds if optimize_interval_seconds is not None
+            else float(os.getenv("OPTIMIZE_INTERVAL_SECONDS", "3600"))
+        )
+        self.analyze_interval_seconds = (
+            analyze_interval_seconds if analyze_interval_seconds is not None
+            else float(os.getenv("ANALYZE_INTERVAL_SECONDS", "86400"))
+        )
+        self._lock = threading.Lock()
+        self._last_activity = time.monotonic()
+        # 起動直後は統計の更新から始める
+        self._last_optimize: Optional[float] = None
+        self._last_analyze: Optional[float] = None
+        self._status: Dict[str, Any] = {
+            "pages_reclaimed": 0,
+            "vacuum_steps": 0,
+            "last_vacuum_at": None,
+            "last_optimize_at": None,
+            "last_analyze_at": None,
+        }
+
+    def record_activity(self) -> None:
+        """リクエストを受けたことを記録（アイドル判定に使う）"""
+        self._last_activity = time.monotonic()
+
+    def is_idle(self) -> bool:
+        """一定時間リクエストがなく、このプロセスで変換も行っていないか"""
+        if time.monotonic() - self._last_activity < self.idle_seconds:
+            return False
+        queue = conversion_scheduler.get_status()
+        return not (queue["running"] or queue["queued"])
+
+    @staticmethod
+    def _now() -> str:
+        return datetime.now(timezone.utc).isoformat()
+
+    def _due(self, last: Optional[float], interval: float) -> bool:
+        return last is None or time.monotonic() - last >= interval
+
+    def run_step(self) -> Dict[str, Any]:
+        """空きページを1ステップ分返し、時期が来ていれば統計を更新"""
+        with self._lock:
+            result = {"pages_reclaimed": 0, "optimized": False, "analyzed": False}
+
+            storage = db_manager.get_storage_status()
+            if storage.get("auto_vacuum") == "incremental" and storage.get("freelist_count"):
+                reclaimed = db_manager.incremental_vacuum(self.step_pages)
+                result["pages_reclaimed"] = reclaimed
+                self._status["pages_reclaimed"] += reclaimed
+                self._status["vacuum_steps"] += 1
+                self._status["last_vacuum_at"] = self._now()
+
+            if self._due(self._last_optimize, self.optimize_interval_seconds):
+                analyze = self._due(self._last_analyze, self.analyze_interval_seconds)
+                if db_manager.optimize(analyze=analyze):
+                    self._last_optimize = time.monotonic()
+                    self._status["last_optimize_at"] = self._now()
+                    result["optimized"] = True
+                    if analyze:
+                        self._last_analyze = self._last_optimize
+                        self._status["last_analyze_at"] = self._status["last_optimize_at"]
+                        result["analyzed"] = True
+
+            return result
+
+    def get_status(self) -> Dict[str, Any]:
+        """DBの断片化の状況とメンテナンスの実施状況"""
+        return {
+            "storage": db_manager.get_storage_status(),
+            "idle": self.is_idle(),
+            **self._status
+        }
+
+    async def run_periodic(self, interval_seconds: Optional[float] = None) -> None:
+        """アイドル時にメンテナンスを繰り返す（アプリ起動中のバックグラウンドタスク）"""
+        if interval_seconds is None:
+            interval_seconds = float(os.getenv("MAINTENANCE_INTERVAL_SECONDS", "5"))
+
+        while True:
+            await asyncio.sleep(interval_seconds)
+            if not self.is_idle():
+                continue
+            try:
+                result = await asyncio.to_thread(self.run_step)
+                if result["pages_reclaimed"] or result["analyzed"]:
+                    print(f"Database maintenance: {result}")
+            except Exception as e:
+                print(f"Error in database maintenance: {e}")
+
+
+# グローバルインスタンス
+maintenance_service = MaintenanceService()
@@ -4,30 +4,63 @@ PDF変換サービス
 PDFファイルをMarkdown形式に変換する処理を担当
 """
 
+import asyncio
+import hashlib
 import os
+import tempfile
+import threading
 import time
 import uuid
+from contextlib import ExitStack, contextmanager
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Callable, Iterable, Iterator, List
 import pypdf
 import pdfplumber
 import markitdown
 from datetime import datetime
 
-from ..database import db_manager
+from ..database import data_dir, db_manager
 from ..models import FileStatus
+from .response_cache import file_response_cache
+from .blob_store import blob_store
+from .conversion_scheduler import (
+    conversion_scheduler, estimate_job_cost, compute_sort_key, JobEstimate,
+    ConversionCancelled
+)
+
+
+# ファイルごとのロックに使うストライプ数
+FILE_LOCK_STRIPES = 64
+
+
+@dataclass
+class _ConversionHandle:
+    """このプロセス内で実行中の変換"""
+    cancel_event: threading.Event = field(default_factory=threading.Event)
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel_event.is_set()
 
 
 class PDFService:
     """PDF変換サービス"""
     
-    def __init__(self, upload_dir: str = "data/uploads", 
-                 markdown_dir: str = "data/markdown"):
-        self.upload_dir = Path(upload_dir)
-        self.markdown_dir = Path(markdown_dir)
+    def __init__(self, upload_dir: Optional[str] = None, 
+                 markdown_dir: Optional[str] = None,
+                 conversion_mode: Optional[str] = None):
+        self.upload_dir = Path(upload_dir) if upload_dir else data_dir() / "uploads"
+        self.markdown_dir = Path(markdown_dir) if markdown_dir else data_dir() / "markdown"
+        # inline: APIプロセス内で変換 / queue: ジョブキュー経由で変換ワーカーが変換
+        self.conversion_mode: str = conversion_mode or os.getenv("CONVERSION_MODE") or "inline"
+        # このプロセス内で変換中のファイルID → 変換ハンドル
+        self._active_conversions: Dict[str, _ConversionHandle] = {}
+        # 状態遷移を直列化するファイルごとのロック（ハッシュでストライプ化）
+        self._file_locks = [threading.RLock() for _ in range(FILE_LOCK_STRIPES)]
         self._ensure_directories()
     
-    def _ensure_directories(self):
+    def _ensure_directories(self) -> None:
         """必要なディレクトリの存在確認・作成"""
         self.upload_dir.mkdir(parents=True, exist_ok=True)
         self.markdown_dir.mkdir(parents=True, exist_ok=True)
@@ -50,18 +83,49 @@ class PDFService:
         except Exception as e:
             return False, "無効なPDFファイルです"
     
-    def _save_uploaded_file(self, file_content: bytes, filename: str) -> str:
-        """アップロードされたファイルを保存"""
-        file_id = str(uuid.uuid4())
-        file_path = self.upload_dir / f"{file_id}_{filename}"
-        
-        with open(file_path, "wb") as f:
-            f.write(file_content)
-        
-        return str(file_path)
+    def _register_upload(self, file_id: str, file_content: bytes, filename: str,
+                         metadata: Dict[str, Any]) -> str:
+        """アップロードされたPDFをブロブストアに保存してファイルを登録
+
+        同じ内容のPDFは保存済みのブロブを参照する。保存先のパスを返す
+        """
+        with blob_store.lock():
+            digest = blob_store.put(file_content)
+            file_path = str(blob_store.path_for(digest))
+            if not db_manager.insert_file(file_id, filename, file_path, len(file_content),
+                                          metadata, blob_digest=digest):
+                raise Exception("データベースへの登録に失敗しました")
+        return file_path
     
-    def _convert_pdf_to_markdown(self, file_path: str) -> str:
-        """PDFをMarkdownに変換"""
+    def _replace_source(self, file_id: str, file_content: bytes, filename: str,
+                        estimate: JobEstimate, priority: Optional[int]) -> str:
+        """再変換する新しいPDFを保存して処理中に遷移（保存先のパスを返す）"""
+        with self.file_lock(file_id):
+            with blob_store.lock():
+                digest = blob_store.put(file_content)
+                file_path = str(blob_store.path_for(digest))
+                if not db_manager.update_file_source(file_id, filename, file_path, len(file_content),
+                                                     blob_digest=digest):
+                    raise Exception("データベースの更新に失敗しました")
+            db_manager.update_file_status(file_id, FileStatus.PROCESSING)
+            file_response_cache.invalidate(file_id)
+            
+            if self.conversion_mode == "queue":
+                db_manager.cancel_conversion_jobs(file_id)
+                self._enqueue_conversion(file_id, "reconvert", estimate, priority)
+        return file_path
+    
+    def _check_cancelled(self, cancel_event: Optional[threading.Event]) -> None:
+        """キャンセルされていれば変換を中断"""
+        if cancel_event is not None and cancel_event.is_set():
+            raise ConversionCancelled()
+    
+    def _convert_pdf_to_markdown(self, file_path: str,
+                                 cancel_event: Optional[threading.Event] = None) -> str:
+        """PDFをMarkdownに変換
+
+        cancel_event がセットされると、ページの区切りで ConversionCancelled を送出する
+        """
         markdown_content = []
         
         try:
@@ -69,8 +133,11 @@ class PDFService:
                 from markitdown import MarkItDown
                 markitdown_converter = MarkItDown()
                 result = markitdown_converter.convert(file_path)
+                self._check_cancelled(cancel_event)
                 if result and result.text_content and result.text_content.strip():
                     return result.text_content
+            except ConversionCancelled:
+                raise
             except Exception as e:
                 print(f"MarkItDownでの変換に失敗: {e}")
             
@@ -78,6 +145,7 @@ class PDFService:
             try:
                 with pdfplumber.open(file_path) as pdf:
                     for page_num, page in enumerate(pdf.pages, 1):
+                        self._check_cancelled(cancel_event)
                         text = page.extract_text()
                         if text:
                             # ページ区切りを追加
@@ -98,6 +166,8 @@ class PDFService:
                                         markdown_content.append(line)
                             
                             markdown_content.append("")  # 空行を追加
+            except ConversionCancelled:
+                raise
             except Exception as e:
                 print(f"pdfplumberでの変換に失敗: {e}")
             
@@ -106,31 +176,238 @@ class PDFService:
                 try:
                     with open(file_path, 'rb') as f:
                         pdf_reader = pypdf.PdfReader(f)
-                        for page_num, page in enumerate(pdf_reader.pages, 1):
-                            text = page.extract_text()
+                        for page_num, pdf_page in enumerate(pdf_reader.pages, 1):
+                            self._check_cancelled(cancel_event)
+                            text = pdf_page.extract_text()
                             if text:
                                 if page_num > 1:
                                     markdown_content.append("\n---\n")
                                 markdown_content.append(text)
                                 markdown_content.append("")
+                except ConversionCancelled:
+                    raise
                 except Exception as e:
                     print(f"pypdfでの変換に失敗: {e}")
             
             return "\n".join(markdown_content) if markdown_content else "# PDF変換結果\n\nテキストを抽出できませんでした。"
             
+        except ConversionCancelled:
+            raise
         except Exception as e:
             return f"# PDF変換エラー\n\n変換中にエラーが発生しました: {str(e)}"
     
+    def markdown_path_for(self, file_id: str) -> Path:
+        """Markdownの保存先
+
+        1つのディレクトリにファイルが集中しないよう、ファイルIDのハッシュで
+        2階層に分散する（<markdown_dir>/<2文字>/<2文字>/<file_id>.md）
+        """
+        shard = hashlib.sha256(file_id.encode("utf-8")).hexdigest()
+        return self.markdown_dir / shard[:2] / shard[2:4] / f"{file_id}.md"
+    
     def _save_markdown(self, file_id: str, markdown_content: str) -> str:
         """Markdownをファイルに保存"""
-        markdown_path = self.markdown_dir / f"{file_id}.md"
+        markdown_path = self.markdown_path_for(file_id)
+        markdown_path.parent.mkdir(parents=True, exist_ok=True)
         
-        with open(markdown_path, "w", encoding="utf-8") as f:
-            f.write(markdown_content)
+        # 読み出し中やバックアップ中に書きかけのファイルが見えないよう、
+        # 一時ファイルに書いてから置き換える
+        fd, temp_path = tempfile.mkstemp(dir=markdown_path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(markdown_content)
+            os.replace(temp_path, markdown_path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
         
         return str(markdown_path)
     
-    async def process_pdf_upload(self, file_content: bytes, filename: str) -> Dict[str, Any]:
+    @contextmanager
+    def file_lock(self, file_id: str) -> Iterator[None]:
+        """ファイルの状態遷移を直列化するロック"""
+        lock = self._file_locks[hash(file_id) % FILE_LOCK_STRIPES]
+        with lock:
+            yield
+    
+    @contextmanager
+    def file_locks(self, file_ids: Iterable[str]) -> Iterator[None]:
+        """複数ファイルのロックをまとめて取得（デッドロックを避けるため順序を固定）"""
+        stripes = sorted({hash(file_id) % FILE_LOCK_STRIPES for file_id in file_ids})
+        with ExitStack() as stack:
+            for stripe in stripes:
+                stack.enter_context(self._file_locks[stripe])
+            yield
+    
+    def is_converting(self, file_id: str) -> bool:
+        """このプロセス内で変換中かどうか"""
+        return file_id in self._active_conversions
+    
+    def active_conversion_ids(self) -> List[str]:
+        """このプロセス内で待機中・変換中のファイルID"""
+        return list(self._active_conversions)
+    
+    def _begin_conversion(self, file_id: str) -> _ConversionHandle:
+        """変換を登録（同じファイルの実行中の変換はキャンセルする）"""
+        with self.file_lock(file_id):
+            previous = self._active_conversions.get(file_id)
+            if previous is not None:
+                previous.cancel_event.set()
+            handle = _ConversionHandle()
+            self._active_conversions[file_id] = handle
+            return handle
+    
+    def _end_conversion(self, file_id: str, handle: _ConversionHandle) -> None:
+        """変換の登録を解除"""
+        with self.file_lock(file_id):
+            if self._active_conversions.get(file_id) is handle:
+                del self._active_conversions[file_id]
+    
+    def cancel_conversion(self, file_id: str) -> bool:
+        """ファイルの実行中・待機中の変換をキャンセル"""
+        with self.file_lock(file_id):
+            handle = self._active_conversions.pop(file_id, None)
+            if handle is not None:
+                handle.cancel_event.set()
+            cancelled_jobs = db_manager.cancel_conversion_jobs(file_id)
+        return handle is not None or cancelled_jobs > 0
+    
+    def cancel_local_conversions(self, file_ids: Iterable[str]) -> int:
+        """このプロセス内の変換をまとめてキャンセル（キュー上のジョブは呼び出し側で削除する）"""
+        cancelled = 0
+        with self.file_locks(file_ids):
+            for file_id in file_ids:
+                handle = self._active_conversions.pop(file_id, None)
+                if handle is not None:
+                    handle.cancel_event.set()
+                    cancelled += 1
+        return cancelled
+    
+    async def _run_conversion(self, file_path: str, estimate: JobEstimate,
+                              priority: Optional[int], handle: _ConversionHandle) -> str:
+        """スケジューラ経由で変換を実行"""
+        markdown: str = await conversion_scheduler.run(
+            self._convert_pdf_to_markdown, file_path, handle.cancel_event,
+            estimate=estimate, priority=priority, cancel_event=handle.cancel_event
+        )
+        return markdown
+    
+    def _commit_conversion(self, file_id: str, action: str, markdown_content: str,
+                           processing_time: float, message: str,
+                           is_current: Optional[Callable[[], bool]] = None) -> None:
+        """変換結果を書き戻す（キャンセル済みなら ConversionCancelled）"""
+        with self.file_lock(file_id):
+            if is_current is not None and not is_current():
+                raise ConversionCancelled()
+            
+            markdown_path = self._save_markdown(file_id, markdown_content)
+            db_manager.update_file_status(
+                file_id,
+                FileStatus.COMPLETED,
+                markdown_content,
+                processing_time,
+                markdown_path=markdown_path
+            )
+            file_response_cache.invalidate(file_id)
+            db_manager.add_conversion_log(file_id, action, "success", message, processing_time)
+    
+    def _fail_conversion(self, file_id: str, action: str, error: str,
+                         processing_time: float,
+                         is_current: Optional[Callable[[], bool]] = None) -> None:
+        """変換失敗を記録（新しい変換に置き換えられていれば状態は変更しない）"""
+        with self.file_lock(file_id):
+            if is_current is None or is_current():
+                db_manager.update_file_status(file_id, FileStatus.FAILED)
+                file_response_cache.invalidate(file_id)
+            db_manager.add_conversion_log(file_id, action, "failed", error, processing_time)
+    
+    def _cancelled_result(self, file_id: str, action: str,
+                          processing_time: float) -> Dict[str, Any]:
+        """キャンセルされた変換の結果"""
+        db_manager.add_conversion_log(
+            file_id, action, "cancelled",
+            "Conversion superseded by a newer update or deletion",
+            processing_time
+        )
+        return {
+            "success": False,
+            "cancelled": True,
+            "error": "より新しい更新または削除により変換がキャンセルされました",
+            "file_id": file_id
+        }
+    
+    def _enqueue_conversion(self, file_id: str, action: str, estimate: JobEstimate,
+                            priority: Optional[int]) -> None:
+        """変換ジョブをキューに登録（ワーカープロセスが処理する）"""
+        sort_key = compute_sort_key(
+            estimate, time.time(), priority, conversion_scheduler.aging_rate
+        )
+        if db_manager.enqueue_conversion_job(file_id, action, sort_key) is None:
+            raise Exception("変換ジョブの登録に失敗しました")
+        
+        db_manager.add_conversion_log(file_id, action, "queued", "Conversion job queued")
+    
+    def resubmit_conversion(self, file_id: str, file_path: str, action: str,
+                            estimate: JobEstimate, priority: Optional[int] = None) -> None:
+        """保存済みのPDFの変換を再投入（応答を待たないバックグラウンド実行）"""
+        if self.conversion_mode == "queue":
+            self._enqueue_conversion(file_id, action, estimate, priority)
+            return
+        
+        handle = self._begin_conversion(file_id)
+        future = conversion_scheduler.submit(
+            self.convert_stored_file, file_id, file_path, action,
+            lambda: not handle.cancelled, handle.cancel_event,
+            estimate=estimate, priority=priority, cancel_event=handle.cancel_event
+        )
+        future.add_done_callback(lambda _: self._end_conversion(file_id, handle))
+        db_manager.add_conversion_log(file_id, action, "queued", "Conversion job queued")
+    
+    def convert_stored_file(self, file_id: str, file_path: str, action: str,
+                            is_current: Optional[Callable[[], bool]] = None,
+                            cancel_event: Optional[threading.Event] = None) -> Dict[str, Any]:
+        """保存済みのPDFを変換して結果を書き戻す（変換ワーカー用）
+
+        is_current が False を返した場合（リースを失った・新しい更新があった等）は
+        結果を書き戻さない
+        """
+        start_time = time.time()
+        
+        try:
+            markdown_content = self._convert_pdf_to_markdown(file_path, cancel_event)
+            processing_time = time.time() - start_time
+            self._commit_conversion(
+                file_id, action, markdown_content, processing_time,
+                "PDF to Markdown conversion completed by worker", is_current
+            )
+            
+            return {
+                "success": True,
+                "file_id": file_id,
+                "processing_time": processing_time,
+                "status": FileStatus.COMPLETED
+            }
+            
+        except ConversionCancelled:
+            return {
+                "success": False,
+                "error": "変換結果は破棄されました",
+                "file_id": file_id,
+                "discarded": True
+            }
+        except Exception as e:
+            processing_time = time.time() - start_time
+            self._fail_conversion(file_id, action, str(e), processing_time, is_current)
+            
+            return {
+                "success": False,
+                "error": str(e),
+                "file_id": file_id
+            }
+    
+    async def process_pdf_upload(self, file_content: bytes, filename: str,
+                                 priority: Optional[int] = None) -> Dict[str, Any]:
         """PDFアップロード処理"""
         start_time = time.time()
         
@@ -145,46 +422,55 @@ class PDFService:
         
         # ファイルID生成
         file_id = str(uuid.uuid4())
+        handle = None
         
         try:
-            # ファイル保存
-            file_path = self._save_uploaded_file(file_content, filename)
             file_size = len(file_content)
+            estimate = estimate_job_cost(file_content)
             
-            # データベースにファイル情報を登録
+            # ファイル保存・データベースにファイル情報を登録
             metadata = {
                 "original_filename": filename,
-                "upload_timestamp": datetime.now().isoformat()
+                "upload_timestamp": datetime.now().isoformat(),
+                "page_count": estimate.page_count,
+                "estimated_cost": estimate.cost,
+                "priority": priority
             }
+            # ブロブの書き込みとロック待ちがあるためスレッドで実行する
+            file_path = await asyncio.to_thread(
+                self._register_upload, file_id, file_content, filename, metadata
+            )
             
-            if not db_manager.insert_file(file_id, filename, file_path, file_size, metadata):
-                raise Exception("データベースへの登録に失敗しました")
+            # キューモードではワーカーに変換を任せてすぐに応答する
+            if self.conversion_mode == "queue":
+                self._enqueue_conversion(file_id, "upload_and_convert", estimate, priority)
+                return {
+                    "success": True,
+                    "file_id": file_id,
+                    "filename": filename,
+                    "markdown": "",
+                    "file_size": file_size,
+                    "processing_time": None,
+                    "status": FileStatus.PROCESSING
+                }
             
-            # 変換処理
+            # 変換処理（ファイルごとのロックはスレッドのロックのため、イベントループ上では取得しない）
+            handle = await asyncio.to_thread(self._begin_conversion, file_id)
             db_manager.update_file_status(file_id, FileStatus.PROCESSING)
-            markdown_content = self._convert_pdf_to_markdown(file_path)
-            
-            # Markdown保存
-            markdown_path = self._save_markdown(file_id, markdown_content)
+            markdown_content = await self._run_conversion(file_path, estimate, priority, handle)
             
             # 処理時間計算
             processing_time = time.time() - start_time
             
-            # データベース更新
-            db_manager.update_file_status(
-                file_id, 
-                FileStatus.COMPLETED, 
-                markdown_content, 
-                processing_time
-            )
-            
-            # ログ記録
-            db_manager.add_conversion_log(
-                file_id, 
-                "upload_and_convert", 
-                "success", 
+            # Markdown保存・データベース更新・ログ記録（ロック待ちと差分の計算があるためスレッドで実行）
+            await asyncio.to_thread(
+                self._commit_conversion,
+                file_id,
+                "upload_and_convert",
+                markdown_content,
+                processing_time,
                 "PDF to Markdown conversion completed",
-                processing_time
+                lambda: not handle.cancelled
             )
             
             return {
@@ -197,16 +483,20 @@ class PDFService:
                 "status": FileStatus.COMPLETED
             }
             
+        except ConversionCancelled:
+            return self._cancelled_result(
+                file_id, "upload_and_convert", time.time() - start_time
+            )
         except Exception as e:
             # エラー処理
             processing_time = time.time() - start_time
-            db_manager.update_file_status(file_id, FileStatus.FAILED)
-            db_manager.add_conversion_log(
-                file_id, 
-                "upload_and_convert", 
-                "failed", 
+            await asyncio.to_thread(
+                self._fail_conversion,
+                file_id,
+                "upload_and_convert",
                 str(e),
-                processing_time
+                processing_time,
+                (lambda: not handle.cancelled) if handle else None
             )
             
             return {
@@ -214,10 +504,16 @@ class PDFService:
                 "error": str(e),
                 "file_id": file_id
             }
+        finally:
+            if handle is not None:
+                await asyncio.to_thread(self._end_conversion, file_id, handle)
     
     async def reconvert_pdf(self, file_id: str, file_content: bytes, 
-                           filename: str) -> Dict[str, Any]:
-        """PDFの再変換処理"""
+                           filename: str, priority: Optional[int] = None) -> Dict[str, Any]:
+        """PDFの再変換処理
+
+        同じファイルの変換が実行中であれば、古い方はキャンセルされる
+        """
         start_time = time.time()
         
         # ファイル検証
@@ -229,6 +525,8 @@ class PDFService:
                 "file_id": file_id
             }
         
+        handle = None
+        
         try:
             # 既存ファイルの確認
             existing_file = db_manager.get_file(file_id)
@@ -239,35 +537,44 @@ class PDFService:
                     "file_id": file_id
                 }
             
-            # 新しいファイルを保存
-            file_path = self._save_uploaded_file(file_content, filename)
             file_size = len(file_content)
+            estimate = estimate_job_cost(file_content)
             
-            # 変換処理
-            db_manager.update_file_status(file_id, FileStatus.PROCESSING)
-            markdown_content = self._convert_pdf_to_markdown(file_path)
+            # 古い変換をキャンセルし、新しいPDFを保存して処理中に遷移
+            handle = await asyncio.to_thread(self._begin_conversion, file_id)
+            file_path = await asyncio.to_thread(
+                self._replace_source, file_id, file_content, filename, estimate, priority
+            )
             
-            # Markdown保存
-            markdown_path = self._save_markdown(file_id, markdown_content)
+            # 以前のPDFが他から参照されていなければ削除
+            await asyncio.to_thread(blob_store.collect_garbage)
+            
+            if self.conversion_mode == "queue":
+                return {
+                    "success": True,
+                    "file_id": file_id,
+                    "filename": filename,
+                    "markdown": "",
+                    "file_size": file_size,
+                    "processing_time": None,
+                    "status": FileStatus.PROCESSING
+                }
+            
+            # 変換処理
+            markdown_content = await self._run_conversion(file_path, estimate, priority, handle)
             
             # 処理時間計算
             processing_time = time.time() - start_time
             
-            # データベース更新
-            db_manager.update_file_status(
-                file_id, 
-                FileStatus.COMPLETED, 
-                markdown_content, 
-                processing_time
-            )
-            
-            # ログ記録
-            db_manager.add_conversion_log(
-                file_id, 
-                "reconvert", 
-                "success", 
+            # Markdown保存・データベース更新・ログ記録（ロック待ちと差分の計算があるためスレッドで実行）
+            await asyncio.to_thread(
+                self._commit_conversion,
+                file_id,
+                "reconvert",
+                markdown_content,
+                processing_time,
                 "PDF reconversion completed",
-                processing_time
+                lambda: not handle.cancelled
             )
             
             return {
@@ -280,16 +587,18 @@ class PDFService:
                 "status": FileStatus.COMPLETED
             }
             
+        except ConversionCancelled:
+            return self._cancelled_result(file_id, "reconvert", time.time() - start_time)
         except Exception as e:
             # エラー処理
             processing_time = time.time() - start_time
-            db_manager.update_file_status(file_id, FileStatus.FAILED)
-            db_manager.add_conversion_log(
-                file_id, 
-                "reconvert", 
-                "failed", 
+            await asyncio.to_thread(
+                self._fail_conversion,
+                file_id,
+                "reconvert",
                 str(e),
-                processing_time
+                processing_time,
+                (lambda: not handle.cancelled) if handle else None
             )
             
             return {
@@ -297,3 +606,6 @@ class PDFService:
                 "error": str(e),
                 "file_id": file_id
             }
+        finally:
+            if handle is not None:
+                await asyncio.to_thread(self._end_conversion, file_id, handle)
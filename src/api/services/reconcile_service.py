@@ -0,0 +1,154 @@
+"""
+ディスク整合性チェックサービス
+
+data/uploads・data/markdown・ブロブストアのファイルを files テーブルと突き合わせ、
+どの行からも参照されていない孤立ファイルを報告または削除する。
+ディレクトリは1件ずつ走査し、参照中のパスだけをメモリ上の集合に持つ。
+"""
+
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Set
+
+from ..database import db_manager
+from .blob_store import blob_store
+from .pdf_service import PDFService
+
+
+# 報告に含める孤立ファイルの最大数
+REPORT_SAMPLE_SIZE = 100
+
+
+class _RateLimiter:
+    """1秒あたりの操作回数を制限する（0 以下なら無制限）"""
+
+    def __init__(self, per_second: float):
+        self.interval = 1.0 / per_second if per_second > 0 else 0.0
+        self._next_at = time.monotonic()
+
+    def wait(self) -> None:
+        if not self.interval:
+            return
+        now = time.monotonic()
+        if self._next_at > now:
+            time.sleep(self._next_at - now)
+        self._next_at = max(now, self._next_at) + self.interval
+
+
+class ReconcileService:
+    """参照されていないディスク上のファイルを検出・削除するサービス"""
+
+    def __init__(self, pdf_service: PDFService, delete: bool = False,
+                 min_age_seconds: float = 3600.0,
+                 max_deletes_per_second: float = 50.0,
+                 max_scans_per_second: float = 0.0):
+        self.pdf_service = pdf_service
+        self.delete = delete
+        # 書き込み直後でまだ DB に登録されていないファイルを消さないための猶予
+        self.min_age_seconds = min_age_seconds
+        self.max_deletes_per_second = max_deletes_per_second
+        self.max_scans_per_second = max_scans_per_second
+
+    def _roots(self) -> List[Path]:
+        """走査するディレクトリ（他の走査対象の中にあるものは除く）"""
+        roots: List[Path] = []
+        candidates = [self.pdf_service.upload_dir, self.pdf_service.markdown_dir, blob_store.root]
+        for root in sorted({Path(os.path.abspath(path)) for path in candidates}):
+            if not any(root == parent or parent in root.parents for parent in roots):
+                roots.append(root)
+        return roots
+
+    def _known_paths(self) -> Set[str]:
+        """files テーブルから参照されているパスの集合"""
+        known: Set[str] = set()
+        for row in db_manager.iter_files(columns=["id", "original_path", "markdown_path"]):
+            for path in (row["original_path"], row["markdown_path"]):
+                if path:
+                    known.add(os.path.abspath(path))
+            # 変換中のファイルは markdown_path の記録前に保存先へ書き込まれる
+            known.add(os.path.abspath(self.pdf_service.markdown_path_for(row["id"])))
+        return known
+
+    @staticmethod
+    def _scan(root: Path) -> Iterator[os.DirEntry]:
+        """ディレクトリ以下の通常ファイルを1件ずつ返す"""
+        stack = [str(root)]
+        while stack:
+            try:
+                with os.scandir(stack.pop()) as entries:
+                    for entry in entries:
+                        # ロックファイルなどの管理用ファイルは対象外
+                        if entry.name.startswith("."):
+                            continue
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif entry.is_file(follow_symlinks=False):
+                            yield entry
+            except FileNotFoundError:
+                continue
+
+    def _remove_orphan(self, path: str) -> bool:
+        """孤立ファイルを削除（ブロブは削除直前に参照を確認する）"""
+        blob_root = os.path.abspath(blob_store.root)
+        if os.path.commonpath([path, blob_root]) == blob_root:
+            digest = Path(path).name.split(".")[0]
+            with blob_store.lock():
+                # 走査の後に同じ内容がアップロードされていれば残す
+                if db_manager.is_blob_referenced(digest):
+                    return False
+                os.remove(path)
+                return True
+
+        os.remove(path)
+        return True
+
+    def reconcile(self) -> Dict[str, Any]:
+        """孤立ファイルを検出し、delete=True なら削除する"""
+        known = self._known_paths()
+        cutoff = time.time() - self.min_age_seconds
+        scan_limiter = _RateLimiter(self.max_scans_per_second)
+        delete_limiter = _RateLimiter(self.max_deletes_per_second)
+
+        result: Dict[str, Any] = {
+            "scanned": 0,
+            "orphans": 0,
+            "orphan_bytes": 0,
+            "deleted": 0,
+            "errors": 0,
+            "samples": []
+        }
+
+        for root in self._roots():
+            for entry in self._scan(root):
+                scan_limiter.wait()
+                result["scanned"] += 1
+                path = os.path.abspath(entry.path)
+                if path in known:
+                    continue
+
+                try:
+                    stat = entry.stat(follow_symlinks=False)
+                except FileNotFoundError:
+                    continue
+                if stat.st_mtime > cutoff:
+                    continue
+
+                result["orphans"] += 1
+                result["orphan_bytes"] += stat.st_size
+                if len(result["samples"]) < REPORT_SAMPLE_SIZE:
+                    result["samples"].append(path)
+
+                if not self.delete:
+                    continue
+                delete_limiter.wait()
+                try:
+                    if self._remove_orphan(path):
+                        result["deleted"] += 1
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    print(f"Error removing orphan {path}: {e}")
+                    result["errors"] += 1
+
+        return result
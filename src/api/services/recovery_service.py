@@ -0,0 +1,119 @@
+"""
+変換復旧サービス
+
+プロセス停止などで PROCESSING のまま残ったファイルを検出し、
+保存済みのPDF（original_path）から変換をやり直す
+"""
+
+import asyncio
+import os
+from typing import Any, Dict, Optional
+
+from ..database import db_manager
+from ..models import FileStatus
+from .conversion_scheduler import estimate_job_cost
+from .pdf_service import PDFService
+
+
+class RecoveryService:
+    """PROCESSING のまま停止したファイルの復旧サービス"""
+
+    def __init__(self, pdf_service: PDFService,
+                 stale_seconds: Optional[float] = None,
+                 max_attempts: Optional[int] = None):
+        self.pdf_service = pdf_service
+        self.stale_seconds = stale_seconds if stale_seconds is not None else float(
+            os.getenv("RECOVERY_STALE_SECONDS", "900")
+        )
+        self.max_attempts = max_attempts if max_attempts is not None else int(
+            os.getenv("RECOVERY_MAX_ATTEMPTS", "3")
+        )
+
+    def _give_up(self, file_info: Dict[str, Any], reason: str) -> None:
+        """復旧を諦めてファイルを失敗状態にする"""
+        db_manager.update_file_status(file_info["id"], FileStatus.FAILED)
+        db_manager.add_conversion_log(file_info["id"], "recover", "failed", reason)
+
+    def _requeue(self, file_info: Dict[str, Any]) -> None:
+        """保存済みのPDFから変換をやり直す"""
+        with open(file_info["original_path"], "rb") as f:
+            estimate = estimate_job_cost(f.read())
+
+        self.pdf_service.resubmit_conversion(
+            file_info["id"], file_info["original_path"], "recover", estimate
+        )
+        print(
+            f"Recovered stale conversion {file_info['id']} "
+            f"(attempt {file_info['conversion_attempts'] + 1})"
+        )
+
+    def recover_stale_files(self, limit: int = 100) -> Dict[str, Any]:
+        """放置された PROCESSING ファイルを再投入または失敗にする"""
+        requeued = 0
+        failed = 0
+
+        stale_files = db_manager.find_stale_processing_files(self.stale_seconds, limit)
+        for file_info in stale_files:
+            # このプロセス内で変換中のものは放置されていない
+            if self.pdf_service.is_converting(file_info["id"]):
+                continue
+
+            if file_info["conversion_attempts"] >= self.max_attempts:
+                self._give_up(
+                    file_info,
+                    f"Conversion abandoned after {file_info['conversion_attempts']} recovery attempts"
+                )
+                failed += 1
+                continue
+
+            if not os.path.exists(file_info["original_path"]):
+                self._give_up(file_info, "Original PDF not found for recovery")
+                failed += 1
+                continue
+
+            # 他のプロセスが同じ行を先に復旧していた・変換を続けていたらスキップ
+            if not db_manager.mark_recovery_attempt(
+                file_info["id"], file_info["updated_at"], file_info["heartbeat_at"]
+            ):
+                continue
+
+            try:
+                self._requeue(file_info)
+                requeued += 1
+            except Exception as e:
+                self._give_up(file_info, f"Recovery failed: {e}")
+                failed += 1
+
+        return {
+            "stale_files": len(stale_files),
+            "requeued": requeued,
+            "failed": failed
+        }
+
+    def heartbeat(self) -> int:
+        """このプロセスで待機中・変換中のファイルを放置扱いされないよう更新
+
+        インライン変換は conversion_jobs に載らないため、他のAPIプロセスの
+        復旧処理からは heartbeat_at で生存を判定する
+        """
+        return db_manager.touch_conversions(self.pdf_service.active_conversion_ids())
+
+    async def run_periodic(self, interval_seconds: Optional[float] = None) -> None:
+        """定期的にハートビートと復旧処理を実行（アプリ起動中のバックグラウンドタスク）"""
+        if interval_seconds is None:
+            interval_seconds = float(os.getenv("RECOVERY_INTERVAL_SECONDS", "60"))
+        # 放置と判定されるまでに複数回ハートビートを送る
+        interval_seconds = min(interval_seconds, self.stale_seconds / 3)
+
+        while True:
+            await asyncio.sleep(interval_seconds)
+            try:
+                await asyncio.to_thread(self.heartbeat)
+            except Exception as e:
+                print(f"Error in conversion heartbeat: {e}")
+            try:
+                result = await asyncio.to_thread(self.recover_stale_files)
+                if result["stale_files"]:
+                    print(f"Recovery sweep: {result}")
+            except Exception as e:
+                print(f"Error in recovery sweep: {e}")
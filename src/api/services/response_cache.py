@@ -0,0 +1,183 @@
+"""
+レスポンスキャッシュ
+
+GET /files/{file_id} のシリアライズ済みレスポンスを保持する
+バイト数上限付きのLRUキャッシュ
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional
+
+
+# 無効化した世代を覚えておくファイル数（超えた分は、それより前の世代の put をすべて断る）
+INVALIDATION_HISTORY = 4096
+
+
+@dataclass
+class CachedResponse:
+    """キャッシュされたレスポンス"""
+    updated_at: str
+    body: bytes
+    etag: Optional[str]
+    stored_at: float
+    # Content-Encoding ごとの圧縮済み本文
+    encoded: Dict[str, bytes] = field(default_factory=dict)
+
+    @property
+    def size(self) -> int:
+        return len(self.body) + sum(len(data) for data in self.encoded.values())
+
+
+class ResponseCache:
+    """ファイルIDをキーにしたシリアライズ済みレスポンスのLRUキャッシュ
+
+    上限はエントリ数ではなく保持するバイト数で管理する。
+    """
+
+    def __init__(self, max_bytes: Optional[int] = None,
+                 ttl_seconds: Optional[float] = None):
+        if max_bytes is None:
+            max_bytes = int(os.getenv("FILE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+        if ttl_seconds is None:
+            # 他のAPIプロセスでの更新は無効化が届かないため、一定時間で読み直す
+            ttl_seconds = float(os.getenv("FILE_CACHE_TTL_SECONDS", "60"))
+
+        self.max_bytes = max(0, max_bytes)
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, CachedResponse]" = OrderedDict()
+        self._size = 0
+        # 無効化のたびに増える世代番号と、ファイルごとの最後に無効化した世代
+        self._generation = 0
+        self._invalidated: "OrderedDict[str, int]" = OrderedDict()
+        # この世代より前に読み込んだ内容は、どのファイルでも保存しない（clear・記録の追い出し）
+        self._floor = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def generation(self) -> int:
+        """現在の世代番号（読み込み前に取得して put に渡す）
+
+        put ではそのファイル自身がこの世代より後に無効化されたかだけを見るため、
+        他のファイルの更新が続いてもキャッシュできる
+        """
+        with self._lock:
+            return self._generation
+
+    def _is_stale(self, file_id: str, generation: int) -> bool:
+        """generation の時点より後に、このファイルが無効化されたか"""
+        return generation < self._floor or self._invalidated.get(file_id, 0) > generation
+
+    def get(self, file_id: str) -> Optional[CachedResponse]:
+        """キャッシュ済みレスポンスを取得"""
+        with self._lock:
+            entry = self._entries.get(file_id)
+            if entry is not None and time.monotonic() - entry.stored_at > self.ttl_seconds:
+                self._remove(file_id)
+                entry = None
+
+            if entry is None:
+                self._misses += 1
+                return None
+
+            self._entries.move_to_end(file_id)
+            self._hits += 1
+            return entry
+
+    def put(self, file_id: str, updated_at: str, body: bytes,
+            generation: Optional[int] = None, etag: Optional[str] = None) -> bool:
+        """レスポンスをキャッシュに追加
+
+        generation が読み込み後に無効化された世代なら、古い内容なので保存しない
+        """
+        size = len(body)
+        if size > self.max_bytes:
+            return False
+
+        with self._lock:
+            if generation is not None and self._is_stale(file_id, generation):
+                return False
+
+            current = self._entries.get(file_id)
+            if current is not None:
+                if current.updated_at > updated_at:
+                    return False
+                self._remove(file_id)
+
+            self._entries[file_id] = CachedResponse(updated_at, body, etag, time.monotonic())
+            self._size += size
+
+            # 上限を超えた分を古い順に追い出す
+            while self._size > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+            return True
+
+    def get_encoded(self, file_id: str, etag: Optional[str], encoding: str) -> Optional[bytes]:
+        """圧縮済みの本文を取得（キャッシュ済みの内容と同じETagの場合のみ）"""
+        with self._lock:
+            entry = self._entries.get(file_id)
+            if entry is None or entry.etag != etag:
+                return None
+            return entry.encoded.get(encoding)
+
+    def put_encoded(self, file_id: str, etag: Optional[str], encoding: str,
+                    data: bytes) -> bool:
+        """圧縮済みの本文をキャッシュ済みのレスポンスに追加"""
+        with self._lock:
+            entry = self._entries.get(file_id)
+            if entry is None or entry.etag != etag or encoding in entry.encoded:
+                return False
+            if entry.size + len(data) > self.max_bytes:
+                return False
+
+            entry.encoded[encoding] = data
+            self._size += len(data)
+            while self._size > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+            return True
+
+    def invalidate(self, file_id: str) -> None:
+        """指定ファイルのキャッシュを破棄"""
+        with self._lock:
+            self._generation += 1
+            self._invalidated[file_id] = self._generation
+            self._invalidated.move_to_end(file_id)
+            while len(self._invalidated) > INVALIDATION_HISTORY:
+                _, evicted = self._invalidated.popitem(last=False)
+                self._floor = evicted
+            self._remove(file_id)
+
+    def clear(self) -> None:
+        """すべてのキャッシュを破棄"""
+        with self._lock:
+            self._generation += 1
+            self._floor = self._generation
+            self._invalidated.clear()
+            self._entries.clear()
+            self._size = 0
+
+    def _remove(self, file_id: str) -> None:
+        entry = self._entries.pop(file_id, None)
+        if entry is not None:
+            self._size -= entry.size
+
+    def get_status(self) -> Dict[str, Any]:
+        """キャッシュの状態を取得"""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "size_bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "hits": self._hits,
+                "misses": self._misses
+            }
+
+
+# グローバルインスタンス
+file_response_cache = ResponseCache()
@@ -0,0 +1,79 @@
+"""
+全文検索サービス
+
+FTS5（trigram）インデックスを使ってMarkdown本文を検索する。
+結果は関連度順で、カーソルによるページングに対応する。
+"""
+
+import base64
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+from ..database import db_manager
+
+
+# trigram インデックスで引ける最小の文字数
+MIN_TERM_LENGTH = 3
+
+
+class SearchService:
+    """Markdown本文の全文検索サービス"""
+
+    def parse_query(self, query: str) -> Tuple[str, List[str]]:
+        """検索語を FTS5 の MATCH 式と、短い語のリストに分ける
+
+        語はすべてフレーズとして扱い、FTS5 の演算子は解釈しない
+        """
+        terms = [term for term in query.split() if term]
+        long_terms = [term for term in terms if len(term) >= MIN_TERM_LENGTH]
+        short_terms = [term for term in terms if len(term) < MIN_TERM_LENGTH]
+        if not long_terms:
+            raise ValueError(f"検索語には{MIN_TERM_LENGTH}文字以上の語を含めてください")
+
+        match_query = " AND ".join('"' + term.replace('"', '""') + '"' for term in long_terms)
+        return match_query, short_terms
+
+    @staticmethod
+    def encode_cursor(score: float, doc_id: int) -> str:
+        """次ページのカーソルを作成"""
+        payload = json.dumps([score, doc_id]).encode("utf-8")
+        return base64.urlsafe_b64encode(payload).decode("ascii")
+
+    @staticmethod
+    def decode_cursor(cursor: str) -> Tuple[float, int]:
+        """カーソルを復元（不正な場合は ValueError）"""
+        try:
+            score, doc_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+            return float(score), int(doc_id)
+        except Exception:
+            raise ValueError("無効なカーソルです")
+
+    def search(self, query: str, limit: int = 20,
+               cursor: Optional[str] = None) -> Dict[str, Any]:
+        """全文検索を実行"""
+        match_query, short_terms = self.parse_query(query)
+        after = self.decode_cursor(cursor) if cursor else None
+
+        # 1件多く取得して次のページがあるか判定する
+        rows = db_manager.search_files(match_query, short_terms, limit + 1, after)
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+        results = [
+            {
+                "id": row["id"],
+                "filename": row["filename"],
+                "status": row["status"],
+                "updated_at": row["updated_at"],
+                "snippet": row["snippet"],
+                # bm25 は小さいほど関連度が高いので符号を反転
+                "score": round(-row["score"], 6)
+            }
+            for row in rows
+        ]
+        next_cursor = None
+        if has_more:
+            last = rows[-1]
+            next_cursor = self.encode_cursor(last["score"], last["doc_id"])
+
+        return {"results": results, "next_cursor": next_cursor}
@@ -0,0 +1,379 @@
+"""
+変換ワーカー
+
+ジョブキュー（conversion_jobs テーブル）から変換ジョブをリースして処理する
+スタンドアロンのワーカープロセス。共有ストレージと同じDBを参照していれば、
+別マシン・別コンテナで複数台起動してHTTP層とは独立にスケールできる。
+
+使い方:
+    python -m src.api.worker --lease-seconds 60 --poll-interval 1.0
+    python -m src.api.worker --processes 4 --max-jobs 200 --max-rss-mb 1024
+
+--max-jobs / --max-rss-mb を指定すると、処理件数またはメモリ使用量（RSS）が
+閾値を超えたワーカーを入れ替える。--processes を指定した場合は
+スーパーバイザーが後継プロセスを先に起動し、準備ができてから古いプロセスを停止する。
+"""
+
+import argparse
+import multiprocessing
+import os
+import queue
+import signal
+import socket
+import sys
+import threading
+import time
+import uuid
+from types import ModuleType
+from typing import Any, Callable, Dict, List, Optional
+
+from . import markdown_codec
+from .database import check_ephemeral_mode, db_manager
+from .models import FileStatus
+from .services.pdf_service import PDFService
+
+# resource は Unix にしかない（Windows では RSS を取得しない）
+resource: Optional[ModuleType]
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def get_rss_bytes() -> Optional[int]:
+    """現在のプロセスの常駐メモリ（RSS）をバイト単位で取得"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    
+    # /proc がない環境では最大RSSで代用（macOSはバイト、Linuxはキロバイト）
+    if resource is None:
+        return None
+    try:
+        max_rss: int = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return max_rss if sys.platform == "darwin" else max_rss * 1024
+    except Exception:
+        return None
+
+
+class LeaseHeartbeat:
+    """変換中のジョブのリースを定期的に延長するハートビート"""
+
+    def __init__(self, job_id: int, worker_id: str, lease_seconds: float):
+        self.job_id = job_id
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self.lost = False
+        # リースを失ったら変換を中断させるためのイベント
+        self.cancel_event = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self) -> None:
+        """リース期間の1/3ごとに期限を延長"""
+        interval = max(self.lease_seconds / 3, 0.1)
+        while not self._stop_event.wait(interval):
+            if not db_manager.heartbeat_conversion_job(
+                self.job_id, self.worker_id, self.lease_seconds
+            ):
+                # 期限切れで他のワーカーに回収された、またはキャンセルされた
+                self.lost = True
+                self.cancel_event.set()
+                return
+
+    def is_current(self) -> bool:
+        """まだこのワーカーがリースを保持しているか"""
+        if self.lost:
+            return False
+        return db_manager.heartbeat_conversion_job(
+            self.job_id, self.worker_id, self.lease_seconds
+        )
+
+    def __enter__(self) -> "LeaseHeartbeat":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self._stop_event.set()
+        self._thread.join()
+
+
+class ConversionWorker:
+    """ジョブキューから変換ジョブを取り出して処理するワーカー"""
+
+    # 待機中に稼働状況を記録する間隔（秒）
+    STATUS_REPORT_INTERVAL = 5.0
+
+    def __init__(self, worker_id: Optional[str] = None, lease_seconds: float = 60.0,
+                 poll_interval: float = 1.0, max_attempts: int = 3,
+                 pdf_service: Optional[PDFService] = None,
+                 max_jobs: Optional[int] = None, max_rss_mb: Optional[float] = None,
+                 on_retire: Optional[Callable[[], None]] = None,
+                 stop_event: Optional[Any] = None):
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.pdf_service = pdf_service or PDFService()
+        self.max_jobs = max_jobs
+        self.max_rss_bytes = int(max_rss_mb * 1024 * 1024) if max_rss_mb else None
+        # 入れ替えが必要になったときの通知先（スーパーバイザー配下のとき）
+        self.on_retire = on_retire
+        self.jobs_done = 0
+        self.retiring = False
+        self._stop_event = stop_event or threading.Event()
+        self._last_report = 0.0
+
+    def report_status(self, state: Optional[str] = None) -> None:
+        """稼働状況とメモリ使用量を記録"""
+        if state is None:
+            state = "retiring" if self.retiring else "running"
+        db_manager.report_worker_status(
+            self.worker_id, socket.gethostname(), os.getpid(),
+            state, self.jobs_done, get_rss_bytes()
+        )
+        self._last_report = time.monotonic()
+
+    def recycle_reason(self) -> Optional[str]:
+        """入れ替えが必要であればその理由を返す"""
+        if self.max_jobs and self.jobs_done >= self.max_jobs:
+            return f"processed {self.jobs_done} jobs"
+        
+        if self.max_rss_bytes:
+            rss_bytes = get_rss_bytes()
+            if rss_bytes is not None and rss_bytes >= self.max_rss_bytes:
+                return f"RSS {rss_bytes // (1024 * 1024)}MB"
+        
+        return None
+
+    def _check_recycle(self) -> None:
+        """閾値を超えていれば入れ替えを開始"""
+        if self.retiring:
+            return
+        
+        reason = self.recycle_reason()
+        if not reason:
+            return
+        
+        print(f"[{self.worker_id}] recycling: {reason}")
+        self.retiring = True
+        self.report_status()
+        if self.on_retire is not None:
+            # 後継の準備ができるまではジョブの処理を続ける
+            self.on_retire()
+        else:
+            self.stop()
+
+    def process_job(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        """リースしたジョブを1件処理"""
+        # 何度もワーカーを落とすジョブは諦めて失敗にする
+        if job["attempts"] > self.max_attempts:
+            db_manager.update_file_status(job["file_id"], FileStatus.FAILED)
+            db_manager.add_conversion_log(
+                job["file_id"], job["action"], "failed",
+                f"Conversion abandoned after {job['attempts'] - 1} attempts"
+            )
+            db_manager.finish_conversion_job(job["id"], self.worker_id, "failed")
+            return {"success": False, "error": "max attempts exceeded", "file_id": job["file_id"]}
+
+        with LeaseHeartbeat(job["id"], self.worker_id, self.lease_seconds) as heartbeat:
+            result = self.pdf_service.convert_stored_file(
+                job["file_id"],
+                job["original_path"],
+                job["action"],
+                is_current=heartbeat.is_current,
+                cancel_event=heartbeat.cancel_event
+            )
+
+        if not result.get("discarded"):
+            db_manager.finish_conversion_job(
+                job["id"], self.worker_id, "done" if result["success"] else "failed"
+            )
+        return result
+
+    def run_once(self) -> bool:
+        """ジョブを1件処理（キューが空ならFalse）"""
+        job = db_manager.claim_conversion_job(self.worker_id, self.lease_seconds)
+        if not job:
+            return False
+
+        result = self.process_job(job)
+        self.jobs_done += 1
+        status = "success" if result["success"] else f"failed: {result.get('error')}"
+        print(f"[{self.worker_id}] job {job['id']} ({job['file_id']}) {status}")
+        
+        self.report_status()
+        self._check_recycle()
+        return True
+
+    def run(self) -> None:
+        """停止要求があるまでジョブを処理し続ける"""
+        print(f"[{self.worker_id}] conversion worker started")
+        self.report_status()
+        while not self._stop_event.is_set():
+            if not self.run_once():
+                if time.monotonic() - self._last_report >= self.STATUS_REPORT_INTERVAL:
+                    self.report_status()
+                self._stop_event.wait(self.poll_interval)
+        self.report_status("stopped")
+        print(f"[{self.worker_id}] conversion worker stopped")
+
+    def stop(self) -> None:
+        """処理中のジョブが終わったら停止する"""
+        self._stop_event.set()
+
+
+def _run_child(worker_id: str, options: Dict[str, Any], messages: Any, stop_event: Any) -> None:
+    """スーパーバイザー配下のワーカープロセスのエントリーポイント"""
+    # 停止はスーパーバイザーが stop_event で指示する
+    # （待機中の multiprocessing.Event をシグナルハンドラから set するとデッドロックする）
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    
+    worker = ConversionWorker(
+        worker_id=worker_id,
+        pdf_service=PDFService(markdown_dir=options.pop("markdown_dir")),
+        on_retire=lambda: messages.put(("retiring", worker_id)),
+        stop_event=stop_event,
+        **options
+    )
+    messages.put(("ready", worker_id))
+    worker.run()
+
+
+class WorkerSupervisor:
+    """ワーカープロセス群を管理し、閾値を超えたプロセスを入れ替える"""
+
+    def __init__(self, processes: int, options: Dict[str, Any]):
+        self.processes = processes
+        self.options = options
+        self._context = multiprocessing.get_context("spawn")
+        self._messages = self._context.Queue()
+        # worker_id -> {"process", "stop_event", "replaces", "retired"}
+        self._children: Dict[str, Dict[str, Any]] = {}
+        self._stopping = False
+
+    def _spawn(self, replaces: Optional[str] = None) -> str:
+        """ワーカープロセスを起動"""
+        worker_id = f"{socket.gethostname()}-{uuid.uuid4().hex[:8]}"
+        stop_event = self._context.Event()
+        process = self._context.Process(
+            target=_run_child,
+            args=(worker_id, dict(self.options), self._messages, stop_event),
+            name=f"conversion-worker-{worker_id}"
+        )
+        process.start()
+        self._children[worker_id] = {
+            "process": process,
+            "stop_event": stop_event,
+            "replaces": replaces,
+            "retired": False
+        }
+        return worker_id
+
+    def _handle_message(self, kind: str, worker_id: str) -> None:
+        """ワーカーからの通知を処理"""
+        child = self._children.get(worker_id)
+        if child is None:
+            return
+        
+        if kind == "retiring" and not child["retired"]:
+            # 先に後継を起動し、古いプロセスは後継の準備ができるまで処理を続ける
+            child["retired"] = True
+            self._spawn(replaces=worker_id)
+        elif kind == "ready" and child["replaces"]:
+            old = self._children.get(child["replaces"])
+            if old is not None:
+                old["stop_event"].set()
+
+    def _reap(self) -> None:
+        """終了したプロセスを回収し、異常終了したものは再起動"""
+        for worker_id, child in list(self._children.items()):
+            if child["process"].is_alive():
+                continue
+            
+            child["process"].join()
+            del self._children[worker_id]
+            if not child["retired"] and not self._stopping:
+                print(f"worker {worker_id} exited unexpectedly "
+                      f"(exit code {child['process'].exitcode}), restarting")
+                self._spawn()
+
+    def run(self) -> None:
+        """停止要求があるまでワーカープロセス群を維持する"""
+        for _ in range(self.processes):
+            self._spawn()
+        
+        while not self._stopping:
+            try:
+                kind, worker_id = self._messages.get(timeout=1.0)
+                self._handle_message(kind, worker_id)
+            except queue.Empty:
+                pass
+            self._reap()
+        
+        for child in self._children.values():
+            child["stop_event"].set()
+        for child in self._children.values():
+            child["process"].join()
+
+    def stop(self) -> None:
+        """全ワーカーを処理中のジョブが終わり次第停止する"""
+        self._stopping = True
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """コマンドラインエントリーポイント"""
+    parser = argparse.ArgumentParser(description="PDF変換ワーカー")
+    parser.add_argument("--worker-id", default=None, help="ワーカーID（省略時は自動生成）")
+    parser.add_argument("--lease-seconds", type=float, default=60.0, help="ジョブのリース期間（秒）")
+    parser.add_argument("--poll-interval", type=float, default=1.0, help="キューが空のときの待機間隔（秒）")
+    parser.add_argument("--max-attempts", type=int, default=3, help="1ジョブあたりの最大試行回数")
+    parser.add_argument("--markdown-dir", default="data/markdown", help="Markdown出力ディレクトリ")
+    parser.add_argument("--max-jobs", type=int, default=None, help="1プロセスあたりの最大処理件数")
+    parser.add_argument("--max-rss-mb", type=float, default=None, help="入れ替えるRSSの閾値（MB）")
+    parser.add_argument("--processes", type=int, default=None, help="ワーカープロセス数（スーパーバイザーを起動）")
+    parser.add_argument("--once", action="store_true", help="ジョブを1件だけ処理して終了")
+    args = parser.parse_args(argv)
+
+    # 本文を保存できない圧縮方式の設定や、APIとDBを共有できないエフェメラルモードならジョブを取る前に止める
+    markdown_codec.check_codec()
+    check_ephemeral_mode("queue")
+
+    if args.processes:
+        supervisor = WorkerSupervisor(args.processes, {
+            "lease_seconds": args.lease_seconds,
+            "poll_interval": args.poll_interval,
+            "max_attempts": args.max_attempts,
+            "max_jobs": args.max_jobs,
+            "max_rss_mb": args.max_rss_mb,
+            "markdown_dir": args.markdown_dir
+        })
+        signal.signal(signal.SIGTERM, lambda *_: supervisor.stop())
+        signal.signal(signal.SIGINT, lambda *_: supervisor.stop())
+        supervisor.run()
+        return
+
+    worker = ConversionWorker(
+        worker_id=args.worker_id,
+        lease_seconds=args.lease_seconds,
+        poll_interval=args.poll_interval,
+        max_attempts=args.max_attempts,
+        pdf_service=PDFService(markdown_dir=args.markdown_dir),
+        max_jobs=args.max_jobs,
+        max_rss_mb=args.max_rss_mb
+    )
+
+    if args.once:
+        worker.run_once()
+        return
+
+    signal.signal(signal.SIGTERM, lambda *_: worker.stop())
+    signal.signal(signal.SIGINT, lambda *_: worker.stop())
+    worker.run()
+
+
+if __name__ == "__main__":
+    main()
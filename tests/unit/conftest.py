@@ -72,6 +72,17 @@ def temp_dir():
     shutil.rmtree(temp_directory)
 
 
+@pytest.fixture
+def temp_db(tmp_path):
+    """一時ディレクトリ上の独立したDatabaseManager
+
+    グローバルな db_manager とは別のDBファイルを使うため、
+    件数や順序に依存するテストで利用します。
+    """
+    from src.api.database import DatabaseManager
+    return DatabaseManager(db_path=str(tmp_path / "database.db"))
+
+
 @pytest.fixture
 def sample_file_id(test_client):
     """テスト用ファイルを作成し、そのIDを返す
@@ -137,7 +148,7 @@ def mock_pdf_service(monkeypatch):
         def __init__(self):
             self.processed_files = []
             
-        async def process_pdf_upload(self, file_content, filename):
+        async def process_pdf_upload(self, file_content, filename, priority=None):
             self.processed_files.append(filename)
             return {
                 "success": True,
@@ -122,6 +122,10 @@ def test_list_files_failure(test_client):
     assert "detail" in data
     assert any("less than or equal to 100" in str(error.get("msg", "")) for error in data["detail"])
 
+    # 上限を超える深さのページ
+    response = test_client.get(APIEndpoints.LIST_FILES, params={"page": 101, "per_page": 100})
+    assert response.status_code == 400
+
 # ファイル更新APIのテスト（正常系）
 def test_update_file_success(sample_file_id, test_client):
     """ファイル更新APIのテスト（正常系）"""
@@ -139,6 +143,553 @@ def test_update_file_success(sample_file_id, test_client):
     data = response.json()
     assert_update_response(data, sample_file_id, "test_markdown.pdf")  
 
+# ファイル取得APIのキャッシュが更新で無効化されるテスト
+def test_get_file_cache_invalidated_on_update(sample_file_id, test_client):
+    """更新後の取得でキャッシュ済みの古いレスポンスが返らないことのテスト"""
+    from src.api.services.response_cache import file_response_cache
+    from .helpers import load_test_pdf
+
+    first = test_client.get(APIEndpoints.get_file_endpoint(sample_file_id))
+    assert first.status_code == 200
+    assert file_response_cache.get(sample_file_id).body == first.content
+
+    response = test_client.put(
+        APIEndpoints.get_file_endpoint(sample_file_id),
+        files={"file": ("renamed.pdf", load_test_pdf(), "application/pdf")}
+    )
+    assert response.status_code == 200
+
+    second = test_client.get(APIEndpoints.get_file_endpoint(sample_file_id))
+    assert second.json()["filename"] == "renamed.pdf"
+
+    test_client.delete(APIEndpoints.get_file_endpoint(sample_file_id))
+    assert test_client.get(APIEndpoints.get_file_endpoint(sample_file_id)).status_code == 404
+
+# 条件付きGET（ETag / If-None-Match）のテスト
+def test_get_file_conditional_request(sample_file_id, test_client, monkeypatch):
+    """ETagが一致すれば本文を読まずに304を返すテスト"""
+    from src.api.services.response_cache import file_response_cache
+    from src.api.database import db_manager
+
+    response = test_client.get(APIEndpoints.get_file_endpoint(sample_file_id))
+    etag = response.headers["ETag"]
+    assert etag.startswith('"')
+
+    # キャッシュを空にし、本文の読み込みが行われないことを確認する
+    file_response_cache.clear()
+    def fail_get_file(file_id):
+        raise AssertionError("markdown should not be loaded")
+    monkeypatch.setattr(db_manager, "get_file", fail_get_file)
+
+    response = test_client.get(
+        APIEndpoints.get_file_endpoint(sample_file_id), headers={"If-None-Match": etag}
+    )
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    assert response.content == b""
+
+    monkeypatch.undo()
+    response = test_client.get(
+        APIEndpoints.get_file_endpoint(sample_file_id), headers={"If-None-Match": '"stale"'}
+    )
+    assert response.status_code == 200
+    assert response.json()["id"] == sample_file_id
+
+
+def test_list_files_conditional_request(test_client, monkeypatch):
+    """一覧のETagが一致すれば一覧を読まずに304を返すテスト"""
+    from src.api.database import db_manager
+
+    response = test_client.get(APIEndpoints.LIST_FILES)
+    etag = response.headers["ETag"]
+    response = test_client.get(APIEndpoints.LIST_FILES, params={"per_page": 5})
+    assert response.headers["ETag"] != etag
+
+    def fail_list_files(*args, **kwargs):
+        raise AssertionError("list should not be loaded")
+    monkeypatch.setattr(db_manager, "list_files", fail_list_files)
+    response = test_client.get(APIEndpoints.LIST_FILES, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    monkeypatch.undo()
+
+    upload_test_pdf(test_client)
+    response = test_client.get(APIEndpoints.LIST_FILES, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+# レスポンス圧縮のテスト
+def test_get_file_compressed_response(test_client):
+    """大きなMarkdownはgzipで返し、圧縮結果をキャッシュするテスト"""
+    import uuid
+    from src.api.database import db_manager
+    from src.api.services.response_cache import file_response_cache
+
+    file_id = str(uuid.uuid4())
+    markdown = "# 大きな文書\n\n" + "本文の行です。\n" * 5000
+    db_manager.insert_file(file_id, "large.pdf", "data/uploads/large.pdf", 1024)
+    db_manager.update_file_status(file_id, FileStatus.COMPLETED, markdown, 1.0)
+
+    response = test_client.get(
+        APIEndpoints.get_file_endpoint(file_id), headers={"Accept-Encoding": "gzip"}
+    )
+    assert response.status_code == 200
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert int(response.headers["Content-Length"]) < len(markdown.encode("utf-8"))
+    assert response.json()["markdown"] == markdown
+    assert "gzip" in file_response_cache.get(file_id).encoded
+    gzip_etag = response.headers["ETag"]
+    assert gzip_etag.endswith('-gzip"')
+
+    response = test_client.get(
+        APIEndpoints.get_file_endpoint(file_id), headers={"Accept-Encoding": "identity"}
+    )
+    assert "Content-Encoding" not in response.headers
+    assert response.json()["markdown"] == markdown
+    # 圧縮の有無でバイト列が異なるため、強いETagも異なる
+    assert response.headers["ETag"] != gzip_etag
+
+    response = test_client.get(
+        APIEndpoints.get_file_endpoint(file_id),
+        headers={"Accept-Encoding": "gzip", "If-None-Match": gzip_etag}
+    )
+    assert response.status_code == 304
+    assert response.headers["ETag"] == gzip_etag
+
+    test_client.delete(APIEndpoints.get_file_endpoint(file_id))
+
+
+def test_negotiate_encoding():
+    """Accept-Encoding から圧縮方式を選ぶテスト"""
+    from src.api.compression import negotiate_encoding
+
+    assert negotiate_encoding(None) is None
+    assert negotiate_encoding("identity") is None
+    assert negotiate_encoding("gzip, deflate") == "gzip"
+    assert negotiate_encoding("gzip;q=0") is None
+    assert negotiate_encoding("*") is not None
+
+
+def test_encoded_etag():
+    """圧縮方式ごとのETagのテスト"""
+    from src.api.compression import encoded_etag, strip_etag_encoding
+
+    assert encoded_etag('"abc"', "gzip") == '"abc-gzip"'
+    assert encoded_etag('W/"abc"', "br") == 'W/"abc-br"'
+    assert encoded_etag('"abc"', None) == '"abc"'
+    assert strip_etag_encoding('"abc-gzip"') == '"abc"'
+    assert strip_etag_encoding('W/"abc-deflate"') == '"abc"'
+    assert strip_etag_encoding('"abc"') == '"abc"'
+
+# Markdownダウンロードのテスト
+def test_download_markdown(sample_file_id, test_client):
+    """保存済みMarkdownをファイルから返すテスト（Range・ETag対応）"""
+    url = f"/files/{sample_file_id}/markdown"
+    markdown = test_client.get(APIEndpoints.get_file_endpoint(sample_file_id)).json()["markdown"]
+
+    response = test_client.get(url)
+    assert response.status_code == 200
+    assert response.headers["Content-Type"].startswith("text/markdown")
+    assert response.headers["Accept-Ranges"] == "bytes"
+    assert response.text == markdown
+    etag = response.headers["ETag"]
+
+    response = test_client.get(url, headers={"Range": "bytes=0-9"})
+    assert response.status_code == 206
+    assert response.headers["Content-Range"].startswith("bytes 0-9/")
+    assert response.content == markdown.encode("utf-8")[:10]
+
+    response = test_client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+
+def test_download_markdown_precompressed(test_client):
+    """圧縮して保存された本文がそのまま返されるテスト"""
+    import uuid
+    from src.api.database import db_manager
+
+    file_id = str(uuid.uuid4())
+    markdown = "# 圧縮\n\n" + "本文の行です。\n" * 200
+    db_manager.insert_file(file_id, "compressed.pdf", "data/uploads/compressed.pdf", 10)
+    db_manager.update_file_status(file_id, FileStatus.COMPLETED, markdown)
+    stored = db_manager.get_markdown_payload(file_id)
+    encoding = {"zlib": "deflate", "zstd": "zstd"}[stored["encoding"]]
+
+    response = test_client.get(f"/files/{file_id}/markdown", headers={"Accept-Encoding": encoding})
+    assert response.status_code == 200
+    assert response.headers["Content-Encoding"] == encoding
+    assert int(response.headers["Content-Length"]) == len(stored["payload"])
+    encoded_etag = response.headers["ETag"]
+    assert encoded_etag.endswith(f'-{encoding}"')
+
+    response = test_client.get(f"/files/{file_id}/markdown", headers={"Accept-Encoding": "identity"})
+    assert "Content-Encoding" not in response.headers
+    assert response.text == markdown
+    assert response.headers["ETag"] != encoded_etag
+
+    response = test_client.get(
+        f"/files/{file_id}/markdown",
+        headers={"Accept-Encoding": encoding, "If-None-Match": encoded_etag}
+    )
+    assert response.status_code == 304
+    assert response.headers["ETag"] == encoded_etag
+    test_client.delete(APIEndpoints.get_file_endpoint(file_id))
+
+
+def test_unreadable_markdown_is_server_error(test_client, monkeypatch):
+    """展開できない方式の本文は 404 ではなく 500 になるテスト"""
+    import uuid
+    from src.api import markdown_codec
+    from src.api.database import db_manager
+
+    file_id = str(uuid.uuid4())
+    db_manager.insert_file(file_id, "zstd.pdf", "data/uploads/zstd.pdf", 10)
+    db_manager.update_file_status(file_id, FileStatus.COMPLETED, "# zstd\n\n" + "本文の行です。\n" * 200)
+    monkeypatch.setattr(markdown_codec, "decode", lambda payload, encoding: (_ for _ in ()).throw(
+        markdown_codec.MarkdownCodecError("zstandard is not installed")))
+
+    response = test_client.get(APIEndpoints.get_file_endpoint(file_id))
+    assert response.status_code == 500
+    assert "MARKDOWN_CODEC" in response.json()["detail"]
+    monkeypatch.undo()
+    db_manager.delete_file(file_id)
+
+
+def test_delete_unreadable_markdown_is_server_error(test_client, monkeypatch):
+    """展開できない方式の本文を持つファイルの削除が 404 ではなく 500 になり、行が残るテスト"""
+    import uuid
+    from src.api import markdown_codec
+    from src.api.database import db_manager
+
+    def unreadable(*args):
+        raise markdown_codec.MarkdownCodecError("zstandard is not installed")
+
+    file_id = str(uuid.uuid4())
+    db_manager.insert_file(file_id, "zstd.pdf", "data/uploads/zstd.pdf", 10)
+    db_manager.update_file_status(file_id, FileStatus.COMPLETED, "# zstd\n\n" + "本文の行です。\n" * 200)
+    monkeypatch.setattr(markdown_codec, "check_decodable", unreadable)
+    monkeypatch.setattr(markdown_codec, "decode", lambda payload, encoding: unreadable())
+
+    response = test_client.delete(APIEndpoints.get_file_endpoint(file_id))
+    assert response.status_code == 500
+    assert "MARKDOWN_CODEC" in response.json()["detail"]
+    monkeypatch.undo()
+    assert db_manager.get_file(file_id) is not None
+
+    # 展開できるようになれば削除でき、検索インデックスからも外れる
+    response = test_client.delete(APIEndpoints.get_file_endpoint(file_id))
+    assert response.status_code == 200
+    assert db_manager.get_file(file_id) is None
+
+
+def test_statistics_and_cleanup_do_not_decode_markdown(test_client, monkeypatch):
+    """統計とクリーンアップが本文を展開しないテスト（展開できない本文があっても動く）"""
+    import uuid
+    from src.api import markdown_codec
+    from src.api.database import db_manager
+
+    file_id = str(uuid.uuid4())
+    db_manager.insert_file(file_id, "stats.pdf", "data/uploads/stats.pdf", 10)
+    db_manager.update_file_status(file_id, FileStatus.COMPLETED, "# 統計\n\n" + "本文の行です。\n" * 200)
+    monkeypatch.setattr(markdown_codec, "decode", lambda payload, encoding: (_ for _ in ()).throw(
+        markdown_codec.MarkdownCodecError("zstandard is not installed")))
+
+    response = test_client.get(APIEndpoints.GET_STATISTICS)
+    assert response.status_code == 200
+    assert response.json()["total_files"] >= 1
+    response = test_client.post("/cleanup", params={"days": 365})
+    assert response.status_code == 200
+    assert response.json()["deleted_count"] == 0
+    monkeypatch.undo()
+    db_manager.delete_file(file_id)
+
+
+def test_download_markdown_failure(test_client):
+    """存在しないファイルのMarkdownダウンロードのテスト"""
+    import uuid
+
+    response = test_client.get(f"/files/{uuid.uuid4()}/markdown")
+    assert_file_not_found_error(response)
+
+# フィールド指定での取得のテスト
+def test_get_file_with_fields(sample_file_id, test_client):
+    """指定したフィールドだけを返すテスト"""
+    response = test_client.get(
+        APIEndpoints.get_file_endpoint(sample_file_id),
+        params={"fields": "status,processing_time"}
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert set(data) == {"id", "status", "processing_time"}
+    assert data["status"] == "completed"
+
+    full = test_client.get(APIEndpoints.get_file_endpoint(sample_file_id))
+    assert response.headers["ETag"] != full.headers["ETag"]
+
+    response = test_client.get(
+        APIEndpoints.get_file_endpoint(sample_file_id), params={"fields": "status,secret"}
+    )
+    assert response.status_code == 400
+    assert "secret" in response.json()["detail"]
+
+
+def test_list_files_with_fields(test_client):
+    """一覧でも指定したフィールドだけを返すテスト"""
+    upload_test_pdf(test_client)
+
+    response = test_client.get(APIEndpoints.LIST_FILES, params={"fields": "status"})
+    assert response.status_code == 200
+    files = response.json()["files"]
+    assert files
+    assert all(set(file_info) == {"id", "status"} for file_info in files)
+
+def test_list_files_with_filters(test_client):
+    """一覧の絞り込みと並び替えのテスト"""
+    upload_test_pdf(test_client)
+
+    response = test_client.get(APIEndpoints.LIST_FILES, params={
+        "status": "completed",
+        "created_from": "2000-01-01T00:00:00Z",
+        "min_size": 1,
+        "sort": "-file_size",
+        "per_page": 100
+    })
+    assert response.status_code == 200
+    files = response.json()["files"]
+    assert files
+    assert all(file_info["status"] == "completed" for file_info in files)
+    sizes = [file_info["file_size"] for file_info in files]
+    assert sizes == sorted(sizes, reverse=True)
+
+    response = test_client.get(APIEndpoints.LIST_FILES, params={"status": "completed", "created_to": "2000-01-01"})
+    assert response.json()["total_count"] == 0
+
+    response = test_client.get(APIEndpoints.LIST_FILES, params={"sort": "metadata"})
+    assert response.status_code == 422
+
+def test_duplicate_uploads_share_one_blob(test_client):
+    """同じPDFのアップロードが1つのブロブを共有し、最後の参照の削除で消えるテスト"""
+    import uuid
+    from pathlib import Path
+    from src.api.database import db_manager
+    from .helpers import load_test_pdf
+
+    # 他のテストと内容が重ならないよう末尾にコメントを付けたPDF
+    content = load_test_pdf() + f"\n% {uuid.uuid4()}\n".encode("ascii")
+    first = upload_test_pdf(test_client, content=content)["id"]
+    second = upload_test_pdf(test_client, content=content)["id"]
+    blob_path = db_manager.get_file(first)["original_path"]
+    assert db_manager.get_file(second)["original_path"] == blob_path
+
+    test_client.delete(APIEndpoints.get_file_endpoint(first))
+    assert Path(blob_path).exists()
+
+    test_client.delete(APIEndpoints.get_file_endpoint(second))
+    assert not Path(blob_path).exists()
+
+# 一括取得・一括削除APIのテスト
+def test_batch_get_and_delete_files(test_client):
+    """複数IDの一括取得と一括削除のテスト"""
+    import uuid
+
+    first = upload_test_pdf(test_client)["id"]
+    second = upload_test_pdf(test_client)["id"]
+    missing = str(uuid.uuid4())
+    ids = [first, "invalid-id", second, missing]
+
+    response = test_client.post("/files:batchGet", json={"ids": ids, "fields": ["status"]})
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert [result["id"] for result in results] == ids
+    assert [result["found"] for result in results] == [True, False, True, False]
+    assert results[0]["file"] == {"id": first, "status": "completed"}
+    assert results[1]["error"] == "無効なファイルID形式です"
+    assert results[3]["error"] == "ファイルが見つかりません"
+
+    response = test_client.post("/files:batchGet", json={"ids": [first]})
+    assert_file_response(response.json()["results"][0]["file"], first, "test_markdown.pdf")
+
+    response = test_client.post("/files:batchDelete", json={"ids": ids})
+    assert response.status_code == 200
+    data = response.json()
+    assert data["deleted_count"] == 2
+    assert [result["deleted"] for result in data["results"]] == [True, False, True, False]
+    assert test_client.get(APIEndpoints.get_file_endpoint(first)).status_code == 404
+
+    response = test_client.post("/files:batchDelete", json={"ids": []})
+    assert response.status_code == 422
+
+# 全文検索APIのテスト
+def test_search_files(test_client):
+    """Markdown本文の全文検索のテスト"""
+    import uuid
+    from src.api.database import db_manager
+
+    file_id = str(uuid.uuid4())
+    keyword = f"kw{file_id[:8]}"
+    db_manager.insert_file(file_id, "search.pdf", "data/uploads/search.pdf", 10)
+    db_manager.update_file_status(file_id, FileStatus.COMPLETED, f"# 検索テスト\n\n{keyword} を含む本文")
+
+    response = test_client.get("/search", params={"q": keyword})
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert [result["id"] for result in results] == [file_id]
+    assert "<mark>" in results[0]["snippet"]
+    test_client.delete(APIEndpoints.get_file_endpoint(file_id))
+
+    response = test_client.get("/search", params={"q": "ab"})
+    assert response.status_code == 400
+
+    response = test_client.get("/search", params={"q": keyword, "cursor": "broken"})
+    assert response.status_code == 400
+
+# エクスポートAPIのテスト
+def test_export_files(sample_file_id, test_client):
+    """変換済みドキュメントをNDJSONでエクスポートするテスト"""
+    import json
+
+    response = test_client.get("/export", params={"format": "ndjson"})
+    assert response.status_code == 200
+    assert response.headers["Content-Type"].startswith("application/x-ndjson")
+    ids = [json.loads(line)["id"] for line in response.text.splitlines()]
+    assert sample_file_id in ids
+
+    response = test_client.get("/export", params={"format": "zip"})
+    assert response.status_code == 422
+
+# 同時エクスポートのテスト
+@pytest.mark.asyncio
+async def test_concurrent_exports(monkeypatch):
+    """複数のエクスポートを同時にストリーミングしても全件が返るテスト"""
+    import asyncio
+    import io
+    import json
+    import tarfile
+
+    import httpx
+
+    from src.api import main
+    from src.api.database import db_manager
+
+    # バッチをまたいで、ジェネレーターが別のスレッドで再開されるようにする
+    monkeypatch.setattr(main.export_service, "batch_size", 3)
+    file_ids = [f"00000000-0000-4000-8000-{index:012d}" for index in range(20)]
+    for file_id in file_ids:
+        db_manager.insert_file(file_id, "export.pdf", f"data/uploads/{file_id}.pdf", 10)
+        db_manager.update_file_status(file_id, FileStatus.COMPLETED, f"# {file_id}")
+
+    try:
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            responses = await asyncio.gather(
+                *(client.get("/export", params={"format": "ndjson"}) for _ in range(8)),
+                *(client.get("/export", params={"format": "tar"}) for _ in range(3))
+            )
+    finally:
+        db_manager.delete_files(file_ids)
+
+    for response in responses[:8]:
+        assert response.status_code == 200
+        ids = {json.loads(line)["id"] for line in response.text.splitlines()}
+        assert set(file_ids) <= ids
+    for response in responses[8:]:
+        assert response.status_code == 200
+        with tarfile.open(fileobj=io.BytesIO(response.content)) as archive:
+            names = set(archive.getnames())
+        assert {f"{file_id}.md" for file_id in file_ids} <= names
+
+# ロック待ちの削除のテスト
+@pytest.mark.asyncio
+async def test_delete_waiting_for_lock_does_not_block_other_requests():
+    """変換の書き戻し中のファイルを削除しても、ロック待ちで他のリクエストを止めないテスト"""
+    import asyncio
+    import threading
+    import uuid
+
+    import httpx
+
+    from src.api import main
+    from src.api.database import db_manager
+
+    file_id = str(uuid.uuid4())
+    db_manager.insert_file(file_id, "locked.pdf", "data/uploads/locked.pdf", 10)
+    acquired = threading.Event()
+    release = threading.Event()
+
+    def hold_lock():
+        with main.pdf_service.file_lock(file_id):
+            acquired.set()
+            release.wait(10)
+
+    holder = threading.Thread(target=hold_lock)
+    holder.start()
+    acquired.wait(5)
+    try:
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            delete = asyncio.ensure_future(client.delete(f"/files/{file_id}"))
+            batch = asyncio.ensure_future(client.post("/files:batchDelete", json={"ids": [file_id]}))
+            response = await asyncio.wait_for(client.get("/health"), 5)
+            assert response.status_code == 200
+            assert not delete.done() and not batch.done()
+
+            release.set()
+            responses = await asyncio.wait_for(asyncio.gather(delete, batch), 10)
+    finally:
+        release.set()
+        holder.join()
+
+    # どちらか一方だけが削除する
+    deleted = [responses[0].status_code == 200, responses[1].json()["deleted_count"] == 1]
+    assert deleted.count(True) == 1
+
+@pytest.mark.asyncio
+async def test_upload_waiting_for_blob_store_does_not_block_other_requests():
+    """ブロブストアのロック待ちのアップロードが他のリクエストを止めないテスト"""
+    import asyncio
+    import threading
+    import time
+
+    import httpx
+
+    from src.api import main
+    from src.api.services.blob_store import blob_store
+    from .helpers import load_test_pdf
+
+    acquired = threading.Event()
+    release = threading.Event()
+
+    def hold_lock():
+        with blob_store.lock():
+            acquired.set()
+            release.wait(10)
+
+    holder = threading.Thread(target=hold_lock)
+    holder.start()
+    acquired.wait(5)
+    try:
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            upload = asyncio.ensure_future(client.post(
+                APIEndpoints.UPLOAD,
+                files={"file": ("blob.pdf", load_test_pdf(), "application/pdf")}
+            ))
+            # アップロードがロック待ちに入るまで進める
+            started = time.monotonic()
+            await asyncio.sleep(0.2)
+            response = await asyncio.wait_for(client.get("/health"), 5)
+            assert response.status_code == 200
+            assert time.monotonic() - started < 5
+            assert not upload.done()
+
+            release.set()
+            response = await asyncio.wait_for(upload, 30)
+    finally:
+        release.set()
+        holder.join()
+
+    assert response.status_code == 200
+    main.file_service.delete_file(response.json()["id"])
+
 # ファイル更新APIのテスト（異常系）
 def test_update_file_failure(test_client):
     """ファイル更新APIの異常系テスト（共通パターン使用）"""
@@ -188,6 +739,49 @@ def test_get_file_logs_failure(test_client):
     get_logs_caller = create_file_endpoint_caller("GET", "/files/{file_id}/logs")
     run_invalid_file_id_patterns(test_client, get_logs_caller)
 
+# Markdownの版の履歴APIのテスト
+def test_file_versions(sample_file_id, test_client):
+    """再変換で増えた版の一覧と各版の取得のテスト"""
+    from src.api.database import db_manager
+
+    original = test_client.get(APIEndpoints.get_file_endpoint(sample_file_id)).json()["markdown"]
+    revised = original + "\n## 追記\n"
+    assert db_manager.update_file_status(sample_file_id, "completed", revised)
+
+    response = test_client.get(f"/files/{sample_file_id}/versions")
+    assert response.status_code == 200
+    versions = response.json()["versions"]
+    assert [row["version"] for row in versions] == [1, 2]
+
+    first = test_client.get(f"/files/{sample_file_id}/versions/1")
+    assert first.status_code == 200
+    assert first.json()["markdown"] == original
+    assert test_client.get(f"/files/{sample_file_id}/versions/2").json()["markdown"] == revised
+    assert test_client.get(f"/files/{sample_file_id}/versions/3").status_code == 404
+    assert test_client.get("/files/00000000-0000-4000-8000-000000000000/versions").status_code == 404
+
+# 版の差分APIのテスト
+def test_diff_file_versions(sample_file_id, test_client):
+    """2つの版の差分が unified diff で返るテスト"""
+    from src.api.database import db_manager
+
+    original = test_client.get(APIEndpoints.get_file_endpoint(sample_file_id)).json()["markdown"]
+    assert db_manager.update_file_status(sample_file_id, "completed", original + "\n## 追記\n")
+
+    response = test_client.get(f"/files/{sample_file_id}/diff")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/x-diff")
+    assert (response.headers["x-diff-from"], response.headers["x-diff-to"]) == ("1", "2")
+    assert response.text.startswith(f"--- {sample_file_id}@v1")
+    assert "+## 追記\n" in response.text
+
+    same = test_client.get(f"/files/{sample_file_id}/diff", params={"from": 2, "to": 2})
+    assert same.status_code == 200
+    assert same.text == ""
+    assert test_client.get(
+        f"/files/{sample_file_id}/diff", params={"from": 1, "to": 5}
+    ).status_code == 404
+
 # 統計情報取得APIのテスト（正常系）
 def test_get_statistics_success(test_client):
     """統計情報取得APIのテスト（正常系）"""
@@ -215,6 +809,26 @@ def test_cleanup_old_files_success(test_client):
     assert isinstance(data["deleted_count"], int)
     assert isinstance(data["total_old_files"], int)
 
+def test_cleanup_archive_mode(test_client):
+    """アーカイブモードのクリーンアップAPIのテスト"""
+    response = test_client.post(APIEndpoints.CLEANUP_OLD_FILES, params={"days": 365, "mode": "archive"})
+    assert response.status_code == 200
+    data = response.json()
+    assert "アーカイブが完了しました" in data["message"]
+    assert isinstance(data["archived_count"], int)
+    
+    response = test_client.post(APIEndpoints.CLEANUP_OLD_FILES, params={"days": 30, "mode": "purge"})
+    assert response.status_code == 422
+
+def test_maintenance_status(test_client):
+    """メンテナンス状況取得APIのテスト"""
+    response = test_client.get("/maintenance")
+    assert response.status_code == 200
+    data = response.json()
+    assert data["storage"]["auto_vacuum"] == "incremental"
+    assert "free_ratio" in data["storage"]
+    assert "pages_reclaimed" in data
+
 # 古いファイルクリーンアップAPIのテスト（異常系）
 def test_cleanup_old_files_failure(test_client):
     """古いファイルクリーンアップAPIの異常系テスト（バリデーション統合）"""
@@ -231,4 +845,37 @@ def test_cleanup_old_files_failure(test_client):
     assert response.status_code == 422
     data = response.json()
     assert "detail" in data
-    assert any("less than or equal to 365" in str(error.get("msg", "")) for error in data["detail"])
\ No newline at end of file
+    assert any("less than or equal to 365" in str(error.get("msg", "")) for error in data["detail"])
+
+# 優先度付きアップロードのテスト
+def test_upload_pdf_with_priority(test_client):
+    """優先度を指定したアップロードのテスト"""
+    from .helpers import load_test_pdf
+    pdf_content = load_test_pdf()
+
+    response = test_client.post(
+        APIEndpoints.UPLOAD,
+        files={"file": ("test_markdown.pdf", pdf_content, "application/pdf")},
+        data={"priority": "5"}
+    )
+    assert response.status_code == 200
+    assert_upload_response(response.json(), "completed")
+
+    # 範囲外の優先度
+    response = test_client.post(
+        APIEndpoints.UPLOAD,
+        files={"file": ("test_markdown.pdf", pdf_content, "application/pdf")},
+        data={"priority": "11"}
+    )
+    assert response.status_code == 422
+
+
+# 変換ワーカー稼働状況APIのテスト
+def test_get_worker_status(test_client):
+    """変換ワーカー稼働状況APIのテスト"""
+    response = test_client.get("/workers")
+    assert response.status_code == 200
+    data = response.json()
+    assert "workers" in data
+    assert isinstance(data["workers"], list)
+    assert data["scheduler"]["workers"] >= 1
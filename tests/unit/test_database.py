@@ -0,0 +1,865 @@
+import time
+
+import pytest
+
+
+def _insert(db, file_id, filename="test.pdf"):
+    """テスト用のファイル行を登録"""
+    assert db.insert_file(file_id, filename, f"data/uploads/{file_id}.pdf", 1024)
+
+
+class TestConversionJobQueue:
+    """変換ジョブキューのテストクラス"""
+
+    def test_claim_returns_lowest_sort_key(self, temp_db):
+        """見積もりコストの小さいジョブから取り出されるテスト"""
+        _insert(temp_db, "file-large")
+        _insert(temp_db, "file-small")
+        temp_db.enqueue_conversion_job("file-large", "upload_and_convert", 100.0)
+        temp_db.enqueue_conversion_job("file-small", "upload_and_convert", 1.0)
+
+        first = temp_db.claim_conversion_job("worker-a", lease_seconds=60)
+        second = temp_db.claim_conversion_job("worker-b", lease_seconds=60)
+        third = temp_db.claim_conversion_job("worker-c", lease_seconds=60)
+
+        assert first["file_id"] == "file-small"
+        assert first["attempts"] == 1
+        assert first["original_path"] == "data/uploads/file-small.pdf"
+        assert second["file_id"] == "file-large"
+        assert third is None
+
+    def test_expired_lease_is_reclaimed(self, temp_db):
+        """リース期限切れのジョブが他のワーカーに回収されるテスト"""
+        _insert(temp_db, "file-1")
+        temp_db.enqueue_conversion_job("file-1", "upload_and_convert", 1.0)
+
+        job = temp_db.claim_conversion_job("dead-worker", lease_seconds=0.01)
+        time.sleep(0.05)
+        reclaimed = temp_db.claim_conversion_job("worker-b", lease_seconds=60)
+
+        assert reclaimed["id"] == job["id"]
+        assert reclaimed["attempts"] == 2
+        # 旧ワーカーはリースを失っている
+        assert temp_db.heartbeat_conversion_job(job["id"], "dead-worker", 60) is False
+        assert temp_db.finish_conversion_job(job["id"], "dead-worker", "done") is False
+        assert temp_db.finish_conversion_job(job["id"], "worker-b", "done") is True
+
+    def test_heartbeat_extends_lease(self, temp_db):
+        """ハートビートでリースが延長されるテスト"""
+        _insert(temp_db, "file-1")
+        temp_db.enqueue_conversion_job("file-1", "upload_and_convert", 1.0)
+
+        job = temp_db.claim_conversion_job("worker-a", lease_seconds=0.05)
+        assert temp_db.heartbeat_conversion_job(job["id"], "worker-a", 60) is True
+        time.sleep(0.1)
+
+        assert temp_db.claim_conversion_job("worker-b", lease_seconds=60) is None
+
+    def test_deleted_file_jobs_are_removed(self, temp_db):
+        """ファイル削除時にジョブも削除されるテスト"""
+        _insert(temp_db, "file-1")
+        temp_db.enqueue_conversion_job("file-1", "upload_and_convert", 1.0)
+
+        assert temp_db.delete_file("file-1") is True
+        assert temp_db.claim_conversion_job("worker-a", lease_seconds=60) is None
+
+
+class TestColumnProjection:
+    """列指定での取得のテストクラス"""
+
+    def test_get_file_reads_only_requested_columns(self, temp_db):
+        """指定した列だけが返されるテスト"""
+        _insert(temp_db, "file-1")
+        temp_db.update_file_status("file-1", "completed", "# 本文", 1.5)
+
+        file_info = temp_db.get_file("file-1", columns=["id", "status", "processing_time"])
+
+        assert file_info == {"id": "file-1", "status": "completed", "processing_time": 1.5}
+
+    def test_unknown_column_is_rejected(self, temp_db):
+        """未知の列名は実行されないテスト"""
+        _insert(temp_db, "file-1")
+
+        assert temp_db.get_file("file-1", columns=["id", "1; DROP TABLE files"]) is None
+        assert temp_db.get_file("file-1") is not None
+
+    def test_list_files_with_columns(self, temp_db):
+        """一覧でも指定した列だけが返されるテスト"""
+        _insert(temp_db, "file-1")
+        _insert(temp_db, "file-2")
+
+        result = temp_db.list_files(columns=["id", "status"])
+
+        assert result["total_count"] == 2
+        assert all(set(file_info) == {"id", "status"} for file_info in result["files"])
+
+
+class TestListFilters:
+    """一覧の絞り込み・並び替えのテストクラス"""
+
+    FILTER_VALUES = {
+        "status": "failed",
+        "filename_prefix": "report",
+        "created_from": "2024-01-01 00:00:00",
+        "created_to": "2024-01-02 00:00:00",
+        "min_size": 100,
+        "max_size": 10000,
+    }
+
+    def _insert_rows(self, db):
+        rows = [
+            ("file-1", "report-a.pdf", "failed", 500, "2024-01-01 22:00:00", 3.0),
+            ("file-2", "report-b.pdf", "completed", 5000, "2024-01-01 23:00:00", 1.0),
+            ("file-3", "invoice.pdf", "failed", 50, "2024-01-03 01:00:00", 2.0),
+        ]
+        for file_id, filename, status, size, created_at, processing_time in rows:
+            _insert(db, file_id, filename)
+            with db._connect() as conn:
+                conn.execute(
+                    "UPDATE files SET status = ?, file_size = ?, created_at = ?, processing_time = ? "
+                    "WHERE id = ?",
+                    (status, size, created_at, processing_time, file_id)
+                )
+
+    def test_filters_and_sort(self, temp_db):
+        """条件での絞り込みと並び替えのテスト"""
+        self._insert_rows(temp_db)
+
+        def ids(**kwargs):
+            return [row["id"] for row in temp_db.list_files(per_page=100, **kwargs)["files"]]
+
+        assert ids(filters={"status": "failed"}, sort="created_at") == ["file-1", "file-3"]
+        assert ids(filters={"filename_prefix": "report"}, sort="-processing_time") == ["file-1", "file-2"]
+        assert ids(filters={"created_from": "2024-01-01 00:00:00",
+                            "created_to": "2024-01-02 00:00:00"}, sort="file_size") == ["file-1", "file-2"]
+        assert ids(filters={"min_size": 100, "max_size": 1000}) == ["file-1"]
+        assert temp_db.list_files(filters={"status": "failed"})["total_count"] == 2
+
+    @pytest.mark.parametrize("sort", ["created_at", "-created_at", "processing_time",
+                                      "-processing_time", "file_size", "-file_size"])
+    def test_every_filter_combination_uses_index(self, temp_db, sort):
+        """すべての絞り込み・並び順の組み合わせで、一覧の SQL がインデックスだけで処理されるテスト
+
+        許可する走査・一時ソートは次の場合だけ:
+        - ページの取得で、並び替えの列から始まるインデックスを順に読む走査（LIMIT で止まる）
+        - 絞り込みのない総件数（全行を数えるため、いちばん小さいインデックスを読む）
+        - 並び替えの列とは別の列を範囲で絞り込んだ場合の一時ソート
+          （範囲と並び順を1つのインデックスから取れないため。ソートするのは範囲内の行だけ）
+        """
+        import itertools
+        import re
+
+        column = sort.lstrip("-")
+        keys = list(self.FILTER_VALUES)
+        with temp_db._connect() as conn:
+            def leading_column(index):
+                return conn.execute(f"PRAGMA index_info({index})").fetchone()[2]
+
+            for count in range(len(keys) + 1):
+                for combination in itertools.combinations(keys, count):
+                    filters = {key: self.FILTER_VALUES[key] for key in combination}
+                    count_sql, page_sql, params = temp_db._build_list_statements(None, filters, sort)
+                    for query, query_params in ((page_sql, (*params, 10, 0)), (count_sql, params)):
+                        plan = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {query}", query_params)]
+                        context = (combination, query, plan)
+                        ranges = {name for step in plan
+                                  for name in re.findall(r"(\w+)[<>]\?", step) if step.startswith("SEARCH")}
+                        for step in plan:
+                            scan = re.match(r"SCAN files USING (?:COVERING )?INDEX (\w+)", step)
+                            if scan:
+                                if query is page_sql:
+                                    assert leading_column(scan.group(1)) == column, context
+                                else:
+                                    assert not combination, context
+                            elif step.startswith("USE TEMP B-TREE"):
+                                assert query is page_sql and ranges - {column}, context
+                            else:
+                                assert step.startswith("SEARCH files USING"), context
+
+    def test_ties_are_ordered_by_id(self, temp_db):
+        """同じ値の行が id 順に並び、ページ間で重複・欠落しないテスト"""
+        for index in range(7):
+            _insert(temp_db, f"file-{index}")
+        with temp_db._connect() as conn:
+            conn.execute("UPDATE files SET created_at = '2024-01-01 00:00:00', file_size = 1")
+
+        for sort in ("created_at", "-created_at", "-file_size"):
+            pages = [temp_db.list_files(page, 3, sort=sort)["files"] for page in (1, 2, 3)]
+            ids = [row["id"] for rows in pages for row in rows]
+            expected = sorted(f"file-{index}" for index in range(7))
+            assert ids == (expected if not sort.startswith("-") else expected[::-1])
+
+    def test_changed_indexes_are_rebuilt(self, temp_db):
+        """列を変えた一覧用インデックスが既存DBで作り直されるテスト"""
+        from src.api.database import DatabaseManager
+
+        with temp_db._connect() as conn:
+            conn.execute("DROP INDEX idx_files_created_at")
+            conn.execute("CREATE INDEX idx_files_created_at ON files (created_at)")
+
+        migrated = DatabaseManager(db_path=temp_db.db_path)
+
+        with migrated._connect() as conn:
+            columns = [row[2] for row in conn.execute("PRAGMA index_info(idx_files_created_at)")]
+        assert columns == ["created_at", "id"]
+
+    def test_list_version_tracks_listed_changes(self, temp_db):
+        """一覧の変更カウンターが一覧に出る変更でだけ増えるテスト"""
+        version = temp_db.get_list_version()
+        _insert(temp_db, "file-1")
+        assert temp_db.get_list_version() > version
+
+        version = temp_db.get_list_version()
+        with temp_db._connect() as conn:
+            conn.execute("UPDATE files SET conversion_attempts = 1 WHERE id = 'file-1'")
+        assert temp_db.get_list_version() == version
+
+        temp_db.update_file_status("file-1", "completed", "# 本文")
+        assert temp_db.get_list_version() > version
+
+        version = temp_db.get_list_version()
+        temp_db.delete_file("file-1")
+        assert temp_db.get_list_version() > version
+
+    def test_statistics_and_old_files(self, temp_db):
+        """状態ごとの集計と、登録日時で古いファイルのIDを取得するテスト"""
+        self._insert_rows(temp_db)
+
+        assert temp_db.get_file_statistics() == {
+            "failed": {"count": 2, "total_size": 550, "total_processing_time": 5.0},
+            "completed": {"count": 1, "total_size": 5000, "total_processing_time": 1.0},
+        }
+        assert temp_db.find_files_created_before("2024-01-02 00:00:00") == ["file-1", "file-2"]
+        with temp_db._connect() as conn:
+            plan = conn.execute(
+                "EXPLAIN QUERY PLAN SELECT id FROM files WHERE created_at < ? ORDER BY created_at, id",
+                ("2024-01-02 00:00:00",)
+            ).fetchall()
+        assert "idx_files_created_at" in " ".join(row[-1] for row in plan)
+
+    def test_unknown_sort_is_rejected(self, temp_db):
+        """未知の並び替え列は実行されないテスト"""
+        with pytest.raises(ValueError):
+            temp_db._build_list_query(None, "-metadata")
+
+
+class TestBlobReferences:
+    """ブロブ参照数のテストクラス"""
+
+    def _ref_counts(self, db):
+        with db._connect() as conn:
+            return dict(conn.execute("SELECT digest, ref_count FROM blobs"))
+
+    def test_ref_count_follows_insert_reconvert_and_delete(self, temp_db):
+        """登録・再アップロード・削除に合わせて参照数が増減するテスト"""
+        temp_db.insert_file("file-1", "a.pdf", "blobs/aaa.pdf", 10, blob_digest="aaa")
+        temp_db.insert_file("file-2", "b.pdf", "blobs/aaa.pdf", 10, blob_digest="aaa")
+        assert self._ref_counts(temp_db) == {"aaa": 2}
+
+        temp_db.update_file_source("file-2", "b.pdf", "blobs/bbb.pdf", 20, blob_digest="bbb")
+        assert self._ref_counts(temp_db) == {"aaa": 1, "bbb": 1}
+
+        temp_db.delete_file("file-1")
+        temp_db.delete_files(["file-2"])
+        assert self._ref_counts(temp_db) == {"aaa": 0, "bbb": 0}
+        assert sorted(temp_db.take_unreferenced_blobs()) == ["aaa", "bbb"]
+        assert self._ref_counts(temp_db) == {}
+
+    def test_delete_keeps_blob_backed_pdf(self, temp_db, tmp_path):
+        """ブロブストアのPDFは直接消さず、Markdownは削除されるテスト"""
+        blob_path = tmp_path / "aaa.pdf"
+        blob_path.write_bytes(b"%PDF")
+        markdown_path = tmp_path / "file-1.md"
+        markdown_path.write_text("# a", encoding="utf-8")
+        temp_db.insert_file("file-1", "a.pdf", str(blob_path), 4, blob_digest="aaa")
+        temp_db.update_file_status("file-1", "completed", "# a", markdown_path=str(markdown_path))
+
+        assert temp_db.delete_file("file-1") is True
+        assert blob_path.exists()
+        assert not markdown_path.exists()
+
+
+class TestMarkdownCompression:
+    """Markdown本文の圧縮保存のテストクラス"""
+
+    MARKDOWN = "# 請求書\n\n" + "| 品目 | 数量 | 金額 |\n| --- | --- | --- |\n" * 50
+
+    def _raw(self, db, file_id):
+        with db._connect() as conn:
+            return conn.execute(
+                "SELECT markdown_content, markdown_encoding FROM files WHERE id = ?", (file_id,)
+            ).fetchone()
+
+    def test_content_is_compressed_and_read_back(self, temp_db, monkeypatch):
+        """本文が圧縮して保存され、読み出し時に展開されるテスト"""
+        monkeypatch.setenv("MARKDOWN_CODEC", "zlib")
+        _insert(temp_db, "file-1")
+        temp_db.update_file_status("file-1", "completed", self.MARKDOWN)
+
+        payload, encoding = self._raw(temp_db, "file-1")
+        assert encoding == "zlib"
+        assert isinstance(payload, bytes)
+        assert len(payload) < len(self.MARKDOWN.encode("utf-8"))
+        assert temp_db.get_file("file-1")["markdown_content"] == self.MARKDOWN
+        assert temp_db.get_file("file-1", columns=["markdown_content"]) == {
+            "markdown_content": self.MARKDOWN
+        }
+        assert [row["id"] for row in temp_db.search_files('"請求書"')] == ["file-1"]
+
+    def test_existing_content_is_compressed_in_batches(self, temp_db, monkeypatch):
+        """非圧縮の既存本文がハッシュを変えずに圧縮されるテスト"""
+        monkeypatch.setenv("MARKDOWN_CODEC", "none")
+        for index in range(3):
+            _insert(temp_db, f"file-{index}")
+            temp_db.update_file_status(f"file-{index}", "completed", self.MARKDOWN)
+        hashes = {f"file-{index}": temp_db.get_file(f"file-{index}")["content_hash"]
+                  for index in range(3)}
+        assert self._raw(temp_db, "file-0")[1] is None
+
+        first = temp_db.compress_markdown_batch(limit=2, codec="zlib")
+        second = temp_db.compress_markdown_batch(first["last_rowid"], limit=2, codec="zlib")
+
+        assert first["compressed"] + second["compressed"] == 3
+        assert first["bytes_after"] < first["bytes_before"]
+        for file_id, content_hash in hashes.items():
+            assert self._raw(temp_db, file_id)[1] == "zlib"
+            assert temp_db.get_file(file_id)["content_hash"] == content_hash
+            assert temp_db.get_file(file_id)["markdown_content"] == self.MARKDOWN
+        assert len(temp_db.search_files('"請求書"')) == 3
+
+    def test_small_content_is_stored_as_text(self, temp_db):
+        """小さい本文は圧縮しないテスト"""
+        _insert(temp_db, "file-1")
+        temp_db.update_file_status("file-1", "completed", "# 短い")
+
+        assert self._raw(temp_db, "file-1") == ("# 短い", None)
+
+
+    def test_default_codec_is_zlib(self, monkeypatch):
+        """zstandard の有無にかかわらず、指定がなければ zlib を使うテスト"""
+        from src.api import markdown_codec
+
+        monkeypatch.delenv("MARKDOWN_CODEC", raising=False)
+        monkeypatch.setattr(markdown_codec, "zstandard", object())
+
+        assert markdown_codec.default_codec() == "zlib"
+        assert markdown_codec.encode(self.MARKDOWN)[1] == "zlib"
+
+    def test_unreadable_codec_is_an_error(self, temp_db, monkeypatch):
+        """展開できない方式の本文は見つからない扱いにせず例外にするテスト"""
+        from src.api import markdown_codec
+
+        monkeypatch.setattr(markdown_codec, "zstandard", None)
+        _insert(temp_db, "file-1")
+        temp_db.update_file_status("file-1", "completed", self.MARKDOWN)
+        # zstandard のある環境で保存した本文（ハッシュが同じなので索引はし直さない）
+        with temp_db._connect() as conn:
+            conn.execute("UPDATE files SET markdown_encoding = 'zstd' WHERE id = ?", ("file-1",))
+            conn.commit()
+
+        with pytest.raises(markdown_codec.MarkdownCodecError):
+            temp_db.get_file("file-1")
+        with pytest.raises(markdown_codec.MarkdownCodecError):
+            markdown_codec.encode(self.MARKDOWN, "zstd")
+
+
+class TestFileVersions:
+    """Markdownの版の履歴のテストクラス"""
+
+    @staticmethod
+    def _markdown(revision):
+        lines = [f"| 行{index} | {index * 10} |\n" for index in range(100)]
+        lines[revision % 100] = f"| 行{revision % 100} | 改訂{revision} |\n"
+        return "# 請求書\n\n" + "".join(lines)
+
+    def test_every_version_is_restored(self, temp_db, monkeypatch):
+        """逆方向の差分と定期的な全文から、すべての版が復元できるテスト"""
+        monkeypatch.setattr("src.api.database.VERSION_SNAPSHOT_INTERVAL", 4)
+        _insert(temp_db, "file-1")
+        for revision in range(1, 11):
+            assert temp_db.update_file_status("file-1", "completed", self._markdown(revision))
+        # 本文が変わらない更新では版は増えない
+        temp_db.update_file_status("file-1", "completed", self._markdown(10))
+
+        versions = temp_db.list_file_versions("file-1")
+        assert [row["version"] for row in versions] == list(range(1, 11))
+        assert [row["kind"] for row in versions] == (["delta"] * 3 + ["snapshot"]) * 2 + [
+            "delta", "current"
+        ]
+        delta = versions[0]
+        assert delta["stored_size"] * 10 < delta["size"]
+        restored = temp_db.restore_file_versions("file-1", list(range(1, 12)))
+        assert sorted(restored) == list(range(1, 11))
+        for revision in range(1, 11):
+            assert restored[revision]["markdown_content"] == self._markdown(revision)
+            assert temp_db.get_file_version("file-1", revision)["markdown_content"] == (
+                self._markdown(revision)
+            )
+        assert temp_db.get_file_version("file-1", 11) is None
+
+    def test_latest_version_is_not_duplicated(self, temp_db):
+        """最新の版は files の本文だけで、初めての変換では履歴に何も保存しないテスト"""
+        _insert(temp_db, "file-1")
+        temp_db.update_file_status("file-1", "completed", self._markdown(1))
+
+        versions = temp_db.list_file_versions("file-1")
+        assert [(row["version"], row["kind"], row["stored_size"]) for row in versions] == [
+            (1, "current", 0)
+        ]
+        with temp_db._connect() as conn:
+            assert conn.execute("SELECT COUNT(*) FROM file_versions").fetchone()[0] == 0
+
+        temp_db.update_file_status("file-1", "completed", self._markdown(2))
+        assert [row["kind"] for row in temp_db.list_file_versions("file-1")] == [
+            "delta", "current"
+        ]
+        assert temp_db.delete_file("file-1")
+        assert temp_db.list_file_versions("file-1") == []
+
+    def test_concurrent_update_is_retried(self, temp_db, monkeypatch):
+        """差分の計算中に本文が更新されたら、計算し直して履歴を保つテスト"""
+        _insert(temp_db, "file-1")
+        temp_db.update_file_status("file-1", "completed", self._markdown(1))
+        prepare = temp_db._prepare_version
+        calls = []
+
+        def racing_prepare(file_id, markdown_content, content_hash):
+            prepared = prepare(file_id, markdown_content, content_hash)
+            calls.append(markdown_content)
+            if len(calls) == 1:
+                # ロックの外で準備している間に別の更新が入る
+                temp_db.update_file_status("file-1", "completed", self._markdown(2))
+            return prepared
+
+        monkeypatch.setattr(temp_db, "_prepare_version", racing_prepare)
+        assert temp_db.update_file_status("file-1", "completed", self._markdown(3))
+
+        assert calls[0] == calls[-1] == self._markdown(3)
+        restored = temp_db.restore_file_versions("file-1", [1, 2, 3])
+        assert [restored[version]["markdown_content"] for version in (1, 2, 3)] == [
+            self._markdown(1), self._markdown(2), self._markdown(3)
+        ]
+
+    def test_diff_skips_unchanged_pages(self, temp_db):
+        """ページのハッシュが保存され、変更されたページだけが差分になるテスト"""
+        import difflib
+        from src.api import markdown_delta
+
+        pages = [[f"p{page} line{index}\n" for index in range(10)] + ["---\n"]
+                 for page in range(5)]
+        old = "".join("".join(page) for page in pages)
+        pages[3][5] = "p3 changed\n"
+        new = "".join("".join(page) for page in pages)
+        _insert(temp_db, "file-1")
+        temp_db.update_file_status("file-1", "completed", old)
+        temp_db.update_file_status("file-1", "completed", new)
+
+        stored = temp_db.restore_file_versions("file-1", [1, 2])
+        new_hashes = markdown_delta.page_hashes(new)
+        assert len(stored[1]["page_hashes"]) == 5
+        assert [a == b for a, b in zip(stored[1]["page_hashes"], new_hashes)] == [
+            True, True, True, False, True
+        ]
+        diff = list(markdown_delta.iter_unified_diff(
+            old, new, "a", "b", stored[1]["page_hashes"], new_hashes
+        ))
+        expected = difflib.unified_diff(old.splitlines(True), new.splitlines(True), "a", "b")
+        assert "".join(diff) == "".join(expected)
+        assert diff[1].startswith("@@ -36,7 +36,7 @@")
+
+    def test_page_texts_match_split_pages(self):
+        """行に分けずに切り出したページが split_pages と同じになるテスト"""
+        from src.api import markdown_delta
+
+        for text in ("", "本文", "a\n---\n", "a\n --- \nb", "a\f\nb\n\f", "a\n---", "---\n---\n",
+                     "a\n--- x\nb\n", "a\n\u3000---\u3000\nb\n"):
+            assert markdown_delta.split_page_texts(text) == [
+                "".join(page) for page in markdown_delta.split_pages(text)
+            ]
+
+    def test_diff_restores_both_versions_at_once(self, temp_db):
+        """比較する2つの版を1回の復元で取得するテスト"""
+        from unittest.mock import patch
+        from src.api.services.file_service import FileService
+
+        _insert(temp_db, "file-1")
+        for body in ("# 版1\n", "# 版2\n", "# 版3\n"):
+            temp_db.update_file_status("file-1", "completed", body)
+
+        with patch("src.api.services.file_service.db_manager", temp_db), \
+             patch.object(temp_db, "restore_file_versions",
+                          wraps=temp_db.restore_file_versions) as restore:
+            diff = FileService().diff_versions("file-1", 1, 3)
+            text = b"".join(diff["chunks"]).decode("utf-8")
+        assert "-# 版1\n" in text and "+# 版3\n" in text
+        restore.assert_called_once_with("file-1", [1, 3])
+
+
+class TestStorageMaintenance:
+    """空きページの回収のテストクラス"""
+
+    def test_freed_pages_are_reclaimed_incrementally(self, temp_db):
+        """削除で空いたページが少しずつ返されるテスト"""
+        for index in range(200):
+            _insert(temp_db, f"file-{index}")
+            temp_db.update_file_status(f"file-{index}", "completed", f"{index} " + "本文" * 2000)
+        temp_db.delete_files([f"file-{index}" for index in range(200)])
+
+        before = temp_db.get_storage_status()
+        assert before["auto_vacuum"] == "incremental"
+        assert before["freelist_count"] > 10
+
+        assert temp_db.incremental_vacuum(10) == 10
+        while temp_db.incremental_vacuum(100):
+            pass
+        after = temp_db.get_storage_status()
+        assert after["freelist_count"] == 0
+        assert after["page_count"] < before["page_count"]
+        assert temp_db.optimize(analyze=True)
+
+    def test_existing_database_is_migrated(self, tmp_path):
+        """既存DBは起動時には VACUUM せず、コマンドで INCREMENTAL に移行されるテスト"""
+        import sqlite3
+        from src.api.database import DatabaseManager
+
+        path = tmp_path / "legacy.db"
+        conn = sqlite3.connect(path)
+        conn.execute("CREATE TABLE legacy (x)")
+        conn.execute("INSERT INTO legacy VALUES (1)")
+        conn.commit()
+        conn.close()
+
+        db = DatabaseManager(str(path))
+        assert db.get_storage_status()["auto_vacuum"] == "none"
+
+        assert db.enable_incremental_vacuum() == {"migrated": True, "auto_vacuum": "incremental"}
+        assert db.enable_incremental_vacuum()["migrated"] is False
+        assert db.get_storage_status()["auto_vacuum"] == "incremental"
+        with db._connect() as conn:
+            assert conn.execute("SELECT x FROM legacy").fetchall() == [(1,)]
+
+
+class TestShardedDatabase:
+    """シャード分割したデータベースのテストクラス"""
+
+    @pytest.fixture
+    def sharded_db(self, tmp_path):
+        from src.api.database import ShardedDatabaseManager
+        return ShardedDatabaseManager(str(tmp_path / "database.db"), shard_count=3)
+
+    def _fill(self, db, count=30):
+        for index in range(count):
+            file_id = f"file-{index:02d}"
+            db.insert_file(file_id, f"{file_id}.pdf", f"data/uploads/{file_id}.pdf", (index * 7) % 13)
+            target = db.shard_for(file_id) if hasattr(db, "shards") else db
+            with target._connect() as conn:
+                conn.execute("UPDATE files SET created_at = ? WHERE id = ?",
+                             (f"2025-01-01 00:00:{index:02d}", file_id))
+
+    def test_single_file_operations_touch_one_shard(self, sharded_db, tmp_path):
+        """1ファイルの操作が振り分け先のシャードだけで行われるテスト"""
+        self._fill(sharded_db)
+        counts = [shard.list_files()["total_count"] for shard in sharded_db.shards]
+        assert sum(counts) == 30 and all(counts)
+        assert (tmp_path / "database.shard2.db").exists()
+
+        index = sharded_db.shard_index("file-05")
+        sharded_db.update_file_status("file-05", "completed", "# 5")
+        sharded_db.add_conversion_log("file-05", "convert", "completed")
+        assert sharded_db.shards[index].get_file("file-05")["markdown_content"] == "# 5"
+        assert len(sharded_db.get_conversion_logs("file-05")) == 1
+        for other, shard in enumerate(sharded_db.shards):
+            if other != index:
+                assert shard.get_file("file-05") is None
+
+        assert sharded_db.delete_file("file-05")
+        assert sharded_db.get_file("file-05") is None
+        assert sorted(sharded_db.delete_files(["file-01", "file-02", "missing"])) == ["file-01", "file-02"]
+        assert set(sharded_db.get_files(["file-03", "file-04", "file-05"])) == {"file-03", "file-04"}
+
+    def test_list_files_is_merged_across_shards(self, sharded_db, temp_db):
+        """一覧が1つのDBと同じ順序・ページで返されるテスト"""
+        self._fill(sharded_db)
+        self._fill(temp_db)
+
+        for sort in ("-created_at", "created_at", "-file_size"):
+            for page in (1, 2, 4):
+                expected = temp_db.list_files(page, 8, sort=sort)
+                actual = sharded_db.list_files(page, 8, sort=sort)
+                assert actual["total_count"] == 30
+                keys = [(row[sort.lstrip("-")]) for row in actual["files"]]
+                assert keys == [row[sort.lstrip("-")] for row in expected["files"]]
+
+        projected = sharded_db.list_files(1, 3, columns=["id"], filters={"min_size": 5})
+        assert projected["files"] == temp_db.list_files(1, 3, columns=["id"], filters={"min_size": 5})["files"]
+        assert projected["total_count"] == temp_db.list_files(filters={"min_size": 5})["total_count"]
+
+    def test_statistics_and_old_files_across_shards(self, sharded_db, temp_db):
+        """集計と古いファイルの検索が1つのDBと同じ結果になるテスト"""
+        self._fill(sharded_db)
+        self._fill(temp_db)
+
+        assert sharded_db.get_file_statistics() == temp_db.get_file_statistics()
+        cutoff = "2025-01-01 00:00:10"
+        assert sorted(sharded_db.find_files_created_before(cutoff)) == \
+            temp_db.find_files_created_before(cutoff)
+
+    def test_deep_pages_are_not_read_from_shards(self, sharded_db, monkeypatch):
+        """LIST_MAX_OFFSET を超えるページは各シャードから読まないテスト"""
+        from src.api import database
+
+        self._fill(sharded_db)
+        monkeypatch.setattr(database, "LIST_MAX_OFFSET", 16)
+        calls = []
+        for shard in sharded_db.shards:
+            original = shard.list_files
+            monkeypatch.setattr(shard, "list_files",
+                                lambda *args, _original=original, **kwargs: calls.append(args) or _original(*args, **kwargs))
+
+        assert len(sharded_db.list_files(2, 8)["files"]) == 8
+        assert sharded_db.list_files(3, 8)["files"] == []
+        assert all(args[1] <= 16 for args in calls)
+
+    def test_search_cursor_across_shards(self, sharded_db):
+        """検索結果を全シャードから重複なくページングできるテスト"""
+        self._fill(sharded_db, count=12)
+        for index in range(12):
+            sharded_db.update_file_status(f"file-{index:02d}", "completed", "共通キーワード")
+
+        seen = []
+        after = None
+        while True:
+            rows = sharded_db.search_files('"共通キーワード"', limit=5, after=after)
+            seen.extend(row["id"] for row in rows)
+            if len(rows) < 5:
+                break
+            after = (rows[-1]["score"], rows[-1]["doc_id"])
+        assert sorted(seen) == [f"file-{index:02d}" for index in range(12)]
+
+    def test_job_ids_and_rowid_cursors_identify_shard(self, sharded_db):
+        """ジョブIDと rowid カーソルでシャードが区別されるテスト"""
+        self._fill(sharded_db, count=6)
+        job_ids = {sharded_db.enqueue_conversion_job(f"file-{index:02d}", "convert", index)
+                   for index in range(6)}
+        assert len(job_ids) == 6
+
+        job = sharded_db.claim_conversion_job("worker-1", 60)
+        assert job["id"] in job_ids
+        assert sharded_db.heartbeat_conversion_job(job["id"], "worker-1", 60)
+        assert sharded_db.finish_conversion_job(job["id"], "worker-1", "done")
+
+        seen = []
+        after = 0
+        while True:
+            rows = sharded_db.list_file_locations(after, 4)
+            seen.extend(row["id"] for row in rows)
+            if len(rows) < 4:
+                break
+            after = rows[-1]["rowid"]
+        assert sorted(seen) == [f"file-{index:02d}" for index in range(6)]
+
+    def test_blob_shared_across_shards_is_kept(self, sharded_db):
+        """別のシャードから参照されているブロブは未参照として返さないテスト"""
+        ids = ["file-00", "file-01", "file-02", "file-03"]
+        first, second = ids[0], next(
+            file_id for file_id in ids if sharded_db.shard_index(file_id) != sharded_db.shard_index(ids[0])
+        )
+        for file_id in (first, second):
+            sharded_db.insert_file(file_id, "a.pdf", "blobs/abc.pdf", 1, blob_digest="abc")
+        assert sharded_db.get_blob_statistics() == {"blob_count": 1, "reference_count": 2}
+
+        sharded_db.delete_file(first)
+        assert sharded_db.take_unreferenced_blobs() == []
+        sharded_db.delete_file(second)
+        assert sharded_db.take_unreferenced_blobs() == ["abc"]
+
+
+class TestEphemeralDatabase:
+    """メモリ上のDB（エフェメラルモード）のテストクラス"""
+
+    @pytest.fixture
+    def memory_db(self):
+        from src.api.database import DatabaseManager
+        return DatabaseManager(":memory:")
+
+    def test_same_api_as_file_database(self, memory_db, tmp_path):
+        """ファイルのDBと同じ操作ができ、ディスクに書かないテスト"""
+        _insert(memory_db, "file-1")
+        memory_db.update_file_status("file-1", "completed", "# メモリ上の本文")
+        memory_db.add_conversion_log("file-1", "convert", "completed")
+
+        assert memory_db.get_file("file-1")["markdown_content"] == "# メモリ上の本文"
+        assert memory_db.list_files()["total_count"] == 1
+        assert [row["id"] for row in memory_db.search_files('"メモリ上"')] == ["file-1"]
+        assert memory_db.delete_file("file-1")
+        assert memory_db.get_file("file-1") is None
+        assert not list(tmp_path.iterdir())
+
+    def test_rejects_multiple_processes(self, monkeypatch):
+        """変換ワーカーや複数の uvicorn ワーカーと組み合わせると起動しないテスト"""
+        from src.api.database import check_ephemeral_mode
+
+        monkeypatch.setenv("DATABASE_MODE", "memory")
+        monkeypatch.delenv("WEB_CONCURRENCY", raising=False)
+        check_ephemeral_mode("inline", ["uvicorn", "src.api.main:app"])
+        check_ephemeral_mode("inline", ["uvicorn", "src.api.main:app", "--workers", "1"])
+        with pytest.raises(RuntimeError, match="CONVERSION_MODE=queue"):
+            check_ephemeral_mode("queue", ["uvicorn", "src.api.main:app"])
+        with pytest.raises(RuntimeError, match="uvicorn workers"):
+            check_ephemeral_mode("inline", ["uvicorn", "src.api.main:app", "--workers", "4"])
+        with pytest.raises(RuntimeError, match="uvicorn workers"):
+            check_ephemeral_mode("inline", ["uvicorn", "src.api.main:app", "--workers=2"])
+        monkeypatch.setenv("WEB_CONCURRENCY", "2")
+        with pytest.raises(RuntimeError, match="uvicorn workers"):
+            check_ephemeral_mode("inline", ["uvicorn", "src.api.main:app"])
+
+        # 通常のモードでは制限しない
+        monkeypatch.delenv("DATABASE_MODE")
+        check_ephemeral_mode("queue", ["uvicorn", "src.api.main:app", "--workers", "4"])
+
+    def test_shared_across_threads(self, memory_db):
+        """複数スレッドからの書き込みと、スレッドをまたいだ読み出しのテスト"""
+        from concurrent.futures import ThreadPoolExecutor
+
+        def insert_many(worker):
+            for index in range(50):
+                _insert(memory_db, f"file-{worker}-{index}")
+                memory_db.update_file_status(f"file-{worker}-{index}", "completed", "# 本文")
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(insert_many, range(8)))
+        assert memory_db.list_files()["total_count"] == 400
+
+        # StreamingResponse のようにスレッドを変えながら読み進めても他の操作を止めない
+        rows = memory_db.iter_files(columns=["id"], batch_size=30)
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            first = executor.submit(lambda: [next(rows) for _ in range(100)]).result()
+            assert executor.submit(memory_db.get_file, "file-0-0").result(timeout=5)
+            rest = executor.submit(list, rows).result()
+        assert len({row["id"] for row in first + rest}) == 400
+
+    def test_ephemeral_mode_uses_memory(self, monkeypatch, tmp_path):
+        """DATABASE_MODE=memory でメモリ上のDBと一時ディレクトリを使うテスト"""
+        import src.api.database as database
+
+        monkeypatch.setenv("DATABASE_MODE", "memory")
+        monkeypatch.setenv("EPHEMERAL_DATA_DIR", str(tmp_path / "ephemeral"))
+        monkeypatch.setenv("DATABASE_SHARDS", "4")
+        monkeypatch.setattr(database, "_ephemeral_data_dir", None)
+
+        db = database.create_database_manager()
+        assert isinstance(db, database.DatabaseManager)
+        assert db.db_path == ":memory:"
+        assert database.data_dir() == tmp_path / "ephemeral"
+
+
+class TestBatchOperations:
+    """一括取得・一括削除のテストクラス"""
+
+    def test_get_files_across_chunks(self, temp_db, monkeypatch):
+        """IN 句の分割をまたいで取得できるテスト"""
+        monkeypatch.setattr("src.api.database.BATCH_CHUNK_SIZE", 2)
+        for index in range(5):
+            _insert(temp_db, f"file-{index}")
+
+        files = temp_db.get_files(["file-0", "file-3", "file-4", "missing", "file-0"])
+
+        assert set(files) == {"file-0", "file-3", "file-4"}
+        assert files["file-3"]["filename"] == "test.pdf"
+
+    def test_get_files_with_columns(self, temp_db):
+        """列指定時も id をキーに取得できるテスト"""
+        _insert(temp_db, "file-1")
+
+        files = temp_db.get_files(["file-1"], columns=["status"])
+
+        assert files == {"file-1": {"id": "file-1", "status": "processing"}}
+
+    def test_delete_files_removes_rows_and_jobs(self, temp_db, monkeypatch):
+        """一括削除で行とジョブが削除されるテスト"""
+        monkeypatch.setattr("src.api.database.BATCH_CHUNK_SIZE", 2)
+        for index in range(3):
+            _insert(temp_db, f"file-{index}")
+            temp_db.enqueue_conversion_job(f"file-{index}", "upload_and_convert", 1.0)
+
+        deleted = temp_db.delete_files(["file-0", "file-2", "missing"])
+
+        assert sorted(deleted) == ["file-0", "file-2"]
+        assert temp_db.get_file("file-0") is None
+        assert temp_db.get_file("file-1") is not None
+        assert temp_db.claim_conversion_job("worker", lease_seconds=60)["file_id"] == "file-1"
+
+
+class TestSearchIndex:
+    """全文検索インデックスのテストクラス"""
+
+    def _search(self, db, term):
+        return [row["id"] for row in db.search_files(f'"{term}"')]
+
+    def test_index_follows_insert_update_and_delete(self, temp_db):
+        """変換・再変換・削除に合わせてインデックスが更新されるテスト"""
+        _insert(temp_db, "file-1")
+        temp_db.update_file_status("file-1", "completed", "# 請求書の一覧\n\n合計金額")
+        assert self._search(temp_db, "請求書") == ["file-1"]
+
+        temp_db.update_file_status("file-1", "completed", "# 見積書の一覧")
+        assert self._search(temp_db, "請求書") == []
+        assert self._search(temp_db, "見積書") == ["file-1"]
+
+        temp_db.delete_file("file-1")
+        assert self._search(temp_db, "見積書") == []
+
+    def test_existing_files_are_indexed_on_migration(self, temp_db):
+        """インデックス導入前のファイルも検索できるテスト"""
+        from src.api.database import DatabaseManager
+
+        _insert(temp_db, "file-1")
+        temp_db.update_file_status("file-1", "completed", "移行前の文書です")
+        with temp_db._connect() as conn:
+            for trigger in ("files_search_insert", "files_search_update", "files_search_delete"):
+                conn.execute(f"DROP TRIGGER {trigger}")
+            conn.execute("DROP TABLE files_fts")
+            conn.execute("DROP TABLE search_documents")
+
+        migrated = DatabaseManager(db_path=temp_db.db_path)
+
+        assert self._search(migrated, "移行前") == ["file-1"]
+
+    def test_index_does_not_copy_markdown(self, temp_db):
+        """インデックスが本文の複製を持たず、更新後も本文と一致するテスト"""
+        from src.api.database import DatabaseManager
+
+        _insert(temp_db, "file-1")
+        _insert(temp_db, "file-2")
+        temp_db.update_file_status("file-1", "completed", "請求書の一覧 " * 100)
+        temp_db.update_file_status("file-2", "completed", "見積書")
+        temp_db.update_file_status("file-1", "completed", "納品書の一覧 " * 100)
+        temp_db.delete_file("file-2")
+
+        with temp_db._connect() as conn:
+            tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master")}
+            conn.execute("INSERT INTO files_fts (files_fts, rank) VALUES ('integrity-check', 1)")
+            # 本文の複製を持つ以前の定義に戻す
+            conn.execute("DROP TABLE files_fts")
+            conn.execute("CREATE VIRTUAL TABLE files_fts USING fts5(filename, content, tokenize = 'trigram')")
+
+        assert "files_fts_content" not in tables
+
+        migrated = DatabaseManager(db_path=temp_db.db_path)
+
+        assert self._search(migrated, "納品書") == ["file-1"]
+        with migrated._connect() as conn:
+            assert conn.execute(
+                "SELECT COUNT(*) FROM sqlite_master WHERE name = 'files_fts_content'"
+            ).fetchone()[0] == 0
+
+    def test_short_terms_filter_results(self, temp_db):
+        """3文字未満の語は絞り込みとして扱われるテスト"""
+        _insert(temp_db, "file-1")
+        _insert(temp_db, "file-2")
+        temp_db.update_file_status("file-1", "completed", "請求書 東京")
+        temp_db.update_file_status("file-2", "completed", "請求書 大阪")
+
+        rows = temp_db.search_files('"請求書"', like_terms=["東京"])
+
+        assert [row["id"] for row in rows] == ["file-1"]
@@ -179,33 +179,11 @@ class TestFileService:
 
     def test_get_file_statistics_success(self, file_service, mock_db_manager):
         """ファイル統計情報取得成功のテスト"""
-        # 統計用テストデータ（実際のFileServiceロジックに合わせて修正）
-        stats_files = [
-            {
-                "status": "completed",
-                "file_size": 1024,
-                "processing_time": 2.0
-            },
-            {
-                "status": "processing", 
-                "file_size": 2048,
-                "processing_time": None
-            },
-            {
-                "status": "completed",
-                "file_size": 512,
-                "processing_time": 1.5
-            },
-            {
-                "status": "failed",
-                "file_size": 256,
-                "processing_time": 0.5
-            }
-        ]
-        
-        mock_db_manager.list_files.return_value = {
-            "files": stats_files,
-            "total_count": len(stats_files)
+        # 状態ごとの集計（データベースの GROUP BY status の結果）
+        mock_db_manager.get_file_statistics.return_value = {
+            "completed": {"count": 2, "total_size": 1536, "total_processing_time": 3.5},
+            "processing": {"count": 1, "total_size": 2048, "total_processing_time": 0},
+            "failed": {"count": 1, "total_size": 256, "total_processing_time": 0.5},
         }
         
         # テスト実行
@@ -229,7 +207,7 @@ class TestFileService:
     def test_get_file_statistics_exception(self, file_service, mock_db_manager):
         """統計情報取得で例外が発生した場合のテスト"""
         # モック設定（例外発生）
-        mock_db_manager.list_files.side_effect = Exception("Database error")
+        mock_db_manager.get_file_statistics.side_effect = Exception("Database error")
         
         # テスト実行
         result = file_service.get_file_statistics()
@@ -241,27 +219,28 @@ class TestFileService:
 
     def test_cleanup_old_files_success(self, file_service, mock_db_manager):
         """古いファイルクリーンアップ成功のテスト"""
-        # 基本的な機能をテスト（例外処理のみ）
-        mock_db_manager.list_files.return_value = {
-            "files": [],
-            "total_count": 0
-        }
+        mock_db_manager.find_files_created_before.return_value = ["old-1", "old-2"]
+        mock_db_manager.delete_file.return_value = True
         
         # テスト実行
-        result = file_service.cleanup_old_files(days=30)
+        with patch("src.api.services.file_service.blob_store") as mock_blob_store:
+            result = file_service.cleanup_old_files(days=30)
         
         # アサーション
         assert result["success"] is True
-        assert result["deleted_count"] == 0
-        assert result["total_old_files"] == 0
+        assert result["deleted_count"] == 2
+        assert result["total_old_files"] == 2
+        mock_blob_store.collect_garbage.assert_called_once()
         
-        # list_filesが呼ばれたことを確認
-        mock_db_manager.list_files.assert_called_once_with(page=1, per_page=10000)
+        # 一覧を読まず、created_at の範囲でIDだけを取得する（UTC の CURRENT_TIMESTAMP 形式）
+        mock_db_manager.list_files.assert_not_called()
+        (cutoff,), _ = mock_db_manager.find_files_created_before.call_args
+        assert datetime.strptime(cutoff, "%Y-%m-%d %H:%M:%S")
 
     def test_cleanup_old_files_exception(self, file_service, mock_db_manager):
         """クリーンアップで例外が発生した場合のテスト"""
         # モック設定（例外発生）
-        mock_db_manager.list_files.side_effect = Exception("Database error")
+        mock_db_manager.find_files_created_before.side_effect = Exception("Database error")
         
         # テスト実行
         result = file_service.cleanup_old_files(days=30)
@@ -597,27 +576,27 @@ class TestPDFService:
         
         # アサーション
         assert result_path.endswith(f"{file_id}.md")
-        saved_file = tmp_path / f"{file_id}.md"
+        saved_file = pdf_service.markdown_path_for(file_id)
+        assert len(saved_file.relative_to(tmp_path).parts) == 3
         assert saved_file.exists()
         assert saved_file.read_text(encoding="utf-8") == markdown_content
 
-    def test_save_uploaded_file(self, pdf_service, tmp_path):
-        """アップロードファイル保存のテスト"""
-        # テスト用ディレクトリを設定
-        pdf_service.upload_dir = tmp_path
-        
-        # テストデータ
-        file_content = b"test pdf content"
-        filename = "test.pdf"
-        
-        # テスト実行
-        result_path = pdf_service._save_uploaded_file(file_content, filename)
-        
-        # アサーション
-        assert result_path.endswith(f"_{filename}")
-        saved_file = Path(result_path)
-        assert saved_file.exists()
-        assert saved_file.read_bytes() == file_content
+    def test_blob_store_deduplicates_content(self, tmp_path):
+        """同じ内容のPDFが1つのブロブとして保存されるテスト"""
+        from src.api.services.blob_store import BlobStore
+
+        store = BlobStore(str(tmp_path / "blobs"))
+
+        with store.lock():
+            first = store.put(b"test pdf content")
+            second = store.put(b"test pdf content")
+            other = store.put(b"other pdf content")
+
+        assert first == second != other
+        path = store.path_for(first)
+        assert path.relative_to(tmp_path / "blobs").parts[:2] == (first[:2], first[2:4])
+        assert path.read_bytes() == b"test pdf content"
+        assert len(list((tmp_path / "blobs").rglob("*.pdf"))) == 2
 
     def test_ensure_directories(self, tmp_path):
         """ディレクトリ作成のテスト"""
@@ -707,3 +686,886 @@ class TestPDFServiceParameterized:
             assert "ファイルサイズは10MB以下にしてください" in message
 
 
+
+
+# ===============================
+# ConversionSchedulerのテスト
+# ===============================
+
+class TestConversionScheduler:
+    """変換スケジューラのテストクラス"""
+
+    def _run_in_order(self, scheduler, jobs):
+        """ワーカーを塞いだ状態でジョブを投入し、実行順を返す"""
+        import threading
+        from src.api.services.conversion_scheduler import JobEstimate
+
+        gate = threading.Event()
+        order = []
+        blocker = scheduler.submit(gate.wait, estimate=JobEstimate(1, 0, 0.0))
+        futures = [
+            scheduler.submit(order.append, name, estimate=estimate, priority=priority)
+            for name, estimate, priority in jobs
+        ]
+        gate.set()
+        blocker.result(timeout=5)
+        for future in futures:
+            future.result(timeout=5)
+        return order
+
+    def test_estimate_job_cost_uses_page_count(self):
+        """実PDFのページ数からコストを見積もるテスト"""
+        from src.api.services.conversion_scheduler import estimate_job_cost
+        from .helpers import load_test_pdf
+
+        estimate = estimate_job_cost(load_test_pdf())
+
+        assert estimate.page_count >= 1
+        assert estimate.file_size > 0
+        assert estimate.cost > 0
+
+    def test_estimate_job_cost_invalid_pdf_falls_back_to_size(self):
+        """ページ数を読めない場合はサイズから概算するテスト"""
+        from src.api.services.conversion_scheduler import estimate_job_cost
+
+        estimate = estimate_job_cost(b"x" * (500 * 1024))
+
+        assert estimate.page_count == 10
+
+    def test_shortest_job_runs_first(self):
+        """見積もりコストの小さいジョブが先に実行されるテスト"""
+        from src.api.services.conversion_scheduler import ConversionScheduler, JobEstimate
+
+        scheduler = ConversionScheduler(max_workers=1, aging_rate=0.0)
+        order = self._run_in_order(scheduler, [
+            ("large", JobEstimate(900, 9 * 1024 * 1024, 45.0), None),
+            ("small", JobEstimate(1, 1024, 0.05), None),
+        ])
+
+        assert order == ["small", "large"]
+
+    def test_explicit_priority_overrides_cost(self):
+        """明示的な優先度が見積もりコストより優先されるテスト"""
+        from src.api.services.conversion_scheduler import ConversionScheduler, JobEstimate
+
+        scheduler = ConversionScheduler(max_workers=1, aging_rate=0.0)
+        order = self._run_in_order(scheduler, [
+            ("small", JobEstimate(1, 1024, 0.05), None),
+            ("urgent", JobEstimate(100, 1024 * 1024, 5.0), 1),
+        ])
+
+        assert order == ["urgent", "small"]
+
+    def test_aging_prevents_starvation(self):
+        """待ち時間が長いジョブはコストが大きくても先に実行されるテスト"""
+        from src.api.services.conversion_scheduler import JobEstimate, compute_sort_key
+
+        large = JobEstimate(900, 9 * 1024 * 1024, 45.0)
+        small = JobEstimate(1, 1024, 0.05)
+
+        # 60秒前に投入された大きなジョブ vs 今投入された小さなジョブ
+        old_large_key = compute_sort_key(large, enqueued_at=1000.0, aging_rate=1.0)
+        new_small_key = compute_sort_key(small, enqueued_at=1060.0, aging_rate=1.0)
+
+        assert old_large_key < new_small_key
+
+
+# ===============================
+# ResponseCacheのテスト
+# ===============================
+
+class TestResponseCache:
+    """レスポンスキャッシュのテストクラス"""
+
+    def test_evicts_least_recently_used_by_bytes(self):
+        """バイト数の上限を超えると最も古く使われたものから追い出すテスト"""
+        from src.api.services.response_cache import ResponseCache
+
+        cache = ResponseCache(max_bytes=100, ttl_seconds=60)
+        cache.put("a", "t1", b"x" * 40)
+        cache.put("b", "t1", b"x" * 40)
+        assert cache.get("a") is not None  # a を最近使ったことにする
+        cache.put("c", "t1", b"x" * 40)
+
+        assert cache.get("a") is not None
+        assert cache.get("b") is None
+        assert cache.get("c") is not None
+        assert cache.get_status()["size_bytes"] == 80
+
+    def test_oversized_response_is_not_cached(self):
+        """上限を超える単一レスポンスはキャッシュしないテスト"""
+        from src.api.services.response_cache import ResponseCache
+
+        cache = ResponseCache(max_bytes=10, ttl_seconds=60)
+
+        assert cache.put("a", "t1", b"x" * 11) is False
+        assert cache.get("a") is None
+
+    def test_stale_read_is_rejected_after_invalidation(self):
+        """無効化より前に読み込んだ内容は保存されないテスト"""
+        from src.api.services.response_cache import ResponseCache
+
+        cache = ResponseCache(max_bytes=100, ttl_seconds=60)
+        generation = cache.generation()
+        cache.invalidate("a")
+
+        assert cache.put("a", "t1", b"old", generation) is False
+        assert cache.put("a", "t2", b"new", cache.generation()) is True
+        assert cache.get("a").body == b"new"
+
+    def test_other_file_invalidation_does_not_reject(self):
+        """他のファイルの無効化では読み込んだ内容を捨てないテスト"""
+        from src.api.services import response_cache
+        from src.api.services.response_cache import ResponseCache
+
+        cache = ResponseCache(max_bytes=100, ttl_seconds=60)
+        generation = cache.generation()
+        cache.invalidate("b")
+        assert cache.put("a", "t1", b"body", generation) is True
+
+        # 記録から追い出された無効化は、それより前の世代の put をすべて断る
+        generation = cache.generation()
+        for index in range(response_cache.INVALIDATION_HISTORY + 1):
+            cache.invalidate(f"other-{index}")
+        assert cache.put("c", "t1", b"body", generation) is False
+        assert cache.put("c", "t1", b"body", cache.generation()) is True
+
+        generation = cache.generation()
+        cache.clear()
+        assert cache.put("a", "t2", b"body", generation) is False
+
+    def test_expired_entry_is_reloaded(self):
+        """TTLを過ぎたエントリは返さないテスト"""
+        from src.api.services.response_cache import ResponseCache
+
+        cache = ResponseCache(max_bytes=100, ttl_seconds=0)
+        cache.put("a", "t1", b"body")
+
+        assert cache.get("a") is None
+
+
+# ===============================
+# ExportServiceのテスト
+# ===============================
+
+class TestExportService:
+    """エクスポートサービスのテストクラス"""
+
+    @pytest.fixture
+    def export_db(self, temp_db, monkeypatch):
+        """変換済み2件・変換中1件を登録した一時DB"""
+        monkeypatch.setattr("src.api.services.export_service.db_manager", temp_db)
+        for file_id, markdown in [("file-1", "# 一つ目"), ("file-2", "# 二つ目\n" * 100)]:
+            temp_db.insert_file(file_id, f"{file_id}.pdf", f"data/uploads/{file_id}.pdf", 10)
+            temp_db.update_file_status(file_id, FileStatus.COMPLETED, markdown, 0.5)
+        temp_db.insert_file("file-3", "file-3.pdf", "data/uploads/file-3.pdf", 10)
+        return temp_db
+
+    def test_ndjson_export(self, export_db):
+        """変換済みドキュメントが1行1件で出力されるテスト"""
+        import json
+        from src.api.services.export_service import ExportService
+
+        output = b"".join(ExportService(batch_size=1).iter_ndjson())
+        documents = [json.loads(line) for line in output.decode("utf-8").splitlines()]
+
+        assert [document["id"] for document in documents] == ["file-1", "file-2"]
+        assert documents[0]["markdown"] == "# 一つ目"
+
+    def test_tar_export(self, export_db):
+        """tar アーカイブとして読み込めるテスト"""
+        import io
+        import tarfile
+        from src.api.services.export_service import ExportService
+
+        output = b"".join(ExportService().iter_tar(status=None))
+
+        with tarfile.open(fileobj=io.BytesIO(output)) as archive:
+            assert archive.getnames() == ["file-1.md", "file-2.md", "file-3.md"]
+            content = archive.extractfile("file-2.md").read().decode("utf-8")
+            assert content == "# 二つ目\n" * 100
+
+    def test_export_cli_writes_file(self, export_db, tmp_path):
+        """エクスポートコマンドがファイルに書き出すテスト"""
+        from src.api.export import main
+
+        output = tmp_path / "corpus.ndjson"
+        main(["--format", "ndjson", "--status", "all", "--output", str(output)])
+
+        assert len(output.read_text(encoding="utf-8").splitlines()) == 3
+
+
+# ===============================
+# SearchServiceのテスト
+# ===============================
+
+class TestSearchService:
+    """全文検索サービスのテストクラス"""
+
+    def test_parse_query_quotes_terms(self):
+        """検索語がフレーズとしてエスケープされるテスト"""
+        from src.api.services.search_service import SearchService
+
+        match_query, short_terms = SearchService().parse_query('請求書 "OR" 東京')
+
+        assert match_query == '"請求書" AND """OR"""'
+        assert short_terms == ["東京"]
+
+    def test_parse_query_requires_long_term(self):
+        """3文字以上の語がない場合はエラーになるテスト"""
+        from src.api.services.search_service import SearchService
+
+        with pytest.raises(ValueError):
+            SearchService().parse_query("東京 大阪")
+
+    def test_cursor_pagination(self, temp_db, monkeypatch):
+        """カーソルで重複なく全件を辿れるテスト"""
+        from src.api.services.search_service import SearchService
+
+        monkeypatch.setattr("src.api.services.search_service.db_manager", temp_db)
+        for index in range(5):
+            file_id = f"file-{index}"
+            temp_db.insert_file(file_id, f"{file_id}.pdf", f"data/uploads/{file_id}.pdf", 10)
+            temp_db.update_file_status(
+                file_id, FileStatus.COMPLETED, "請求書 " * (index + 1) + "その他の本文"
+            )
+
+        service = SearchService()
+        seen = []
+        cursor = None
+        while True:
+            page = service.search("請求書", limit=2, cursor=cursor)
+            seen.extend(result["id"] for result in page["results"])
+            cursor = page["next_cursor"]
+            if cursor is None:
+                break
+
+        assert sorted(seen) == [f"file-{index}" for index in range(5)]
+        assert seen[0] == "file-4"
+        assert "<mark>請求書</mark>" in service.search("請求書", limit=1)["results"][0]["snippet"]
+
+
+# ===============================
+# RecoveryServiceのテスト
+# ===============================
+
+class TestRecoveryService:
+    """PROCESSING のまま停止したファイルの復旧テスト"""
+
+    @pytest.fixture
+    def recovery_env(self, temp_db, tmp_path):
+        """一時DBを参照するキューモードの復旧サービス"""
+        from src.api.services.pdf_service import PDFService
+        from src.api.services.recovery_service import RecoveryService
+
+        with patch("src.api.services.pdf_service.db_manager", temp_db), \
+             patch("src.api.services.recovery_service.db_manager", temp_db):
+            pdf_service = PDFService(
+                upload_dir=str(tmp_path / "uploads"),
+                markdown_dir=str(tmp_path / "markdown"),
+                conversion_mode="queue"
+            )
+            yield temp_db, RecoveryService(pdf_service, stale_seconds=60, max_attempts=2)
+
+    def _insert_stale(self, db, file_id, original_path, attempts=0):
+        """1時間前から PROCESSING のままのファイルを登録"""
+        import sqlite3
+        db.insert_file(file_id, "test.pdf", str(original_path), 10)
+        with sqlite3.connect(db.db_path) as conn:
+            conn.execute("""
+                UPDATE files SET updated_at = datetime('now', '-1 hour'),
+                                 conversion_attempts = ?
+                WHERE id = ?
+            """, (attempts, file_id))
+
+    def test_stale_file_is_requeued(self, recovery_env, tmp_path):
+        """放置されたファイルがキューに再投入されるテスト"""
+        from .helpers import load_test_pdf
+        db, recovery_service = recovery_env
+        original_path = tmp_path / "stale.pdf"
+        original_path.write_bytes(load_test_pdf())
+        self._insert_stale(db, "file-stale", original_path)
+
+        result = recovery_service.recover_stale_files()
+
+        assert result == {"stale_files": 1, "requeued": 1, "failed": 0}
+        assert db.get_file("file-stale")["conversion_attempts"] == 1
+        job = db.claim_conversion_job("worker", 30)
+        assert job["file_id"] == "file-stale"
+        assert job["action"] == "recover"
+        # 再投入済みのファイルは次の走査では対象外
+        assert recovery_service.recover_stale_files()["stale_files"] == 0
+
+    def test_file_over_max_attempts_is_failed(self, recovery_env, tmp_path):
+        """試行回数の上限に達したファイルが失敗になるテスト"""
+        db, recovery_service = recovery_env
+        original_path = tmp_path / "stale.pdf"
+        original_path.write_bytes(b"%PDF")
+        self._insert_stale(db, "file-stale", original_path, attempts=2)
+
+        result = recovery_service.recover_stale_files()
+
+        assert result["failed"] == 1
+        assert db.get_file("file-stale")["status"] == FileStatus.FAILED
+
+    def test_missing_original_is_failed(self, recovery_env, tmp_path):
+        """元のPDFが存在しないファイルが失敗になるテスト"""
+        db, recovery_service = recovery_env
+        self._insert_stale(db, "file-stale", tmp_path / "missing.pdf")
+
+        result = recovery_service.recover_stale_files()
+
+        assert result["failed"] == 1
+        assert db.get_file("file-stale")["status"] == FileStatus.FAILED
+
+    def test_recent_file_is_not_touched(self, recovery_env):
+        """処理開始直後のファイルは対象外であることのテスト"""
+        db, recovery_service = recovery_env
+        db.insert_file("file-fresh", "test.pdf", "missing.pdf", 10)
+
+        result = recovery_service.recover_stale_files()
+
+        assert result["stale_files"] == 0
+        assert db.get_file("file-fresh")["status"] == FileStatus.PROCESSING
+
+    def test_heartbeat_keeps_inline_conversion_alive(self, recovery_env, tmp_path):
+        """他のプロセスがハートビートを送っているインライン変換は対象外であることのテスト"""
+        from src.api.services.recovery_service import RecoveryService
+        db, recovery_service = recovery_env
+        original_path = tmp_path / "stale.pdf"
+        original_path.write_bytes(b"%PDF")
+        self._insert_stale(db, "file-busy", original_path, attempts=2)
+
+        # 別プロセスのSJFスケジューラで待機中の変換
+        other = RecoveryService(MagicMock(), stale_seconds=60)
+        other.pdf_service.active_conversion_ids.return_value = ["file-busy", "file-missing"]
+        assert other.heartbeat() == 1
+
+        result = recovery_service.recover_stale_files()
+
+        assert result["stale_files"] == 0
+        file_info = db.get_file("file-busy")
+        assert file_info["status"] == FileStatus.PROCESSING
+        assert file_info["conversion_attempts"] == 2
+
+    def test_recovery_skips_file_heartbeated_after_scan(self, recovery_env, tmp_path):
+        """走査後にハートビートが更新されたファイルは復旧しないことのテスト"""
+        import sqlite3
+        db, recovery_service = recovery_env
+        original_path = tmp_path / "stale.pdf"
+        original_path.write_bytes(b"%PDF")
+        self._insert_stale(db, "file-busy", original_path)
+        stale = db.find_stale_processing_files(60)
+
+        with sqlite3.connect(db.db_path) as conn:
+            conn.execute("UPDATE files SET heartbeat_at = CURRENT_TIMESTAMP WHERE id = 'file-busy'")
+
+        assert not db.mark_recovery_attempt(
+            "file-busy", stale[0]["updated_at"], stale[0]["heartbeat_at"]
+        )
+        assert db.get_file("file-busy")["conversion_attempts"] == 0
+
+
+# ===============================
+# 保存先レイアウト移行のテスト
+# ===============================
+
+class TestLayoutMigration:
+    """フラットな保存先から分散レイアウトへの移行テスト"""
+
+    @pytest.fixture
+    def migration_env(self, temp_db, tmp_path):
+        """一時DB・一時ブロブストアを使う移行サービス"""
+        from src.api.services.blob_store import BlobStore
+        from src.api.services.layout_migration_service import LayoutMigrationService
+        from src.api.services.pdf_service import PDFService
+
+        store = BlobStore(str(tmp_path / "blobs"))
+        with patch("src.api.services.layout_migration_service.db_manager", temp_db), \
+             patch("src.api.services.layout_migration_service.blob_store", store):
+            pdf_service = PDFService(
+                upload_dir=str(tmp_path / "uploads"),
+                markdown_dir=str(tmp_path / "markdown")
+            )
+            yield temp_db, store, pdf_service, LayoutMigrationService(pdf_service, batch_size=1)
+
+    def _insert_legacy(self, db, pdf_service, file_id, content, record_markdown_path=True):
+        """旧レイアウトで保存されたファイルを登録"""
+        original_path = pdf_service.upload_dir / f"{file_id}_test.pdf"
+        original_path.write_bytes(content)
+        markdown_path = pdf_service.markdown_dir / f"{file_id}.md"
+        markdown_path.write_text(f"# {file_id}", encoding="utf-8")
+        db.insert_file(file_id, "test.pdf", str(original_path), len(content))
+        if record_markdown_path:
+            db.update_file_status(file_id, FileStatus.COMPLETED, f"# {file_id}",
+                                  markdown_path=str(markdown_path))
+        return original_path, markdown_path
+
+    def test_migrate_moves_files_in_batches(self, migration_env):
+        """既存のPDFとMarkdownが新しいレイアウトに移るテスト"""
+        db, store, pdf_service, service = migration_env
+        old_pdf_1, old_md_1 = self._insert_legacy(db, pdf_service, "file-1", b"%PDF same")
+        old_pdf_2, old_md_2 = self._insert_legacy(db, pdf_service, "file-2", b"%PDF same",
+                                                  record_markdown_path=False)
+
+        totals = service.migrate()
+
+        assert totals["markdown_moved"] == 2
+        assert totals["uploads_moved"] == 2
+        assert totals["errors"] == 0
+        for file_id, old_pdf, old_md in (("file-1", old_pdf_1, old_md_1),
+                                         ("file-2", old_pdf_2, old_md_2)):
+            file_info = db.get_file(file_id)
+            assert file_info["markdown_path"] == str(pdf_service.markdown_path_for(file_id))
+            assert Path(file_info["markdown_path"]).read_text(encoding="utf-8") == f"# {file_id}"
+            assert file_info["original_path"] == str(store.path_for(store.digest(b"%PDF same")))
+            assert not old_pdf.exists()
+            assert not old_md.exists()
+        # 同じ内容のPDFは1つのブロブにまとまる
+        assert db.get_blob_statistics() == {"blob_count": 1, "reference_count": 2}
+        # 2回目は何もしない
+        assert service.migrate()["markdown_moved"] == 0
+
+    def test_reconverted_file_is_not_overwritten(self, migration_env):
+        """移行中に保存先が変わったファイルは切り替えないテスト"""
+        db, store, pdf_service, service = migration_env
+        _, old_md = self._insert_legacy(db, pdf_service, "file-1", b"%PDF")
+        row = db.list_file_locations()[0]
+        # 行を読んだ後に再変換された
+        new_path = pdf_service._save_markdown("file-1", "# reconverted")
+        db.update_file_status("file-1", FileStatus.COMPLETED, "# reconverted", markdown_path=new_path)
+
+        assert service._migrate_markdown(row) is False
+        assert Path(new_path).read_text(encoding="utf-8") == "# reconverted"
+        assert old_md.exists()
+
+
+# ===============================
+# ディスク整合性チェックのテスト
+# ===============================
+
+class TestReconcileService:
+    """参照されていないファイルの検出・削除のテスト"""
+
+    @pytest.fixture
+    def reconcile_env(self, temp_db, tmp_path):
+        """一時DB・一時ディレクトリを走査する整合性チェック"""
+        from src.api.services.blob_store import BlobStore
+        from src.api.services.pdf_service import PDFService
+
+        store = BlobStore(str(tmp_path / "uploads" / "blobs"))
+        with patch("src.api.services.reconcile_service.db_manager", temp_db), \
+             patch("src.api.services.reconcile_service.blob_store", store):
+            pdf_service = PDFService(
+                upload_dir=str(tmp_path / "uploads"),
+                markdown_dir=str(tmp_path / "markdown")
+            )
+            yield temp_db, store, pdf_service
+
+    @staticmethod
+    def _age(*paths):
+        """ファイルを2時間前に書き込まれたことにする"""
+        import os
+        import time
+        old = time.time() - 7200
+        for path in paths:
+            os.utime(path, (old, old))
+
+    def test_reports_and_deletes_orphans(self, reconcile_env):
+        """参照されていない古いファイルだけが削除されるテスト"""
+        from src.api.services.reconcile_service import ReconcileService
+        db, store, pdf_service = reconcile_env
+
+        with store.lock():
+            digest = store.put(b"%PDF referenced")
+            orphan_digest = store.put(b"%PDF orphan")
+        db.insert_file("file-1", "a.pdf", str(store.path_for(digest)), 15, blob_digest=digest)
+        markdown_path = pdf_service._save_markdown("file-1", "# a")
+        db.update_file_status("file-1", FileStatus.COMPLETED, "# a", markdown_path=markdown_path)
+        orphan_upload = pdf_service.upload_dir / "leftover_a.pdf"
+        orphan_upload.write_bytes(b"%PDF")
+        orphan_markdown = pdf_service.markdown_dir / "deleted-file.md"
+        orphan_markdown.write_text("# gone", encoding="utf-8")
+        fresh_upload = pdf_service.upload_dir / "just_written.pdf"
+        fresh_upload.write_bytes(b"%PDF")
+        self._age(store.path_for(digest), store.path_for(orphan_digest), markdown_path,
+                  orphan_upload, orphan_markdown)
+
+        report = ReconcileService(pdf_service).reconcile()
+        assert report["orphans"] == 3
+        assert report["deleted"] == 0
+        assert orphan_upload.exists()
+
+        result = ReconcileService(pdf_service, delete=True, max_deletes_per_second=0).reconcile()
+        assert result["deleted"] == 3
+        assert not orphan_upload.exists()
+        assert not orphan_markdown.exists()
+        assert not store.path_for(orphan_digest).exists()
+        assert store.path_for(digest).exists()
+        assert Path(markdown_path).exists()
+        assert fresh_upload.exists()
+
+    def test_reuploaded_blob_is_kept(self, reconcile_env):
+        """走査後に参照されたブロブは削除されないテスト"""
+        from src.api.services.reconcile_service import ReconcileService
+        db, store, pdf_service = reconcile_env
+        with store.lock():
+            digest = store.put(b"%PDF")
+        db.insert_file("file-1", "a.pdf", str(store.path_for(digest)), 4, blob_digest=digest)
+
+        assert ReconcileService(pdf_service)._remove_orphan(str(store.path_for(digest))) is False
+        assert store.path_for(digest).exists()
+
+
+class TestArchiveService:
+    """パックファイルへのアーカイブのテスト"""
+
+    @pytest.fixture
+    def archive_env(self, temp_db, tmp_path):
+        """一時DB・一時ディレクトリを使うアーカイブサービス"""
+        from src.api.services.archive_service import ArchiveService
+        from src.api.services.blob_store import BlobStore
+
+        store = BlobStore(str(tmp_path / "blobs"))
+        with patch("src.api.services.archive_service.db_manager", temp_db), \
+             patch("src.api.services.archive_service.blob_store", store):
+            yield temp_db, ArchiveService(str(tmp_path / "archive"), pack_size=1024 * 1024)
+
+    @staticmethod
+    def _add_file(db, tmp_path, file_id, updated_at="2020-01-01 00:00:00"):
+        original = tmp_path / f"{file_id}.pdf"
+        original.write_bytes(b"%PDF " + file_id.encode())
+        db.insert_file(file_id, f"{file_id}.pdf", str(original), 10)
+        db.update_file_status(file_id, FileStatus.COMPLETED, f"# {file_id}\n\n本文")
+        db.add_conversion_log(file_id, "convert", "completed", "ok")
+        with db._connect() as conn:
+            conn.execute("UPDATE files SET updated_at = ? WHERE id = ?", (updated_at, file_id))
+        return original
+
+    def test_cold_files_are_moved_to_packfile(self, archive_env, tmp_path):
+        """古いファイルだけがパックファイルへ移され、読み出せるテスト"""
+        db, service = archive_env
+        original = self._add_file(db, tmp_path, "cold-1")
+        self._add_file(db, tmp_path, "hot-1", updated_at="2999-01-01 00:00:00")
+
+        result = service.archive_cold_files(days=30)
+
+        assert result["archived_count"] == 1
+        assert db.get_file("cold-1") is None
+        assert db.get_conversion_logs("cold-1") == []
+        assert not original.exists()
+        assert db.get_file("hot-1") is not None
+
+        archived = service.get_file("cold-1")
+        assert archived["markdown_content"] == "# cold-1\n\n本文"
+        assert archived["updated_at"] == "2020-01-01 00:00:00"
+        assert service.get_original("cold-1") == b"%PDF cold-1"
+        assert db.get_archive_statistics() == {
+            "files": 1, "packs": 1, "size_bytes": db.get_archived_file("cold-1")["length"]
+        }
+
+    def test_packfile_is_rotated(self, archive_env, tmp_path):
+        """パックファイルが上限を超えると次のファイルに切り替わるテスト"""
+        db, service = archive_env
+        service.pack_size = 1
+        for file_id in ("cold-1", "cold-2"):
+            self._add_file(db, tmp_path, file_id)
+
+        assert service.archive_cold_files(days=30)["archived_count"] == 2
+        assert {db.get_archived_file(file_id)["pack"] for file_id in ("cold-1", "cold-2")} == {
+            "pack-000001.pack", "pack-000002.pack"
+        }
+        assert service.get_file("cold-2")["id"] == "cold-2"
+
+    def test_file_updated_while_archiving_is_kept(self, archive_env, tmp_path):
+        """パックファイルへの書き込み中に更新されたファイルは移さないテスト"""
+        db, service = archive_env
+        self._add_file(db, tmp_path, "cold-1")
+        append = service._append
+
+        def append_then_update(record):
+            location = append(record)
+            db.update_file_status("cold-1", FileStatus.COMPLETED, "# 更新")
+            return location
+
+        with patch.object(service, "_append", side_effect=append_then_update):
+            assert service.archive_file("cold-1") is False
+        assert db.get_file("cold-1")["markdown_content"] == "# 更新"
+        assert db.get_archived_file("cold-1") is None
+
+    def test_version_history_moves_into_packfile(self, archive_env, tmp_path):
+        """版の履歴がパックファイルへ移り、DB から削除されるテスト"""
+        db, service = archive_env
+        self._add_file(db, tmp_path, "cold-1")
+        for body in ("# cold-1\n\n本文2", "# cold-1\n\n本文3"):
+            db.update_file_status("cold-1", FileStatus.COMPLETED, body)
+        with db._connect() as conn:
+            conn.execute("UPDATE files SET updated_at = '2020-01-01 00:00:00' WHERE id = 'cold-1'")
+
+        assert service.archive_cold_files(days=30)["archived_count"] == 1
+        with db._connect() as conn:
+            assert conn.execute("SELECT COUNT(*) FROM file_versions").fetchone()[0] == 0
+
+        assert [row["version"] for row in service.list_file_versions("cold-1")] == [1, 2, 3]
+        assert service.get_file_version("cold-1", 1)["markdown_content"] == "# cold-1\n\n本文"
+        with patch("src.api.services.file_service.db_manager", db), \
+             patch("src.api.services.file_service.archive_service", service):
+            diff = FileService().diff_versions("cold-1", 1, 3)
+            text = b"".join(diff["chunks"]).decode("utf-8")
+            assert "-本文\n" in text and "+本文3\n" in text
+            assert FileService().get_file_version("cold-1", 2)["markdown"] == "# cold-1\n\n本文2"
+
+    def test_version_added_while_archiving_is_kept(self, archive_env, tmp_path):
+        """レコードに書いた後に版が増えたファイルは移さないテスト"""
+        db, service = archive_env
+        self._add_file(db, tmp_path, "cold-1")
+        append = service._append
+
+        def append_then_add_version(record):
+            location = append(record)
+            with db._connect() as conn:
+                conn.execute("""
+                    INSERT INTO file_versions (file_id, version, kind, payload, content_hash, size)
+                    VALUES ('cold-1', 1, 'snapshot', '# 古い本文', 'hash', 10)
+                """)
+                conn.commit()
+            return location
+
+        with patch.object(service, "_append", side_effect=append_then_add_version):
+            assert service.archive_file("cold-1") is False
+        assert db.get_archived_file("cold-1") is None
+        assert db.get_file("cold-1") is not None
+
+    def test_file_service_reads_archived_file(self, archive_env, tmp_path):
+        """FileService がアーカイブ済みファイルを返すテスト"""
+        db, service = archive_env
+        self._add_file(db, tmp_path, "cold-1")
+        service.archive_cold_files(days=30)
+
+        with patch("src.api.services.file_service.db_manager", db), \
+             patch("src.api.services.file_service.archive_service", service):
+            file_service = FileService()
+            file_data = file_service.get_file("cold-1")
+            assert file_data["markdown"] == "# cold-1\n\n本文"
+            assert file_data["etag"] == file_service.get_file_etag("cold-1")
+
+
+class TestBackupService:
+    """オンラインバックアップのテスト"""
+
+    @pytest.fixture
+    def backup_env(self, temp_db, tmp_path):
+        """一時DB・一時ディレクトリを使うバックアップサービス"""
+        from src.api.services.archive_service import ArchiveService
+        from src.api.services.backup_service import BackupService
+        from src.api.services.pdf_service import PDFService
+
+        archive = ArchiveService(str(tmp_path / "archive"))
+        with patch("src.api.services.backup_service.db_manager", temp_db), \
+             patch("src.api.services.backup_service.archive_service", archive), \
+             patch("src.api.services.pdf_service.db_manager", temp_db):
+            pdf_service = PDFService(
+                upload_dir=str(tmp_path / "uploads"),
+                markdown_dir=str(tmp_path / "markdown")
+            )
+            original = pdf_service.upload_dir / "file-1.pdf"
+            original.write_bytes(b"%PDF original")
+            temp_db.insert_file("file-1", "a.pdf", str(original), 13)
+            markdown_path = pdf_service._save_markdown("file-1", "# 変換前")
+            temp_db.update_file_status("file-1", FileStatus.COMPLETED, "# 変換前",
+                                       markdown_path=markdown_path)
+            yield temp_db, pdf_service, BackupService(str(tmp_path / "backups"), pages=1)
+
+    @staticmethod
+    def _snapshot_file(result, path):
+        return Path(result["path"]) / "files" / Path(path).relative_to("/")
+
+    def test_snapshot_contains_database_and_files(self, backup_env):
+        """DBと参照されているファイルがスナップショットに含まれるテスト"""
+        import json
+        from src.api.database import DatabaseManager
+        db, pdf_service, service = backup_env
+
+        result = service.create_snapshot("snap")
+
+        snapshot_db = DatabaseManager(str(Path(result["path"]) / "database.db"))
+        file_info = snapshot_db.get_file("file-1")
+        assert file_info["markdown_content"] == "# 変換前"
+        assert self._snapshot_file(result, file_info["original_path"]).read_bytes() == b"%PDF original"
+        assert self._snapshot_file(result, file_info["markdown_path"]).read_text(encoding="utf-8") == "# 変換前"
+        manifest = json.loads((Path(result["path"]) / "manifest.json").read_text(encoding="utf-8"))
+        assert manifest["files"] == 1
+        assert manifest["missing"] == 0
+        assert not (service.backup_dir / "snap.partial").exists()
+
+    def test_writes_during_backup_are_not_blocked(self, backup_env):
+        """コピー中の書き込みが待たされず、スナップショットに含まれないテスト"""
+        from src.api.database import DatabaseManager
+        db, pdf_service, service = backup_env
+        for index in range(200):
+            db.add_conversion_log("file-1", "convert", "completed", "x" * 500)
+        written = []
+
+        def write_between_steps(seconds):
+            written.append(db.insert_file(f"during-{len(written)}", "b.pdf", "b.pdf", 1))
+
+        service.pause_seconds = 0.001
+        with patch("src.api.database.time.sleep", side_effect=write_between_steps):
+            result = service.create_snapshot("snap")
+
+        assert written and all(written)
+        assert result["database_pages"] > 1
+        snapshot_db = DatabaseManager(str(Path(result["path"]) / "database.db"))
+        assert snapshot_db.get_file("during-0") is None
+        assert db.get_file("during-0") is not None
+
+    def test_markdown_rewritten_after_snapshot_matches_database(self, backup_env):
+        """DBのコピー後に書き換えられたMarkdownはスナップショットの本文で保存されるテスト"""
+        db, pdf_service, service = backup_env
+        backup_to = db.backup_to
+
+        def backup_then_reconvert(*args, **kwargs):
+            progress = backup_to(*args, **kwargs)
+            pdf_service._save_markdown("file-1", "# 変換後")
+            db.update_file_status("file-1", FileStatus.COMPLETED, "# 変換後")
+            return progress
+
+        with patch.object(db, "backup_to", side_effect=backup_then_reconvert):
+            result = service.create_snapshot("snap")
+
+        markdown_path = db.get_file("file-1")["markdown_path"]
+        assert result["markdown_rewritten"] == 1
+        assert self._snapshot_file(result, markdown_path).read_text(encoding="utf-8") == "# 変換前"
+        assert Path(markdown_path).read_text(encoding="utf-8") == "# 変換後"
+
+
+class TestMaintenanceService:
+    """DBメンテナンスのテスト"""
+
+    def test_run_step_reclaims_pages_and_optimizes(self, temp_db):
+        """1ステップで空きページを返し、初回は統計を更新するテスト"""
+        from src.api.services.maintenance_service import MaintenanceService
+
+        for index in range(50):
+            temp_db.insert_file(f"file-{index}", "a.pdf", "a.pdf", 1)
+            temp_db.update_file_status(f"file-{index}", FileStatus.COMPLETED, "本文" * 2000)
+        temp_db.delete_files([f"file-{index}" for index in range(50)])
+
+        with patch("src.api.services.maintenance_service.db_manager", temp_db):
+            service = MaintenanceService(step_pages=5, idle_seconds=0)
+            first = service.run_step()
+            second = service.run_step()
+            status = service.get_status()
+
+        assert first["pages_reclaimed"] == 5
+        assert first["optimized"] and first["analyzed"]
+        assert not second["optimized"]
+        assert status["pages_reclaimed"] == 10
+        assert status["vacuum_steps"] == 2
+        assert status["storage"]["freelist_count"] > 0
+
+    def test_not_idle_after_activity(self):
+        """リクエスト直後はアイドルとみなさないテスト"""
+        from src.api.services.maintenance_service import MaintenanceService
+
+        service = MaintenanceService(idle_seconds=60)
+        service.record_activity()
+        assert service.is_idle() is False
+        service.idle_seconds = 0
+        assert service.is_idle() is True
+
+
+# ===============================
+# 変換キャンセルのテスト
+# ===============================
+
+class TestConversionCancellation:
+    """古くなった変換のキャンセルのテスト"""
+
+    @pytest.fixture
+    def inline_env(self, temp_db, tmp_path):
+        """一時DBと2ワーカーのスケジューラを使うPDFService"""
+        from src.api.services.pdf_service import PDFService
+        from src.api.services.conversion_scheduler import ConversionScheduler
+
+        with patch("src.api.services.pdf_service.db_manager", temp_db), \
+             patch("src.api.services.pdf_service.conversion_scheduler",
+                   ConversionScheduler(max_workers=2)):
+            pdf_service = PDFService(
+                upload_dir=str(tmp_path / "uploads"),
+                markdown_dir=str(tmp_path / "markdown"),
+                conversion_mode="inline"
+            )
+            yield temp_db, pdf_service
+
+    def test_scheduler_skips_cancelled_job(self):
+        """待機中にキャンセルされたジョブが実行されないテスト"""
+        import threading
+        from src.api.services.conversion_scheduler import (
+            ConversionScheduler, ConversionCancelled, JobEstimate
+        )
+
+        scheduler = ConversionScheduler(max_workers=1)
+        cancel_event = threading.Event()
+        cancel_event.set()
+        calls = []
+
+        future = scheduler.submit(
+            calls.append, "ran", estimate=JobEstimate(1, 0, 0.0), cancel_event=cancel_event
+        )
+
+        with pytest.raises(ConversionCancelled):
+            future.result(timeout=5)
+        assert calls == []
+
+    @pytest.mark.asyncio
+    async def test_newer_update_supersedes_running_conversion(self, inline_env):
+        """新しいPUTが実行中の古い変換をキャンセルするテスト"""
+        import asyncio
+        import threading
+        from .helpers import load_test_pdf
+
+        db, pdf_service = inline_env
+        db.insert_file("file-1", "test.pdf", "old.pdf", 10)
+        started = threading.Event()
+        gate = threading.Event()
+        calls = []
+
+        def fake_convert(file_path, cancel_event=None):
+            calls.append(file_path)
+            if len(calls) == 1:
+                started.set()
+                gate.wait(5)
+                return "# old"
+            return "# new"
+
+        pdf_content = load_test_pdf()
+        with patch.object(pdf_service, "_convert_pdf_to_markdown", side_effect=fake_convert):
+            first = asyncio.create_task(
+                pdf_service.reconvert_pdf("file-1", pdf_content, "first.pdf")
+            )
+            while not started.is_set():
+                await asyncio.sleep(0.01)
+
+            second = await pdf_service.reconvert_pdf("file-1", pdf_content, "second.pdf")
+            gate.set()
+            first_result = await first
+
+        assert second["success"] is True
+        assert first_result["success"] is False
+        assert first_result["cancelled"] is True
+        file_info = db.get_file("file-1")
+        assert file_info["markdown_content"] == "# new"
+        assert file_info["filename"] == "second.pdf"
+        assert file_info["status"] == FileStatus.COMPLETED
+        assert not pdf_service.is_converting("file-1")
+
+    def test_cancel_conversion_cancels_queued_jobs(self, inline_env):
+        """削除時にキュー上のジョブがキャンセルされるテスト"""
+        db, pdf_service = inline_env
+        db.insert_file("file-1", "test.pdf", "old.pdf", 10)
+        db.enqueue_conversion_job("file-1", "upload_and_convert", 1.0)
+
+        assert pdf_service.cancel_conversion("file-1") is True
+        assert db.claim_conversion_job("worker", 30) is None
+        assert pdf_service.cancel_conversion("file-1") is False
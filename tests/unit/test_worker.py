@@ -0,0 +1,160 @@
+import pytest
+from unittest.mock import patch
+
+from src.api.models import FileStatus
+from .helpers import load_test_pdf
+
+
+@pytest.fixture
+def queue_env(temp_db, tmp_path):
+    """一時DBを参照するキューモードのPDFServiceとワーカー"""
+    from src.api.services.pdf_service import PDFService
+    from src.api.worker import ConversionWorker
+
+    with patch("src.api.services.pdf_service.db_manager", temp_db), \
+         patch("src.api.worker.db_manager", temp_db):
+        pdf_service = PDFService(
+            upload_dir=str(tmp_path / "uploads"),
+            markdown_dir=str(tmp_path / "markdown"),
+            conversion_mode="queue"
+        )
+        worker = ConversionWorker(
+            worker_id="test-worker", lease_seconds=30, pdf_service=pdf_service
+        )
+        yield temp_db, pdf_service, worker
+
+
+class TestConversionWorker:
+    """変換ワーカーのテストクラス"""
+
+    @pytest.mark.asyncio
+    async def test_upload_is_queued_and_converted_by_worker(self, queue_env):
+        """キューモードのアップロードがワーカーで変換されるテスト"""
+        db, pdf_service, worker = queue_env
+
+        result = await pdf_service.process_pdf_upload(load_test_pdf(), "test_markdown.pdf")
+        assert result["success"] is True
+        assert result["status"] == FileStatus.PROCESSING
+        assert db.get_file(result["file_id"])["status"] == FileStatus.PROCESSING
+
+        assert worker.run_once() is True
+        assert worker.run_once() is False
+
+        file_info = db.get_file(result["file_id"])
+        assert file_info["status"] == FileStatus.COMPLETED
+        assert file_info["markdown_content"]
+
+    def test_job_over_max_attempts_is_failed(self, queue_env):
+        """最大試行回数を超えたジョブが失敗になるテスト"""
+        db, _, worker = queue_env
+        db.insert_file("file-1", "test.pdf", "missing.pdf", 10)
+        db.enqueue_conversion_job("file-1", "upload_and_convert", 1.0)
+
+        job = db.claim_conversion_job("test-worker", 30)
+        job["attempts"] = worker.max_attempts + 1
+        result = worker.process_job(job)
+
+        assert result["success"] is False
+        assert db.get_file("file-1")["status"] == FileStatus.FAILED
+
+    def test_result_is_discarded_when_lease_is_lost(self, queue_env):
+        """リースを失ったワーカーの変換結果が破棄されるテスト"""
+        _, pdf_service, _ = queue_env
+
+        with patch.object(pdf_service, "_convert_pdf_to_markdown", return_value="# stale"), \
+             patch.object(pdf_service, "_save_markdown") as mock_save:
+            result = pdf_service.convert_stored_file(
+                "file-1", "missing.pdf", "reconvert", is_current=lambda: False
+            )
+
+        assert result["discarded"] is True
+        mock_save.assert_not_called()
+
+
+class TestWorkerRecycling:
+    """ワーカーの入れ替えのテスト"""
+
+    def test_get_rss_bytes(self):
+        """RSSが取得できるテスト"""
+        from src.api.worker import get_rss_bytes
+
+        rss_bytes = get_rss_bytes()
+
+        assert rss_bytes is None or rss_bytes > 0
+
+    def test_get_rss_bytes_without_resource(self, monkeypatch):
+        """/proc も resource もない環境（Windows）では None を返すテスト"""
+        import builtins
+        from src.api import worker
+
+        real_open = builtins.open
+        def fail_proc(path, *args, **kwargs):
+            if str(path).startswith("/proc/"):
+                raise FileNotFoundError(path)
+            return real_open(path, *args, **kwargs)
+        monkeypatch.setattr(builtins, "open", fail_proc)
+        monkeypatch.setattr(worker, "resource", None)
+
+        assert worker.get_rss_bytes() is None
+
+    def test_recycle_after_max_jobs(self, queue_env):
+        """最大処理件数に達したワーカーが後継を要求するテスト"""
+        db, _, worker = queue_env
+        retired = []
+        worker.max_jobs = 2
+        worker.on_retire = lambda: retired.append(worker.worker_id)
+        db.insert_file("file-1", "test.pdf", "missing.pdf", 10)
+        db.insert_file("file-2", "test.pdf", "missing.pdf", 10)
+        db.enqueue_conversion_job("file-1", "upload_and_convert", 1.0)
+        db.enqueue_conversion_job("file-2", "upload_and_convert", 2.0)
+
+        with patch.object(worker.pdf_service, "_convert_pdf_to_markdown", return_value="# ok"):
+            worker.run_once()
+            assert retired == []
+            worker.run_once()
+
+        assert retired == [worker.worker_id]
+        assert worker.retiring is True
+        status = db.list_worker_status()[0]
+        assert status["state"] == "retiring"
+        assert status["jobs_done"] == 2
+        assert status["rss_bytes"] is None or status["rss_bytes"] > 0
+
+    def test_recycle_over_rss_without_supervisor_stops(self, queue_env):
+        """スーパーバイザーなしでRSS閾値を超えたワーカーが停止するテスト"""
+        _, _, worker = queue_env
+        worker.max_rss_bytes = 1
+
+        worker._check_recycle()
+
+        assert worker.retiring is True
+        assert worker._stop_event.is_set()
+
+    def test_supervisor_stops_old_worker_after_replacement_is_ready(self):
+        """後継の準備ができてから古いワーカーが停止されるテスト"""
+        from unittest.mock import MagicMock
+        from src.api.worker import WorkerSupervisor
+
+        supervisor = WorkerSupervisor(1, {})
+        old_stop = MagicMock()
+        supervisor._children["old"] = {
+            "process": MagicMock(), "stop_event": old_stop, "replaces": None, "retired": False
+        }
+
+        spawned = []
+        def fake_spawn(replaces=None):
+            spawned.append(replaces)
+            supervisor._children["new"] = {
+                "process": MagicMock(), "stop_event": MagicMock(),
+                "replaces": replaces, "retired": False
+            }
+            return "new"
+
+        with patch.object(supervisor, "_spawn", side_effect=fake_spawn):
+            supervisor._handle_message("retiring", "old")
+            assert spawned == ["old"]
+            old_stop.set.assert_not_called()
+
+            supervisor._handle_message("ready", "new")
+
+        old_stop.set.assert_called_once()